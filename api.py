@@ -44,6 +44,7 @@ except ImportError:
     WebhookHandler = None
 
 from main import LoanMoESystem
+from services.rag_service import rag_engine
 from config import (
     LINE_CHANNEL_ACCESS_TOKEN,
     LINE_CHANNEL_SECRET,
@@ -84,6 +85,9 @@ async def lifespan(app: FastAPI):
     loan_system = LoanMoESystem()
     logger.info("✅ Loan MoE System 初始化完成")
     
+    # 背景預熱 embedding 模型與 Vector Search，不阻塞啟動
+    rag_engine.warmup(background=True)
+    
     # 初始化 LINE Bot (如果有設定)
     if LINEBOT_AVAILABLE and LINE_CHANNEL_SECRET and LINE_CHANNEL_ACCESS_TOKEN:
         try:
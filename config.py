@@ -46,9 +46,9 @@ MOE_MODEL_PATH = os.path.join(BASE_DIR, 'moe', 'models', 'saved_moe_gating_model
 MAX_LEN = 64
 STRUCT_DIM = 7  # id, name, job, income, status_val, sparsity, risk_score
 
-# 標籤映射
-ID2LABEL = {0: "LDE", 1: "DVE", 2: "FRE"}
-LABEL2ID = {"LDE": 0, "DVE": 1, "FRE": 2}
+# 標籤映射 (id 為 0..N-1 連續整數，直接以 tuple 索引)
+ID2LABEL = ("LDE", "DVE", "FRE")
+LABEL2ID = {label: idx for idx, label in enumerate(ID2LABEL)}
 
 # 狀態映射
 STATUS_MAP = {
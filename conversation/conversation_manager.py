@@ -1,4 +1,5 @@
 import logging
+import time
 from typing import Dict, Any
 
 from .utils import normalize_tw_phone
@@ -31,6 +32,9 @@ class ConversationManager:
             }
         """
         
+        # 本輪所有 profile / history 寫入共用同一個時間戳
+        now = time.time()
+        
         # === 1️⃣ 載入當前狀態 ===
         state = self.session_mgr.get_profile()
         
@@ -51,8 +55,8 @@ class ConversationManager:
         
         logger.info(f"[Gemini Extracted]: {extracted}")
         
-        # === 4.5️⃣ 現在才把使用者輸入存入歷史 ===
-        self.session_mgr.add_message("user", user_input)
+        # === 4.5️⃣ 使用者輸入先暫存，與本輪回覆一起寫入歷史 (一次 round trip) ===
+        turn_messages = [{"role": "user", "content": user_input}]
         
         # === 5️⃣ 特殊欄位處理與驗證 ===
         validated_data = {}
@@ -88,7 +92,7 @@ class ConversationManager:
         
         # === 6️⃣ 更新 Profile ===
         if validated_data:
-            state = self.session_mgr.update_profile(validated_data)
+            state = self.session_mgr.update_profile(validated_data, now=now)
             logger.info(f"[Profile Updated]: {validated_data}")
         
         # === 7️⃣ 再次檢查缺少的欄位 ===
@@ -117,9 +121,10 @@ class ConversationManager:
             self.session_mgr.update_profile({
                 "last_asked_field": next_field,
                 "retry_count": retry_count
-            })
+            }, now=now)
             
-            self.session_mgr.add_message("assistant", question)
+            turn_messages.append({"role": "assistant", "content": question})
+            self.session_mgr.add_messages(turn_messages, now=now)
             
             return {
                 "status": "COLLECTING",
@@ -135,10 +140,11 @@ class ConversationManager:
         }
         
         # 更新狀態為 pending
-        self.session_mgr.update_profile({"verification_status": "pending"})
+        self.session_mgr.update_profile({"verification_status": "pending"}, now=now)
         
         completion_msg = "感謝您提供完整資訊！我們將為您進行評估。"
-        self.session_mgr.add_message("assistant", completion_msg)
+        turn_messages.append({"role": "assistant", "content": completion_msg})
+        self.session_mgr.add_messages(turn_messages, now=now)
         
         logger.info(f"✅ [Collection Complete] User: {user_id}")
         
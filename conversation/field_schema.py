@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 from typing import Any, Callable, Optional, Dict, List, Tuple
 
 
@@ -60,8 +61,9 @@ class Field:
         return True, None
 
     @staticmethod
+    @lru_cache(maxsize=1024)
     def _validate_phone(phone: str) -> bool:
-        """驗證台灣手機號碼"""
+        """驗證台灣手機號碼 (純函數，重試/確認流程常重複驗證同一值，故快取結果)"""
         digits = re.sub(r'\D', '', str(phone))
         
         if digits.startswith('886'):
@@ -70,6 +72,7 @@ class Field:
         return len(digits) == 10 and digits.startswith('09')
 
     @staticmethod
+    @lru_cache(maxsize=1024)
     def _validate_tw_id(id_str: str) -> bool:
         """驗證台灣身分證字號"""
         if not id_str or len(id_str) != 10:
@@ -134,26 +137,37 @@ class FieldSchema:
             )
         }
 
+        # 必填欄位依優先級預先排序 (欄位定義固定，只需排序一次)
+        self._sorted_required: Tuple[str, ...] = tuple(
+            f.name for f in sorted(self.fields.values(), key=lambda f: f.priority)
+            if f.required
+        )
+        self._required_set: frozenset = frozenset(self._sorted_required)
+
     def get_missing_fields(self, profile_state: Dict) -> List[str]:
         """
         取得缺少的必填欄位，並按優先級排序
         """
-        missing = []
-        
-        for k, field in self.fields.items():
-            value = profile_state.get(k)
-            
-            if field.required:
-                if value is None or value == "":
-                    missing.append(k)
+        # 新 session 第一輪 profile 為空，直接回傳全部必填欄位
+        if not profile_state:
+            return list(self._sorted_required)
         
-        missing.sort(key=lambda x: self.fields[x].priority)
+        # 一次走訪 profile 取得已填欄位，再用 set 差集求缺少欄位
+        missing_set = self._required_set - self._filled_keys(profile_state)
+        if not missing_set:
+            return []
         
-        return missing
+        # 依 _sorted_required 的順序輸出，保留優先級
+        return [k for k in self._sorted_required if k in missing_set]
 
     def all_required_filled(self, profile_state: Dict) -> bool:
         """檢查是否所有必填欄位都已填寫"""
-        return len(self.get_missing_fields(profile_state)) == 0
+        return self._required_set <= self._filled_keys(profile_state)
+
+    @staticmethod
+    def _filled_keys(profile_state: Dict) -> set:
+        """已填寫的欄位名稱 (None 與空字串視為未填)"""
+        return {k for k, v in profile_state.items() if v is not None and v != ""}
 
     def validate_all(self, profile_state: Dict) -> Dict:
         """驗證所有欄位"""
@@ -17,6 +17,38 @@ from config import GEMINI_API_KEY, GEMINI_MODEL_NAME
 client = genai.Client(api_key=GEMINI_API_KEY)
 logger = logging.getLogger(__name__)
 
+# 各欄位的問句 (standard / retry)，模組載入時建立一次
+_QUESTION_PROMPTS = {
+    "name": {
+        "standard": "請問您的姓名是?",
+        "retry": "不好意思，我需要確認您的完整姓名，請問該怎麼稱呼您?"
+    },
+    "id": {
+        "standard": "請問您的身分證字號是?",
+        "retry": "身分證字號格式似乎不太對，請您再確認一下(例如 A123456789):"
+    },
+    "phone": {
+        "standard": "請問您的手機號碼是?",
+        "retry": "手機號碼需要是 09 開頭的 10 碼數字，請您再提供一次:"
+    },
+    "loan_purpose": {
+        "standard": "請問您本次貸款的主要用途是?(例如:投資、購車、周轉)",
+        "retry": "了解。能請您再具體說明一下資金用途嗎?這有助於審核:"
+    },
+    "job": {
+        "standard": "請問您目前的職業是?",
+        "retry": "請問您的具體職稱或工作內容是?"
+    },
+    "income": {
+        "standard": "請問您每月大約收入是多少?(請以新台幣計算)",
+        "retry": "不好意思，我們需要一個具體的數字來評估額度，請問月薪大約是多少元?"
+    },
+    "amount": {
+        "standard": "請問您希望申請的貸款金額是多少?(請以新台幣計算)",
+        "retry": "請問您具體想貸多少金額呢?(例如:50萬元)"
+    }
+}
+
 
 class GeminiClient:
     """Gemini API 客戶端"""
@@ -29,39 +61,10 @@ class GeminiClient:
         """
         根據欄位產生問句，支援不同語氣變體
         """
-        prompts = {
-            "name": {
-                "standard": "請問您的姓名是?",
-                "retry": "不好意思，我需要確認您的完整姓名，請問該怎麼稱呼您?"
-            },
-            "id": {
-                "standard": "請問您的身分證字號是?",
-                "retry": "身分證字號格式似乎不太對，請您再確認一下(例如 A123456789):"
-            },
-            "phone": {
-                "standard": "請問您的手機號碼是?",
-                "retry": "手機號碼需要是 09 開頭的 10 碼數字，請您再提供一次:"
-            },
-            "loan_purpose": {
-                "standard": "請問您本次貸款的主要用途是?(例如:投資、購車、周轉)",
-                "retry": "了解。能請您再具體說明一下資金用途嗎?這有助於審核:"
-            },
-            "job": {
-                "standard": "請問您目前的職業是?",
-                "retry": "請問您的具體職稱或工作內容是?"
-            },
-            "income": {
-                "standard": "請問您每月大約收入是多少?(請以新台幣計算)",
-                "retry": "不好意思，我們需要一個具體的數字來評估額度，請問月薪大約是多少元?"
-            },
-            "amount": {
-                "standard": "請問您希望申請的貸款金額是多少?(請以新台幣計算)",
-                "retry": "請問您具體想貸多少金額呢?(例如:50萬元)"
-            }
-        }
-
-        field_prompts = prompts.get(field_name, {})
-        return field_prompts.get(variant, field_prompts.get("standard", f"請提供 {field_name}"))
+        field_prompts = _QUESTION_PROMPTS.get(field_name)
+        if field_prompts is None:
+            return f"請提供 {field_name}"
+        return field_prompts.get(variant) or field_prompts["standard"]
 
     def extract_slots(self, user_input: str, missing_fields: list, history: list = None) -> dict:
         """
@@ -7,6 +7,7 @@ import redis
 import json
 import time
 import logging
+from types import MappingProxyType
 from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
@@ -16,6 +17,13 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import REDIS_HOST, REDIS_PORT, REDIS_DB, REDIS_PASSWORD, SESSION_TTL
 
+# orjson (Rust 實作) 直接輸出 UTF-8 bytes，中文內容序列化較快；未安裝時退回標準 json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # 設定 Logger
 logging.basicConfig(
     level=logging.INFO,
@@ -50,6 +58,20 @@ except redis.exceptions.ConnectionError as e:
     redis_client = None
 
 
+def _dumps(obj) -> bytes:
+    """序列化為 UTF-8 JSON (等同 json.dumps(..., ensure_ascii=False))"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _loads(data):
+    """反序列化 JSON，失敗時拋出 json.JSONDecodeError (orjson 的例外亦為其子類別)"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 # ==========================================
 # 👤 User Session Manager
 # ==========================================
@@ -60,7 +82,8 @@ class UserSessionManager:
     2. Conversation History (對話紀錄)
     """
 
-    DEFAULT_PROFILE = {
+    # 唯讀樣板: 新使用者 / 資料損毀時以 .copy() 產生新的 profile
+    DEFAULT_PROFILE = MappingProxyType({
         "name": None,
         "id": None,
         "phone": None,
@@ -74,7 +97,7 @@ class UserSessionManager:
         "verification_status": None,  # 新增: 追蹤驗證狀態
         "created_at": None,
         "updated_at": None
-    }
+    })
 
     def __init__(self, user_id: str):
         if not user_id:
@@ -98,10 +121,9 @@ class UserSessionManager:
             
             if not data:
                 logger.info(f"[Init Profile] User: {self.user_id}")
-                self._init_profile()
-                return self.DEFAULT_PROFILE.copy()
+                return self._init_profile()
             
-            profile = json.loads(data)
+            profile = _loads(data)
             
             # 確保所有欄位都存在
             for key in self.DEFAULT_PROFILE:
@@ -112,21 +134,27 @@ class UserSessionManager:
             
         except json.JSONDecodeError as e:
             logger.error(f"Profile JSON decode failed for {self.user_id}: {e}")
-            self._init_profile()
-            return self.DEFAULT_PROFILE.copy()
+            return self._init_profile()
             
         except Exception as e:
             logger.error(f"Failed to get profile for {self.user_id}: {e}")
             return self.DEFAULT_PROFILE.copy()
 
-    def update_profile(self, updates: Dict) -> Dict:
-        """更新部分欄位 (Partial Update)"""
+    def update_profile(self, updates: Dict, now: Optional[float] = None) -> Dict:
+        """
+        更新部分欄位 (Partial Update)
+        
+        now: 呼叫端同一輪請求共用的時間戳，未提供時才取 time.time()
+        """
+        if now is None:
+            now = time.time()
+
         try:
             current_profile = self.get_profile()
 
             if current_profile.get("created_at") is None:
-                current_profile["created_at"] = time.time()
-            current_profile["updated_at"] = time.time()
+                current_profile["created_at"] = now
+            current_profile["updated_at"] = now
 
             updated = False
             for k, v in updates.items():
@@ -139,8 +167,7 @@ class UserSessionManager:
                     logger.info(f"[Profile Update] {self.user_id}: {k} = {v}")
 
             if updated:
-                json_data = json.dumps(current_profile, ensure_ascii=False)
-                self._save_to_redis(self.profile_key, json_data)
+                self._save_to_redis(self.profile_key, _dumps(current_profile))
             
             return current_profile
 
@@ -148,51 +175,97 @@ class UserSessionManager:
             logger.error(f"Failed to update profile for {self.user_id}: {e}")
             return self.get_profile()
 
-    def _init_profile(self):
-        """初始化空的 Profile"""
+    def _init_profile(self) -> Dict:
+        """初始化空的 Profile，寫入 Redis 並回傳"""
         initial_data = self.DEFAULT_PROFILE.copy()
         initial_data["created_at"] = time.time()
         
-        self._save_to_redis(
-            self.profile_key,
-            json.dumps(initial_data, ensure_ascii=False)
-        )
+        self._save_to_redis(self.profile_key, _dumps(initial_data))
+        return initial_data
 
     # -------------------------
     # History Management
     # -------------------------
-    def add_message(self, role: str, content: str):
-        """新增對話紀錄"""
+    def add_message(self, role: str, content: str, now: Optional[float] = None):
+        """新增對話紀錄 (now 同 update_profile)"""
         if not content or not content.strip():
             return
 
-        msg = json.dumps({
+        msg = _dumps({
             "role": role,
             "content": content,
-            "timestamp": time.time()
-        }, ensure_ascii=False)
+            "timestamp": time.time() if now is None else now
+        })
 
         try:
-            pipe = redis_client.pipeline()
-            pipe.rpush(self.history_key, msg)
-            pipe.ltrim(self.history_key, -50, -1)
-            pipe.expire(self.history_key, SESSION_TTL)
-            pipe.execute()
-            
+            self._push_history(msg)
             logger.debug(f"[Message Added] {self.user_id} ({role}): {content[:50]}...")
             
         except Exception as e:
             logger.error(f"Failed to add message for {self.user_id}: {e}")
 
+    def add_messages(self, messages: List[Dict], now: Optional[float] = None):
+        """
+        批次新增對話紀錄 (now 同 update_profile)
+        
+        messages: [{"role": ..., "content": ...}, ...]
+        所有訊息以單一 RPUSH 寫入，整批只需一次 round trip
+        """
+        if now is None:
+            now = time.time()
+        encoded = [
+            _dumps({"role": m["role"], "content": m["content"], "timestamp": now})
+            for m in messages
+            if m.get("content") and m["content"].strip()
+        ]
+        if not encoded:
+            return
+
+        try:
+            self._push_history(*encoded)
+            logger.debug(f"[Messages Added] {self.user_id}: {len(encoded)} 筆")
+            
+        except Exception as e:
+            logger.error(f"Failed to add messages for {self.user_id}: {e}")
+
+    def _push_history(self, *encoded: bytes):
+        """RPUSH + LTRIM + EXPIRE 合併為一次 round trip (不需 MULTI/EXEC)"""
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.rpush(self.history_key, *encoded)
+        pipe.ltrim(self.history_key, -50, -1)
+        pipe.expire(self.history_key, SESSION_TTL)
+        pipe.execute()
+
     def get_history(self, limit: int = 10) -> List[Dict]:
-        """取得最近 N 筆對話紀錄"""
+        """
+        取得最近 N 筆對話紀錄
+
+        只向 Redis 取回尾端 limit 筆 (LRANGE key -limit -1)，
+        不會把整條 history list 傳回來再於 Python 端切片。
+        """
+        # limit <= 0 時 -limit 會變成 0 以上，LRANGE 將回傳整條 list
+        if limit <= 0:
+            return []
+
         try:
             msgs = redis_client.lrange(self.history_key, -limit, -1)
+            if not msgs:
+                return []
+            
+            # 快速路徑: 整批組成 JSON array，一次 C 層 decode
+            # (筆數不符代表某筆內容本身含逗號拼接，改走逐筆 decode)
+            try:
+                batch = _loads("[" + ",".join(msgs) + "]")
+                if len(batch) == len(msgs):
+                    return batch
+            except json.JSONDecodeError:
+                pass
             
+            # 有損毀的訊息時逐筆 decode，略過壞掉的那幾筆
             result = []
             for m in msgs:
                 try:
-                    result.append(json.loads(m))
+                    result.append(_loads(m))
                 except json.JSONDecodeError:
                     logger.warning(f"Skipping malformed message in history")
                     continue
@@ -209,11 +282,8 @@ class UserSessionManager:
     def clear_session(self):
         """清空該使用者的所有資料"""
         try:
-            pipe = redis_client.pipeline()
-            pipe.delete(self.profile_key)
-            pipe.delete(self.history_key)
-            pipe.delete(self.lock_key)
-            pipe.execute()
+            # 單一 DEL 指令刪除三個 key
+            redis_client.delete(self.profile_key, self.history_key, self.lock_key)
             
             logger.info(f"✅ Session cleared for {self.user_id}")
             
@@ -238,13 +308,11 @@ class UserSessionManager:
             logger.error(f"Failed to get session info: {e}")
             return {}
 
-    def _save_to_redis(self, key: str, value: str):
+    def _save_to_redis(self, key: str, value: bytes):
         """內部 helper: 寫入並重設 TTL"""
         try:
-            pipe = redis_client.pipeline()
-            pipe.set(key, value)
-            pipe.expire(key, SESSION_TTL)
-            pipe.execute()
+            # SET ... EX 一次寫入值與 TTL
+            redis_client.set(key, value, ex=SESSION_TTL)
             
         except Exception as e:
             logger.error(f"Redis write failed for {key}: {e}")
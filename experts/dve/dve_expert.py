@@ -34,11 +34,22 @@ from config import (
     DEVICE,
     ENABLE_FINETUNED_MODELS
 )
-from services.rag_service import rag_engine
+from services.rag_service import RagContext, rag_engine
 from experts.base import BaseExpert
+from text_utils import KeywordSet
 
 logger = logging.getLogger(__name__)
 
+# 規則式驗證: 不符項目數 (0 / 1 / 2 以上) → (風險等級, 回覆, 下一步)
+_RULE_RISK_TABLE = (
+    ("LOW", "資料驗證無誤,正在為您進行試算。", "TRANSFER_TO_FRE"),
+    ("MEDIUM", "資料已受理,將轉由人工覆核。", "TRANSFER_TO_FRE"),
+    ("HIGH", "系統偵測到您的資料與紀錄有多處不符,請說明。", "FORCE_LDE_CLARIFY"),
+)
+
+# 技術障礙關鍵字 (上傳失敗等)，命中時直接回覆排除方式
+TECH_KEYWORDS = KeywordSet(("傳不上", "失敗", "格式錯誤", "太慢", "當機", "無法"))
+
 
 class DVEExpert(BaseExpert):
     """
@@ -89,8 +100,7 @@ class DVEExpert(BaseExpert):
         logger.info(f"📍 DVE 處理: user_id={profile.get('id', 'UNKNOWN')}")
         
         # === 1. 技術障礙攔截 (Rule-based) ===
-        tech_keywords = ["傳不上", "失敗", "格式錯誤", "太慢", "當機", "無法"]
-        if any(k in query for k in tech_keywords):
+        if TECH_KEYWORDS.matches(query):
             logger.info("🛡️  DVE 偵測到技術問題")
             return {
                 "expert": "DVE (Tech Support)",
@@ -108,36 +118,13 @@ class DVEExpert(BaseExpert):
         # 從 MongoDB 撈取歷史紀錄
         history_records = rag_engine.get_user_history_by_id(user_id)
         
-        rag_context = {}
-        
         if history_records:
             logger.info(f"🔍 發現 {len(history_records)} 筆歷史紀錄")
             latest_record = history_records[-1]  # 取最新
-            meta = latest_record.get("metadata", {})
-            
-            # 直接從 Metadata 對應到 DVE 需要的 Key
-            rag_context = {
-                "檔案中紀錄職業": meta.get("hist_job", "無紀錄"),
-                "上次貸款資金用途": meta.get("hist_purpose", "無紀錄"),
-                "檔案中聯絡電話": meta.get("hist_phone", "無紀錄"),
-                "歷史違約紀錄": meta.get("default_record", "無"),
-                "檔案中服務公司名稱": meta.get("hist_company", "無紀錄"),
-                "檔案中年薪/月薪": str(meta.get("hist_income", "0")),
-                "信用報告查詢次數": str(meta.get("inquiry_count", "0")),
-                "地址變動次數": str(meta.get("addr_change_count", "0"))
-            }
+            rag_context = RagContext.from_metadata(latest_record.get("metadata", {}))
         else:
             logger.warning("⚠️  新用戶 (無歷史紀錄)")
-            rag_context = {
-                "檔案中紀錄職業": "無紀錄 (新戶)",
-                "上次貸款資金用途": "無紀錄",
-                "檔案中聯絡電話": "無紀錄",
-                "歷史違約紀錄": "無",
-                "檔案中服務公司名稱": "無紀錄",
-                "檔案中年薪/月薪": "0",
-                "信用報告查詢次數": "0",
-                "地址變動次數": "0"
-            }
+            rag_context = RagContext.new_user()
         
         # === 3. 組建 Input JSON ===
         # 提取變數以便後續存檔
@@ -159,7 +146,7 @@ class DVEExpert(BaseExpert):
                 "服務公司名稱": q_company,
                 "月薪": q_income
             },
-            "RAG 檢索的歷史數據 (Context) 擷取": rag_context
+            "RAG 檢索的歷史數據 (Context) 擷取": rag_context.as_dve_dict()
         }
         
         input_json_str = json.dumps(dve_input_data, ensure_ascii=False)
@@ -364,7 +351,7 @@ class DVEExpert(BaseExpert):
             "hist_phone": q_phone,
             "hist_purpose": q_purpose,
             "default_record": "無",
-            "inquiry_count": str(int(rag_context.get("信用報告查詢次數", "0")) + 1),
+            "inquiry_count": str(int(rag_context.inquiry_count) + 1),
             "last_risk_level": risk_level,
             "check_status": check_status
         }
@@ -416,33 +403,22 @@ class DVEExpert(BaseExpert):
         mismatches = []
         
         # 比對職業
-        hist_job = rag_context.get("檔案中紀錄職業", "")
+        hist_job = rag_context.job
         if hist_job != "無紀錄" and hist_job != "無紀錄 (新戶)" and hist_job != q_job:
             mismatches.append(f"職業不符 (歷史: {hist_job}, 口述: {q_job})")
         
         # 比對收入
-        hist_income = rag_context.get("檔案中年薪/月薪", "0")
+        hist_income = rag_context.income
         if hist_income != "0" and abs(int(hist_income) - int(q_income)) > int(q_income) * 0.2:
             mismatches.append(f"收入差異過大 (歷史: {hist_income}, 口述: {q_income})")
         
         # 比對電話
-        hist_phone = rag_context.get("檔案中聯絡電話", "")
+        hist_phone = rag_context.phone
         if hist_phone != "無紀錄" and hist_phone != q_phone:
             mismatches.append(f"電話不符 (歷史: {hist_phone}, 口述: {q_phone})")
         
-        # 判斷風險等級
-        if len(mismatches) >= 2:
-            risk_level = "HIGH"
-            user_res = "系統偵測到您的資料與紀錄有多處不符,請說明。"
-            next_step = "FORCE_LDE_CLARIFY"
-        elif len(mismatches) == 1:
-            risk_level = "MEDIUM"
-            user_res = "資料已受理,將轉由人工覆核。"
-            next_step = "TRANSFER_TO_FRE"
-        else:
-            risk_level = "LOW"
-            user_res = "資料驗證無誤,正在為您進行試算。"
-            next_step = "TRANSFER_TO_FRE"
+        # 判斷風險等級 (2 項以上不符皆視為 HIGH)
+        risk_level, user_res, next_step = _RULE_RISK_TABLE[min(len(mismatches), 2)]
         
         logger.info(f"🔧 規則式驗證結果: {risk_level}, 不符項目: {len(mismatches)}")
         
@@ -8,10 +8,12 @@ FRE Expert (Financial Risk Expert) - 最終風控專家
 - 應用安全鎖防止邏輯錯誤
 """
 
+import re
 import json
 import logging
 import time
 from datetime import datetime
+from enum import IntEnum
 from typing import Dict, List, Any, Tuple
 
 import sys
@@ -45,6 +47,94 @@ from services.rag_service import rag_engine
 
 logger = logging.getLogger(__name__)
 
+# 視為「未提供」的字串值 (frozenset: O(1) 成員檢查)
+_NULL_INT_VALUES = frozenset(("null", "資料不足", "", "None"))
+_NULL_STR_VALUES = frozenset(("null", "", "None"))
+
+# ==========================================
+# ⚖️ 決策類別
+# ==========================================
+class Decision(IntEnum):
+    """FRE 最終決策 (值即為下列各表的 index)"""
+    PASS = 0
+    REJECT = 1
+    ESCALATE = 2
+
+    @classmethod
+    def from_text(cls, text: str) -> "Decision":
+        """解析模型輸出的決策字串 (例: 核准_PASS)，無法辨識時視為轉介"""
+        if _PASS_RE.search(text):
+            return cls.PASS
+        if _REJECT_RE.search(text):
+            return cls.REJECT
+        return cls.ESCALATE
+
+    @property
+    def label(self) -> str:
+        return _DECISION_LABELS[self]
+
+
+_PASS_RE = re.compile("PASS|核准")
+_REJECT_RE = re.compile("REJECT|拒絕")
+
+# 依 Decision 索引: 決策字串 / 回覆樣板 / 下一步
+_DECISION_LABELS = ("核准_PASS", "拒絕_REJECT", "轉介審核_ESCALATE")
+_USER_MSGS = (
+    "恭喜！您的信用評分 ({credit_score}分) 符合標準。\n初審額度: {p_amount:,} 元",
+    "感謝申請。經綜合評估，暫時無法核貸。",
+    "申請已受理，將轉由人工覆核。",
+)
+_NEXT_STEPS = ("CASE_CLOSED_SUCCESS", "CASE_CLOSED_REJECT", "HUMAN_HANDOVER")
+
+
+# ==========================================
+# 🔒 安全鎖規則表
+# ==========================================
+# 條件 bit: 1 = DBR > 60, 2 = 信用分 < 650, 4 = 關鍵資料缺失
+# 優先順序: 資料缺失 > DBR > 信用分；值為 (決策, 修正說明, log 訊息) 或 None
+_GUARD_DBR = 1
+_GUARD_SCORE = 2
+_GUARD_MISSING = 4
+
+
+def _build_guard_table() -> Tuple:
+    table = []
+    for flags in range(8):
+        if flags & _GUARD_MISSING:
+            table.append(("轉介審核_ESCALATE", "(系統修正: 關鍵資料缺失)", "⚠️ FRE Guard: 攔截到資料缺失"))
+        elif flags & _GUARD_DBR:
+            table.append(("拒絕_REJECT", "(系統修正: DBR {dbr:.1f}% 過高)", "⚠️ FRE Guard: 攔截到高負債比"))
+        elif flags & _GUARD_SCORE:
+            table.append(("拒絕_REJECT", "(系統修正: 信用分不足)", "⚠️ FRE Guard: 攔截到低信用分"))
+        else:
+            table.append(None)
+    return tuple(table)
+
+
+_GUARD_TABLE = _build_guard_table()
+
+
+# ==========================================
+# 💰 財務指標
+# ==========================================
+LOAN_TERM_MONTHS = 84       # 7 年期
+LOAN_RATE = 0.03            # 總利息 3%
+DEFAULT_INCOME = 60000      # 收入缺失時的估算月薪
+
+
+def compute_metrics(p_income: int, p_amount: int) -> Tuple[int, int, float, int]:
+    """
+    計算 FRE 財務指標
+    
+    Returns:
+        (估算月薪, 月付金, DBR %, 信用分)
+    """
+    base_income = p_income if p_income > 0 else DEFAULT_INCOME
+    monthly_pay = int(p_amount * (1 + LOAN_RATE) / LOAN_TERM_MONTHS) if p_amount > 0 else 0
+    dbr = monthly_pay / base_income * 100
+    credit_score = 700 if base_income > 40000 else 600
+    return base_income, monthly_pay, dbr, credit_score
+
 
 class FREExpert(BaseExpert):
     """
@@ -72,14 +162,14 @@ class FREExpert(BaseExpert):
         
         def safe_int(val, default=0):
             try:
-                if val in [None, "null", "資料不足", "", "None"]:
+                if val is None or (isinstance(val, str) and val in _NULL_INT_VALUES):
                     return default
                 return int(float(val))
             except (ValueError, TypeError):
                 return default
 
         def safe_str(val, default="資料不足"):
-            if val in [None, "null", "", "None"]:
+            if val is None or (isinstance(val, str) and val in _NULL_STR_VALUES):
                 return default
             return str(val)
 
@@ -87,13 +177,7 @@ class FREExpert(BaseExpert):
         p_amount = safe_int(profile.get("amount"))
         p_job = safe_str(profile.get("job"))
         
-        h_income = p_income if p_income > 0 else 60000 
-        calc_base_income = p_income if p_income > 0 else h_income
-        
-        monthly_pay = int((p_amount * 1.03) / 84) if p_amount > 0 else 0
-        dbr = (monthly_pay / calc_base_income * 100) if calc_base_income > 0 else 0
-        
-        credit_score = 700 if calc_base_income > 40000 else 600
+        h_income, _, dbr, credit_score = compute_metrics(p_income, p_amount)
 
         current_time = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
         
@@ -235,39 +319,31 @@ class FREExpert(BaseExpert):
     def _apply_safety_guard(
         self, decision: str, p_income: int, p_job: str, dbr: float, credit_score: int
     ) -> Tuple[str, str]:
-        override_msg = ""
+        # 安全鎖只攔截核准決策
+        if Decision.from_text(decision) is not Decision.PASS:
+            return decision, ""
         
         missing_critical = (p_income == 0) or (p_job == "資料不足")
-        if missing_critical and ("PASS" in decision or "核准" in decision):
-            decision = "轉介審核_ESCALATE"
-            override_msg = "(系統修正: 關鍵資料缺失)"
-            logger.warning("⚠️ FRE Guard: 攔截到資料缺失")
-
-        elif dbr > 60 and ("PASS" in decision or "核准" in decision):
-            decision = "拒絕_REJECT"
-            override_msg = f"(系統修正: DBR {dbr:.1f}% 過高)"
-            logger.warning("⚠️ FRE Guard: 攔截到高負債比")
+        flags = (
+            (dbr > 60) * _GUARD_DBR
+            | (credit_score < 650) * _GUARD_SCORE
+            | missing_critical * _GUARD_MISSING
+        )
         
-        elif credit_score < 650 and ("PASS" in decision or "核准" in decision):
-            decision = "拒絕_REJECT"
-            override_msg = "(系統修正: 信用分不足)"
-            logger.warning("⚠️ FRE Guard: 攔截到低信用分")
-
-        return decision, override_msg
+        rule = _GUARD_TABLE[flags]
+        if rule is None:
+            return decision, ""
+        
+        decision, override_fmt, log_msg = rule
+        logger.warning(log_msg)
+        return decision, override_fmt.format(dbr=dbr)
 
     def _generate_response(
         self, decision: str, credit_score: int, p_amount: int
     ) -> Tuple[str, str]:
-        if "PASS" in decision or "核准" in decision:
-            user_msg = f"恭喜！您的信用評分 ({credit_score}分) 符合標準。\n初審額度: {p_amount:,} 元"
-            next_step = "CASE_CLOSED_SUCCESS"
-        elif "REJECT" in decision or "拒絕" in decision:
-            user_msg = "感謝申請。經綜合評估，暫時無法核貸。"
-            next_step = "CASE_CLOSED_REJECT"
-        else:
-            user_msg = "申請已受理，將轉由人工覆核。"
-            next_step = "HUMAN_HANDOVER"
-        return user_msg, next_step
+        kind = Decision.from_text(decision)
+        user_msg = _USER_MSGS[kind].format(credit_score=credit_score, p_amount=p_amount)
+        return user_msg, _NEXT_STEPS[kind]
     
     def _rule_based_decision(
         self, p_income: int, p_job: str, p_amount: int,
@@ -301,31 +377,22 @@ class FREExpert(BaseExpert):
         # === 決策邏輯 ===
         # 優先使用硬規則
         if dve_risk == "HIGH" or credit_score < 650 or dbr > 45:
-            decision = "拒絕_REJECT"
-            user_msg = "感謝申請。經綜合評估，暫時無法核貸。"
-            next_step = "CASE_CLOSED_REJECT"
+            kind = Decision.REJECT
         elif dve_risk == "MEDIUM" or dbr > 30:
-            decision = "轉介審核_ESCALATE"
-            user_msg = "申請已受理，將轉由人工覆核。"
-            next_step = "HUMAN_HANDOVER"
+            kind = Decision.ESCALATE
         else:
+            kind = Decision.PASS
             # 可參考 RAG 結果微調
             if rag_reference and rag_reference.get("approval_rate") is not None:
                 approval_rate = rag_reference["approval_rate"]
                 if approval_rate < 0.3:
                     # 相似案例核准率很低，謹慎處理
-                    decision = "轉介審核_ESCALATE"
-                    user_msg = "申請已受理，將轉由人工覆核。"
-                    next_step = "HUMAN_HANDOVER"
+                    kind = Decision.ESCALATE
                     logger.info(f"📚 RAG 影響決策: 相似案例核准率僅 {approval_rate:.0%}，轉人工")
-                else:
-                    decision = "核准_PASS"
-                    user_msg = f"恭喜！您的信用評分 ({credit_score}分) 符合標準。\n初審額度: {p_amount:,} 元"
-                    next_step = "CASE_CLOSED_SUCCESS"
-            else:
-                decision = "核准_PASS"
-                user_msg = f"恭喜！您的信用評分 ({credit_score}分) 符合標準。\n初審額度: {p_amount:,} 元"
-                next_step = "CASE_CLOSED_SUCCESS"
+        
+        decision = kind.label
+        user_msg = _USER_MSGS[kind].format(credit_score=credit_score, p_amount=p_amount)
+        next_step = _NEXT_STEPS[kind]
         
         logger.info(f"🔧 規則式決策結果: {decision}")
         
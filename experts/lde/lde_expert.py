@@ -7,8 +7,10 @@ LDE Expert (Loan Desk Expert) - 貸款徵審專家
 - Mode B (Guide): 使用 Gemini API 進行資料補強與引導
 """
 
+import re
 import json
 import logging
+from typing import Final
 from google import genai
 
 # 從上層導入
@@ -29,6 +31,7 @@ from config import (
     ENABLE_FINETUNED_MODELS
 )
 from llm_utils import LocalLLMManager
+from text_utils import KeywordSet
 from experts.base import BaseExpert
 
 logger = logging.getLogger(__name__)
@@ -36,6 +39,13 @@ logger = logging.getLogger(__name__)
 # 初始化 Gemini Client (模組層級,只初始化一次)
 gemini_client = genai.Client(api_key=GEMINI_API_KEY)
 
+# 諮詢關鍵字 (子字串比對，模組層級常數)
+CONSULT_KEYWORDS: Final[KeywordSet] = KeywordSet((
+    "多少", "利率", "什麼", "資格", "可以嗎",
+    "試算", "好過", "推薦", "怎麼", "如何",
+    "條件", "審核", "期限", "費用", "划算"
+))
+
 
 class LDEExpert(BaseExpert):
     """
@@ -110,24 +120,17 @@ class LDEExpert(BaseExpert):
             "consult" or "guide"
         """
         
-        # 計算已填寫欄位數
-        filled_count = sum(1 for v in profile.values() if v is not None)
-        
-        # 諮詢關鍵字
-        consult_keywords = [
-            "多少", "利率", "什麼", "資格", "可以嗎",
-            "試算", "好過", "推薦", "怎麼", "如何",
-            "條件", "審核", "期限", "費用", "划算"
-        ]
-        
-        is_consult_question = any(kw in query for kw in consult_keywords)
+        is_consult_question = CONSULT_KEYWORDS.matches(query)
         
         # === 決策邏輯 ===
         
         # 情況 1: 資料很少 (≤2) + 諮詢問題 → Consult
-        if filled_count <= 2 and is_consult_question:
-            logger.debug("決策: 資料少 + 諮詢問題 → Consult")
-            return "consult"
+        # (只有諮詢問題才需要已填寫欄位數；list.count 在 C 層計數 None)
+        if is_consult_question:
+            filled_count = len(profile) - list(profile.values()).count(None)
+            if filled_count <= 2:
+                logger.debug("決策: 資料少 + 諮詢問題 → Consult")
+                return "consult"
         
         # 情況 2: 狀態是 unknown/pending/mismatch → Guide (需要補資料)
         if verification_status in ["unknown", "pending", "mismatch"]:
@@ -377,8 +380,6 @@ User: {query}
             logger.debug(f"Gemini 原始輸出: {raw_output}")
             
             # === 解析 JSON ===
-            import re
-            
             # 清理 markdown code block
             clean_output = re.sub(r'```json\s*', '', raw_output)
             clean_output = re.sub(r'```\s*', '', clean_output)
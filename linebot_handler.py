@@ -43,6 +43,16 @@ except ImportError:
 # ==========================================
 # Flex Message Templates
 # ==========================================
+
+# 申請必填欄位數
+TOTAL_APPLICATION_FIELDS = 7
+
+# 完成度查表: 已填 N 欄 -> 百分比 (與 int(N / 7 * 100) 結果相同)
+_PROGRESS_TABLE = tuple(
+    i * 100 // TOTAL_APPLICATION_FIELDS for i in range(TOTAL_APPLICATION_FIELDS + 1)
+)
+
+
 class FlexTemplates:
     """LINE Flex Message 模板"""
     
@@ -139,9 +149,9 @@ class FlexTemplates:
     def application_progress(profile: dict, missing_fields: List[str]) -> dict:
         """申請進度模板"""
         # 計算完成度
-        total_fields = 7
-        filled_fields = total_fields - len(missing_fields)
-        progress_percent = int((filled_fields / total_fields) * 100)
+        filled_fields = TOTAL_APPLICATION_FIELDS - len(missing_fields)
+        filled_fields = min(max(filled_fields, 0), TOTAL_APPLICATION_FIELDS)
+        progress_percent = _PROGRESS_TABLE[filled_fields]
         
         # 欄位名稱映射
         field_names = {
@@ -205,7 +215,7 @@ class FlexTemplates:
                                 "layout": "horizontal",
                                 "contents": [
                                     {"type": "text", "text": f"完成度 {progress_percent}%", "size": "sm", "color": "#555555"},
-                                    {"type": "text", "text": f"{filled_fields}/{total_fields}", "size": "sm", "color": "#111111", "align": "end"}
+                                    {"type": "text", "text": f"{filled_fields}/{TOTAL_APPLICATION_FIELDS}", "size": "sm", "color": "#111111", "align": "end"}
                                 ]
                             },
                             {
@@ -482,108 +492,71 @@ class FlexTemplates:
 # ==========================================
 # Quick Reply Templates
 # ==========================================
+def _message_action_item(label: str, text: str) -> dict:
+    """建立快速回覆用的 message action"""
+    return {
+        "type": "action",
+        "action": {
+            "type": "message",
+            "label": label,
+            "text": text
+        }
+    }
+
+
+# 快速回覆內容固定不變，於 import 時建好一次
+# 每則訊息只需淺拷貝外層 list，不必重建巢狀 dict
+LOAN_PURPOSE_QUICK_REPLY = tuple(
+    _message_action_item(label, text)
+    for label, text in (
+        ("購車", "購車"),
+        ("房屋裝修", "房屋裝修"),
+        ("週轉金", "週轉金"),
+        ("教育", "教育支出"),
+        ("醫療", "醫療費用"),
+        ("其他", "其他用途")
+    )
+)
+
+AMOUNT_QUICK_REPLY = tuple(
+    _message_action_item(label, label)
+    for label in ("30萬", "50萬", "80萬", "100萬", "150萬", "其他金額")
+)
+
+YES_NO_QUICK_REPLY = (
+    _message_action_item("是", "是"),
+    _message_action_item("否", "否")
+)
+
+CONFIRM_QUICK_REPLY = (
+    _message_action_item("確認", "確認"),
+    _message_action_item("修改", "我要修改"),
+    _message_action_item("取消", "取消申請")
+)
+
+
 class QuickReplyTemplates:
     """快速回覆模板"""
     
     @staticmethod
     def loan_purpose_options() -> List[dict]:
         """貸款用途選項"""
-        purposes = [
-            ("購車", "購車"),
-            ("房屋裝修", "房屋裝修"),
-            ("週轉金", "週轉金"),
-            ("教育", "教育支出"),
-            ("醫療", "醫療費用"),
-            ("其他", "其他用途")
-        ]
-        
-        return [
-            {
-                "type": "action",
-                "action": {
-                    "type": "message",
-                    "label": label,
-                    "text": text
-                }
-            }
-            for label, text in purposes
-        ]
+        return list(LOAN_PURPOSE_QUICK_REPLY)
     
     @staticmethod
     def amount_options() -> List[dict]:
         """金額選項"""
-        amounts = [
-            ("30萬", "30萬"),
-            ("50萬", "50萬"),
-            ("80萬", "80萬"),
-            ("100萬", "100萬"),
-            ("150萬", "150萬"),
-            ("其他金額", "其他金額")
-        ]
-        
-        return [
-            {
-                "type": "action",
-                "action": {
-                    "type": "message",
-                    "label": label,
-                    "text": text
-                }
-            }
-            for label, text in amounts
-        ]
+        return list(AMOUNT_QUICK_REPLY)
     
     @staticmethod
     def yes_no_options() -> List[dict]:
         """是/否選項"""
-        return [
-            {
-                "type": "action",
-                "action": {
-                    "type": "message",
-                    "label": "是",
-                    "text": "是"
-                }
-            },
-            {
-                "type": "action",
-                "action": {
-                    "type": "message",
-                    "label": "否",
-                    "text": "否"
-                }
-            }
-        ]
+        return list(YES_NO_QUICK_REPLY)
     
     @staticmethod
     def confirm_options() -> List[dict]:
         """確認選項"""
-        return [
-            {
-                "type": "action",
-                "action": {
-                    "type": "message",
-                    "label": "確認",
-                    "text": "確認"
-                }
-            },
-            {
-                "type": "action",
-                "action": {
-                    "type": "message",
-                    "label": "修改",
-                    "text": "我要修改"
-                }
-            },
-            {
-                "type": "action",
-                "action": {
-                    "type": "message",
-                    "label": "取消",
-                    "text": "取消申請"
-                }
-            }
-        ]
+        return list(CONFIRM_QUICK_REPLY)
 
 
 # ==========================================
@@ -685,7 +658,7 @@ class LineMessageBuilder:
         # 根據階段添加額外訊息
         if stage == "CONVERSATION" and missing_fields:
             # 顯示進度 (每 3 個欄位顯示一次)
-            filled_count = 7 - len(missing_fields)
+            filled_count = TOTAL_APPLICATION_FIELDS - len(missing_fields)
             if filled_count > 0 and filled_count % 3 == 0:
                 progress_flex = FlexTemplates.application_progress(profile, missing_fields)
                 messages.append(LineMessageBuilder.build_flex_message(
@@ -6,6 +6,8 @@ Local LLM Manager - 本地模型管理器
 import torch
 import os
 import logging
+from functools import lru_cache
+from typing import Optional
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 from peft import PeftModel
 
@@ -13,6 +15,24 @@ from config import BASE_MODEL_PATH, DEVICE, ENABLE_FINETUNED_MODELS
 
 logger = logging.getLogger(__name__)
 
+# Adapter 權重檔名 (依優先順序)
+ADAPTER_WEIGHT_FILES = ("adapter_model.safetensors", "adapter_model.bin")
+
+
+@lru_cache(maxsize=8)
+def _resolve_adapter_file(adapter_path: str) -> Optional[str]:
+    """
+    找出 adapter 目錄下實際存在的權重檔，找不到時回傳 None
+    
+    專家只有 LDE / DVE / FRE 三個 adapter，結果快取後每次請求
+    不需再做 os.path.join / stat。找不到的結果不會被快取 (見 get_expert_response)。
+    """
+    for filename in ADAPTER_WEIGHT_FILES:
+        path = os.path.join(adapter_path, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
 
 class LocalLLMManager:
     """
@@ -124,11 +144,10 @@ class LocalLLMManager:
             logger.error("❌ Base Model 未載入 (ENABLE_FINETUNED_MODELS=False)")
             return "系統錯誤: 模型未啟用"
         
-        # === 1. 檢查 Adapter 是否存在 ===
-        adapter_file = os.path.join(adapter_path, "adapter_model.safetensors")
-        adapter_file_bin = os.path.join(adapter_path, "adapter_model.bin")
-        
-        if not os.path.exists(adapter_file) and not os.path.exists(adapter_file_bin):
+        # === 1. 檢查 Adapter 是否存在 (已載入的 adapter 不需再檢查) ===
+        if adapter_path not in self._loaded_adapters and _resolve_adapter_file(adapter_path) is None:
+            # 權重檔可能稍後才放上來，不保留「找不到」的快取結果
+            _resolve_adapter_file.cache_clear()
             logger.error(f"❌ 找不到 Adapter: {adapter_path}")
             return "系統錯誤: 找不到模型權重檔"
         
@@ -216,5 +235,6 @@ class LocalLLMManager:
     def clear_adapter_cache(self):
         """清除 Adapter 快取 (釋放 GPU 記憶體)"""
         self._loaded_adapters.clear()
+        _resolve_adapter_file.cache_clear()
         torch.cuda.empty_cache()
         logger.info("🗑️ Adapter 快取已清除")
@@ -1,6 +1,8 @@
 import torch
 import logging
 import os
+from functools import lru_cache
+from types import MappingProxyType
 from typing import Dict, Tuple
 from transformers import DistilBertTokenizer
 
@@ -8,10 +10,37 @@ from .config import (
     DEVICE, MODEL_PATH, STRUCT_DIM, MAX_LEN,
     ID2LABEL, STATUS_MAP, CONFIDENCE_THRESHOLD
 )
-from .model_arch import StateFirstGatingModel
+from .model_arch import StateFirstGatingModel, TextEncoder
+from text_utils import KeywordSet
 
 logger = logging.getLogger(__name__)
 
+# 護欄關鍵字: 一次掃描 query 即可判斷是否命中
+TECH_KEYWORDS = KeywordSet(("系統", "錯誤", "無法", "bug", "故障", "異常", "補件", "驗證", "確認", "資料"))
+QUOTA_KEYWORDS = KeywordSet(("額度", "申覆", "金額", "多少錢", "可以貸"))
+
+# 職業風險關鍵字 (子字串比對，低風險優先)
+HIGH_RISK_JOBS = KeywordSet((
+    "自由業", "無業", "待業", "臨時工", "打零工",
+    "攤販", "家管", "學生", "兼職"
+))
+LOW_RISK_JOBS = KeywordSet((
+    "公務員", "教師", "醫師", "律師", "會計師",
+    "工程師", "主管", "經理", "金融", "科技"
+))
+
+# 結構特徵 sparsity 所使用的欄位 (與訓練資料一致)
+_SPARSITY_FIELDS = ("name", "id", "job", "income", "purpose", "amount")
+
+# 規則式 Fallback: verification_status → (expert, confidence, reason)
+_FALLBACK_RULES = MappingProxyType({
+    "unknown": ("LDE", 0.75, "Rule Fallback: Unknown → LDE"),
+    "pending": ("DVE", 0.75, "Rule Fallback: Pending → DVE"),
+    "verified": ("FRE", 0.75, "Rule Fallback: Verified → FRE"),
+    "mismatch": ("LDE", 0.75, "Rule Fallback: Mismatch → LDE"),
+})
+_FALLBACK_DEFAULT = ("LDE", 0.5, "Rule Fallback: Default → LDE")
+
 
 class MoEGateKeeper:
     """
@@ -30,6 +59,17 @@ class MoEGateKeeper:
         self.model.to(DEVICE)
         self.model.eval()
         
+        # GPU 上以 FP16 autocast 推理 (BERT 頻寬減半)；CPU 維持 FP32
+        # 結構特徵同樣以 FP16 直接建立在 DEVICE 上 (autocast 下 Linear 可直接接受)
+        self._use_amp = DEVICE.type == "cuda"
+        self._struct_dtype = torch.float16 if self._use_amp else torch.float
+        self._encode = self._trace_text_encoder()
+        self._classify = self._compile_classifier()
+        
+        # BERT 只看 user_query，結構特徵另外計算；
+        # 同一句 query (例如預設的「使用者已完成資料填寫」) 的文字特徵直接重用
+        self._encode_text_cached = lru_cache(maxsize=256)(self._encode_text)
+        
         logger.info("✅ MoE GateKeeper 準備就緒!")
 
     def _load_weights(self):
@@ -45,6 +85,73 @@ class MoEGateKeeper:
                 f"請確認已將 .pth 檔案放入 moe/models 資料夾。"
             )
 
+    def _trace_text_encoder(self):
+        """
+        以推理時的固定形狀 (batch=1, MAX_LEN) 將語意流 (BERT + 瓶頸層)
+        trace 成 TorchScript，省去逐層的 Python dispatch；trace 失敗時退回 eager
+        """
+        encoder = TextEncoder(self.model).eval()
+        
+        # attention mask 帶 padding (與 padding='max_length' 的實際輸入相同)，
+        # 確保 trace 到的是有套用 mask 的路徑
+        attention_mask = torch.zeros(1, MAX_LEN, dtype=torch.long, device=DEVICE)
+        attention_mask[:, :MAX_LEN // 2] = 1
+        example = (
+            torch.zeros(1, MAX_LEN, dtype=torch.long, device=DEVICE),
+            attention_mask,
+        )
+        
+        try:
+            with torch.no_grad(), torch.autocast(DEVICE.type, dtype=torch.float16, enabled=self._use_amp):
+                traced = torch.jit.trace(encoder, example, strict=False)
+            traced = torch.jit.optimize_for_inference(traced)
+            logger.info("✅ MoE 文字編碼器已轉為 TorchScript")
+            return traced
+        
+        except Exception as e:
+            logger.warning(f"⚠️ TorchScript trace 失敗，使用 eager 模式: {e}")
+            return encoder
+
+    def _compile_classifier(self):
+        """
+        GPU 上以 torch.compile (reduce-overhead) 將狀態流 + 決策層
+        擷取為單一 CUDA graph；這段運算量極小，瓶頸在逐個 op 的 Python dispatch。
+        CPU 或編譯失敗時退回 eager 的 model.classify
+        """
+        if DEVICE.type != "cuda":
+            return self.model.classify
+        
+        try:
+            compiled = torch.compile(self.model.classify, mode="reduce-overhead", fullgraph=True)
+            
+            # torch.compile 是延遲編譯，先以推理時的形狀跑一次，失敗才能在這裡退回
+            text_embed = torch.zeros(1, self.model.text_compressor[0].out_features, device=DEVICE)
+            struct_features = torch.zeros(1, STRUCT_DIM, dtype=self._struct_dtype, device=DEVICE)
+            with torch.no_grad(), torch.autocast(DEVICE.type, dtype=torch.float16, enabled=self._use_amp):
+                compiled(text_embed, struct_features)
+            
+            logger.info("✅ MoE 決策層已以 torch.compile 編譯")
+            return compiled
+        
+        except Exception as e:
+            logger.warning(f"⚠️ torch.compile 失敗，使用 eager 模式: {e}")
+            return self.model.classify
+
+    def _encode_text(self, text: str) -> torch.Tensor:
+        """user_query → 文字特徵 (1, 32)；經 lru_cache 包裝後以 text 為 key 快取"""
+        encoding = self.tokenizer.encode_plus(
+            text,
+            max_length=MAX_LEN,
+            padding='max_length',
+            truncation=True,
+            return_tensors='pt'
+        )
+        input_ids = encoding['input_ids'].to(DEVICE)
+        attention_mask = encoding['attention_mask'].to(DEVICE)
+        
+        with torch.no_grad(), torch.autocast(DEVICE.type, dtype=torch.float16, enabled=self._use_amp):
+            return self._encode(input_ids, attention_mask)
+
     def calculate_risk_score(self, profile: Dict) -> float:
         """
         計算風險分數 (根據訓練資料優化)
@@ -65,26 +172,13 @@ class MoEGateKeeper:
         amount = profile.get("amount", 0) or 0
         
         # === 維度 1: 職業風險 (40% 權重) ===
-        job_risk = 0.5
-        
-        high_risk_jobs = [
-            "自由業", "無業", "待業", "臨時工", "打零工",
-            "攤販", "家管", "學生", "兼職"
-        ]
-        low_risk_jobs = [
-            "公務員", "教師", "醫師", "律師", "會計師",
-            "工程師", "主管", "經理", "金融", "科技"
-        ]
-        
-        for kw in high_risk_jobs:
-            if kw in job:
-                job_risk = 0.9
-                break
-        
-        for kw in low_risk_jobs:
-            if kw in job:
-                job_risk = 0.1
-                break
+        # 同時命中高/低風險關鍵字時以低風險為準
+        if LOW_RISK_JOBS.matches(job):
+            job_risk = 0.1
+        elif HIGH_RISK_JOBS.matches(job):
+            job_risk = 0.9
+        else:
+            job_risk = 0.5
         
         # === 維度 2: 收入風險 (30% 權重) ===
         income_risk = 0.5
@@ -198,8 +292,7 @@ class MoEGateKeeper:
             return "LDE", 1.0, "Guardrail: Data Mismatch → Agent Review"
         
         # [E] 技術問題: → DVE
-        tech_keywords = ["系統", "錯誤", "無法", "bug", "故障", "異常", "補件", "驗證", "確認", "資料"]
-        if any(kw in text for kw in tech_keywords):
+        if TECH_KEYWORDS.matches(text):
             logger.info("🛡️ Guardrail: 技術/補件問題 → DVE")
             return "DVE", 0.95, "Guardrail: Technical/Verification Issue"
         
@@ -214,8 +307,7 @@ class MoEGateKeeper:
                 return "DVE", 0.85, "Guardrail: Low Risk Quick Verification"
         
         # [G] 額度相關問題: verified → FRE
-        quota_keywords = ["額度", "申覆", "金額", "多少錢", "可以貸"]
-        if any(kw in text for kw in quota_keywords) and status_str == "verified":
+        if status_str == "verified" and QUOTA_KEYWORDS.matches(text):
             logger.info("🛡️ Guardrail: 額度問題 → FRE")
             return "FRE", 0.95, "Guardrail: Quota/Amount Inquiry"
 
@@ -237,14 +329,8 @@ class MoEGateKeeper:
         """
         
         try:
-            # === 準備文字特徵 ===
-            encoding = self.tokenizer.encode_plus(
-                text,
-                max_length=MAX_LEN,
-                padding='max_length',
-                truncation=True,
-                return_tensors='pt'
-            )
+            # === 準備文字特徵 (依 query 快取) ===
+            text_embed = self._encode_text_cached(text)
             
             # === 準備結構特徵 (7 維) ===
             has_id = 1.0 if profile.get("id") else 0.0
@@ -254,9 +340,8 @@ class MoEGateKeeper:
             
             status_val = STATUS_MAP.get(status_str, 0)
             
-            all_fields = ["name", "id", "job", "income", "purpose", "amount"]
-            filled = sum(1 for f in all_fields if profile.get(f) is not None)
-            sparsity = filled / len(all_fields)
+            missing = list(map(profile.get, _SPARSITY_FIELDS)).count(None)
+            sparsity = 1 - missing / len(_SPARSITY_FIELDS)
             
             struct_features = torch.tensor([
                 has_id,
@@ -266,26 +351,26 @@ class MoEGateKeeper:
                 status_val / 4.0,
                 sparsity,
                 risk_score
-            ], dtype=torch.float).unsqueeze(0).to(DEVICE)
+            ], dtype=self._struct_dtype, device=DEVICE).unsqueeze(0)
             
-            logger.debug(f"結構特徵: {struct_features.cpu().numpy()}")
+            # .cpu() 會觸發 GPU 同步，只在 DEBUG 時才做
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"結構特徵: {struct_features.cpu().numpy()}")
             
-            # === 模型推理 ===
-            input_ids = encoding['input_ids'].to(DEVICE)
-            attention_mask = encoding['attention_mask'].to(DEVICE)
-
-            with torch.no_grad():
-                outputs = self.model(input_ids, attention_mask, struct_features)
-                probs = torch.nn.functional.softmax(outputs, dim=1)
-                pred_idx = torch.argmax(probs, dim=1).item()
-                confidence = probs[0][pred_idx].item()
+            # === 模型推理 (狀態流 + 決策層) ===
+            with torch.no_grad(), torch.autocast(DEVICE.type, dtype=torch.float16, enabled=self._use_amp):
+                logits = self._classify(text_embed, struct_features)[0].float()
+                # softmax 單調，argmax 直接取 logits 即可；
+                # 勝者機率 = 1 / Σ exp(logit - max)，不需算出整個機率向量
+                max_logit, pred_idx = logits.max(dim=0)
+                confidence = torch.exp(logits - max_logit).sum().reciprocal().item()
+                pred_idx = pred_idx.item()
             
             expert = ID2LABEL[pred_idx]
             
-            logger.info(
-                f"🎯 AI 推理: {expert} (信心度: {confidence:.2f}), "
-                f"機率分布: {probs.cpu().numpy()}"
-            )
+            logger.info(f"🎯 AI 推理: {expert} (信心度: {confidence:.2f})")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"機率分布: {torch.softmax(logits, dim=0).cpu().numpy()}")
             
             # === 信心度檢查 ===
             if confidence < CONFIDENCE_THRESHOLD:
@@ -310,13 +395,4 @@ class MoEGateKeeper:
         
         logger.info("🔧 使用規則式 Fallback")
         
-        if status_str == "unknown":
-            return "LDE", 0.75, "Rule Fallback: Unknown → LDE"
-        elif status_str == "pending":
-            return "DVE", 0.75, "Rule Fallback: Pending → DVE"
-        elif status_str == "verified":
-            return "FRE", 0.75, "Rule Fallback: Verified → FRE"
-        elif status_str == "mismatch":
-            return "LDE", 0.75, "Rule Fallback: Mismatch → LDE"
-        else:
-            return "LDE", 0.5, "Rule Fallback: Default → LDE"
+        return _FALLBACK_RULES.get(status_str, _FALLBACK_DEFAULT)
@@ -60,17 +60,48 @@ class StateFirstGatingModel(nn.Module):
         Returns:
             logits: 分類結果
         """
-        # --- 處理文字特徵 ---
+        text_embed = self.encode_text(input_ids, attention_mask)
+        return self.classify(text_embed, struct_features)
+
+    def encode_text(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """
+        語意流: BERT [CLS] → 文字瓶頸層
+        
+        只依賴文字輸入，推理時可依 query 快取結果
+        
+        Returns:
+            text_embed: (batch, 32)
+        """
         bert_output = self.bert(input_ids=input_ids, attention_mask=attention_mask)
         # 取 [CLS] token 代表整句語意
         pooled_output = bert_output.last_hidden_state[:, 0] 
-        text_embed = self.text_compressor(pooled_output)  # Output: (batch, 32)
+        return self.text_compressor(pooled_output)
+
+    def classify(self, text_embed: torch.Tensor, struct_features: torch.Tensor) -> torch.Tensor:
+        """
+        狀態流 + 決策層
+        
+        Args:
+            text_embed: encode_text() 的輸出 (batch, 32)
+            struct_features: 結構化特徵 (batch, 7)
         
+        Returns:
+            logits: 分類結果
+        """
         # --- 處理結構化特徵 ---
         struct_embed = self.struct_net(struct_features)  # Output: (batch, 128)
         
         # --- 特徵融合與分類 ---
         combined = torch.cat((text_embed, struct_embed), dim=1)
-        output = self.classifier(combined)
-        
-        return output
+        return self.classifier(combined)
+
+
+class TextEncoder(nn.Module):
+    """以 encode_text 作為 forward 的包裝 (供 TorchScript trace 使用)"""
+
+    def __init__(self, model: StateFirstGatingModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model.encode_text(input_ids, attention_mask)
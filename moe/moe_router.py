@@ -3,6 +3,17 @@ from typing import Dict, Tuple, List
 
 logger = logging.getLogger(__name__)
 
+# MoE 訓練資料中用來計算完整度的欄位
+_TRAINING_FIELDS = ("name", "id", "job", "income", "purpose", "amount")
+
+
+def _filled_mask(profile: Dict) -> int:
+    """已填寫 (非 None) 的訓練欄位 bitmask，第 i 個 bit 對應 _TRAINING_FIELDS[i]"""
+    mask = 0
+    for i, value in enumerate(map(profile.get, _TRAINING_FIELDS)):
+        mask |= (value is not None) << i
+    return mask
+
 
 class ProfileAdapter:
     """
@@ -26,6 +37,9 @@ class ProfileAdapter:
         "verification_status": "verification_status"  # 新增: 狀態也需要傳遞
     }
     
+    # adapt() 用: 反向的 (對話欄位, MoE 欄位)，後寫入者覆蓋 → FIELD_MAPPING 中排前面的優先
+    _ADAPT_ITEMS = tuple(reversed(FIELD_MAPPING.items()))
+    
     # MoE 必須的欄位 (根據訓練資料)
     REQUIRED_FIELDS = ["name", "job", "income", "purpose"]
     
@@ -38,17 +52,18 @@ class ProfileAdapter:
             Input:  {"name": "王小明", "loan_purpose": "購車", ...}
             Output: {"name": "王小明", "purpose": "購車", ...}
         """
-        adapted = {}
-        
-        for conv_field, moe_field in ProfileAdapter.FIELD_MAPPING.items():
-            value = conversation_profile.get(conv_field)
-            
-            if value is not None:
-                # 避免重複覆蓋 (例如 loan_purpose 和 purpose 都存在時)
-                if moe_field not in adapted or adapted[moe_field] is None:
-                    adapted[moe_field] = value
+        get = conversation_profile.get
+        
+        # 單一 comprehension 完成改名與過濾 None；
+        # loan_purpose 和 purpose 都存在時，loan_purpose 較晚寫入而勝出
+        adapted = {
+            moe_field: value
+            for conv_field, moe_field in ProfileAdapter._ADAPT_ITEMS
+            if (value := get(conv_field)) is not None
+        }
         
-        logger.debug(f"欄位適配: {conversation_profile} → {adapted}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"欄位適配: {conversation_profile} → {adapted}")
         
         return adapted
     
@@ -229,11 +244,5 @@ class MoERouter:
         """
         計算資料完整度
         """
-        training_fields = ["name", "id", "job", "income", "purpose", "amount"]
-        
-        filled_count = sum(
-            1 for field in training_fields
-            if profile.get(field) is not None
-        )
-        
-        return filled_count / len(training_fields)
+        # popcount: 已填寫欄位數
+        return _filled_mask(profile).bit_count() / len(_TRAINING_FIELDS)
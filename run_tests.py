@@ -10,7 +10,21 @@ import argparse
 from pathlib import Path
 
 
-def run_tests(test_type: str = "all", verbose: bool = True, coverage: bool = False):
+def xdist_available() -> bool:
+    """檢查是否安裝 pytest-xdist"""
+    try:
+        import xdist  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def run_tests(
+    test_type: str = "all",
+    verbose: bool = True,
+    coverage: bool = False,
+    workers: str = None
+):
     """
     執行測試
     
@@ -18,6 +32,7 @@ def run_tests(test_type: str = "all", verbose: bool = True, coverage: bool = Fal
         test_type: "all", "unit", "integration", "e2e"
         verbose: 是否顯示詳細輸出
         coverage: 是否計算覆蓋率
+        workers: 平行執行的 worker 數 ("auto" 或數字，需 pytest-xdist)
     """
     # 基本命令
     cmd = ["python", "-m", "pytest"]
@@ -46,6 +61,13 @@ def run_tests(test_type: str = "all", verbose: bool = True, coverage: bool = Fal
     if coverage:
         cmd.extend(["--cov=.", "--cov-report=term-missing"])
     
+    # 平行執行 (同一 xdist_group 的測試會分派到同一個 worker)
+    if workers:
+        if xdist_available():
+            cmd.extend(["-n", workers, "--dist=loadgroup"])
+        else:
+            print("⚠️  未安裝 pytest-xdist，改為單一程序執行")
+    
     # 執行
     print(f"🧪 執行測試: {' '.join(cmd)}")
     print("=" * 60)
@@ -84,6 +106,11 @@ def main():
         help="計算測試覆蓋率"
     )
     
+    parser.add_argument(
+        "-n", "--workers",
+        help="平行執行的 worker 數 (例如 auto 或 4，需 pytest-xdist)"
+    )
+    
     parser.add_argument(
         "-q", "--quiet",
         action="store_true",
@@ -104,7 +131,8 @@ def main():
         return_code = run_tests(
             test_type=args.type,
             verbose=not args.quiet,
-            coverage=args.coverage
+            coverage=args.coverage,
+            workers=args.workers
         )
     
     print("=" * 60)
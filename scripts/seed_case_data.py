@@ -225,37 +225,32 @@ def seed_database(num_records: int = 100):
         "轉介審核_ESCALATE": 0
     }
     
+    cases = []
+    
     for i in range(num_records):
         try:
             case = generate_seed_case()
+            case["case_id"] = f"seed_{i+1:05d}"
+            cases.append(case)
             
-            # 存入 case_library (不是 user_history)
-            result = rag_engine.add_case(
-                content=case["content"],
-                metadata=case["metadata"],
-                case_id=f"seed_{i+1:05d}"
-            )
-            
-            if result:
-                success_count += 1
-                decision = case["metadata"]["final_decision"]
-                stats[decision] = stats.get(decision, 0) + 1
-                
-                if (i + 1) % 10 == 0:
-                    print(f"  ✓ 已產生 {i + 1}/{num_records} 筆...")
-            else:
-                fail_count += 1
-                print(f"  ✗ 第 {i + 1} 筆存入失敗")
-                
         except Exception as e:
             fail_count += 1
             print(f"  ✗ 第 {i + 1} 筆產生失敗: {e}")
     
+    # 存入 case_library (不是 user_history)，整批一次 encode + 一次 bulk_write
+    success_count = rag_engine.add_cases_bulk(cases)
+    fail_count += len(cases) - success_count
+    
+    # ordered=False 時部分失敗無法對應到個別案例，分布以產生的案例統計
+    for case in cases:
+        decision = case["metadata"]["final_decision"]
+        stats[decision] = stats.get(decision, 0) + 1
+    
     print("=" * 50)
     print(f"✅ 完成！成功: {success_count}, 失敗: {fail_count}")
     print(f"\n📊 審核結果分布:")
     for decision, count in stats.items():
-        pct = count / success_count * 100 if success_count > 0 else 0
+        pct = count / len(cases) * 100 if cases else 0
         print(f"   {decision}: {count} ({pct:.1f}%)")
 
 
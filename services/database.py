@@ -9,7 +9,11 @@ from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
 from dotenv import load_dotenv
 
+# 連線設定在 import 時讀取一次；不經過 config (該模組會載入 torch 並要求 GEMINI_API_KEY)，
+# 單獨使用 RAG / seed 腳本時不需要 Gemini 設定
 load_dotenv()
+MONGODB_URI = os.getenv("MONGODB_URI")
+DB_NAME = os.getenv("DB_NAME", "MoE-Finance")
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +40,8 @@ class MongoManager:
     @classmethod
     def _initialize(cls):
         """初始化 MongoDB 連線"""
-        uri = os.getenv("MONGODB_URI")
-        db_name = os.getenv("DB_NAME", "MoE-Finance")
+        uri = MONGODB_URI
+        db_name = DB_NAME
         
         if not uri:
             logger.warning("⚠️ 未設定 MONGODB_URI，MongoDB 功能將無法使用")
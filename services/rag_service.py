@@ -22,13 +22,439 @@ RAG 服務
 
 import os
 import logging
+import contextlib
+import copy
+import operator
+import re
 import time
-from typing import Dict, List, Optional
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
 
 from .database import mongo_db
 
+# PyMongo >= 4.10 支援 BSON vector (binData subtype 9)；舊版 driver 時 embedding 存成一般 list
+try:
+    from bson.binary import Binary, BinaryVectorDtype
+    BSON_VECTOR_AVAILABLE = True
+except ImportError:
+    BSON_VECTOR_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# case_library Vector Search 的固定設定 (模組載入時建立一次，請勿修改)
+_VECTOR_SEARCH_BASE = {
+    "index": "vector_index",
+    "path": "embedding"
+}
+
+# numCandidates 取 top_k 的 20 倍 (Atlas 建議 10~20 倍)，下限 100、上限 10000 (Atlas 限制)
+_CANDIDATES_PER_RESULT = 20
+_MIN_NUM_CANDIDATES = 100
+_MAX_NUM_CANDIDATES = 10000
+_CASE_PROJECT_STAGE = {
+    "$project": {
+        "_id": 1,  # 只供語意快取依 _id 取回 embedding，不回傳給呼叫端
+        "content": 1,
+        "metadata": 1,
+        "created_at": 1,
+        "score": {"$meta": "vectorSearchScore"}
+    }
+}
+
+
+# _profile_to_query 的欄位: (標籤, 依序取第一個有值的 profile key)
+# 順序固定，同樣的 profile 一定組出同一段查詢文字 (快取 key 穩定)
+_QUERY_FIELDS = (
+    ("職業", ("job",)),
+    ("月薪", ("income",)),
+    ("貸款金額", ("amount",)),
+    ("用途", ("purpose", "loan_purpose")),
+)
+
+# 每位使用者保留的 DVE 驗證結果筆數 (不同 current_data 各一筆)
+_VERIFY_ENTRIES_PER_USER = 8
+
+# Vector Search 結果快取秒數
+_SEARCH_CACHE_TTL = 120
+
+# warmup() 用的固定查詢文字
+_WARMUP_TEXT = "warmup"
+
+# 已編碼文字的 embedding 保留筆數 (float32 × 384 維，約 1.5 KB/筆)
+_EMBED_CACHE_SIZE = 4096
+
+
+_NON_DIGIT_RE = re.compile(r"\D")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def _normalize_phone(phone) -> str:
+    """
+    正規化電話號碼 (只保留數字)
+    
+    任何型別先轉成字串 (不可雜湊的 list/dict 也可)，再交給有快取的 _digits_only
+    """
+    if not phone:
+        return ""
+    return _digits_only(str(phone))
+
+
+@lru_cache(maxsize=8192)
+def _digits_only(text: str) -> str:
+    """
+    一次 C 層 re.sub 取代逐字元的 Python 迴圈；
+    同一支電話在歷史紀錄中反覆出現，結果直接快取
+    """
+    return _NON_DIGIT_RE.sub("", text)
+
+
+def _income_differs(current, historical) -> bool:
+    """收入差異超過 20% 視為不符"""
+    return abs(current - historical) / historical > 0.2
+
+
+def _phone_differs(current, historical) -> bool:
+    """正規化後比對；任一方正規化後為空則不比"""
+    curr_phone = _normalize_phone(current)
+    hist_phone = _normalize_phone(historical)
+    return bool(curr_phone and hist_phone) and curr_phone != hist_phone
+
+
+# verify_against_history 比對規則: (當前欄位, 歷史欄位, 判斷不符的函式)
+# 兩邊都有值時才比對
+_VERIFY_RULES = (
+    ("job", "hist_job", operator.ne),
+    ("income", "hist_income", _income_differs),
+    ("phone", "hist_phone", _phone_differs),
+)
+
+# 不符項目數 → 風險等級 (2 項以上皆為 HIGH；有違約紀錄另外直接判 HIGH)
+_RISK_BY_MISMATCH = ("LOW", "MEDIUM", "HIGH")
+
+
+@lru_cache(maxsize=1)
+def _load_encoder(model_name: str = "all-MiniLM-L6-v2"):
+    """
+    載入 SentenceTransformer (同一 process 只載入一次)
+    
+    多個 RAGService 實例共用同一個模型 (~90 MB)；
+    載入失敗時拋出例外，不會被快取，下次仍會重試
+    """
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+def is_approved_decision(decision: str) -> bool:
+    """審核結果字串 (例如 "核准_PASS" / "拒絕_REJECT") 是否為核准"""
+    return "PASS" in decision or "核准" in decision
+
+
+def to_stored_embedding(vector: np.ndarray):
+    """
+    embedding 寫入 MongoDB 的格式
+    
+    BSON double array 每維 8 bytes 外加每個元素的 key，
+    改存 packed float32 vector 每維只要 4 bytes (384 維約 1.5 KB)；
+    Atlas 端再由 index 的 scalar quantization 轉成 int8 建索引
+    """
+    if BSON_VECTOR_AVAILABLE:
+        return Binary.from_vector(vector, BinaryVectorDtype.FLOAT32)
+    return vector.tolist()
+
+
+def from_stored_embedding(stored) -> Optional[np.ndarray]:
+    """to_stored_embedding 的反向轉換 (BSON vector 或 list)；無法解析時回傳 None"""
+    if stored is None:
+        return None
+    try:
+        if BSON_VECTOR_AVAILABLE and isinstance(stored, Binary):
+            stored = stored.as_vector().data
+        vector = np.asarray(stored, dtype=np.float32)
+    except (TypeError, ValueError):
+        return None
+    return vector if vector.ndim == 1 and vector.size else None
+
+
+def build_vector_search_pipeline(query_vector: List[float], top_k: int) -> List[Dict]:
+    """
+    組出 Vector Search pipeline
+    
+    只有 queryVector / limit / numCandidates 每次不同；共用的 $project stage 直接重用，
+    $vectorSearch stage 每次建立新 dict，多執行緒同時查詢也不會互相覆蓋
+    """
+    num_candidates = min(max(_MIN_NUM_CANDIDATES, top_k * _CANDIDATES_PER_RESULT), _MAX_NUM_CANDIDATES)
+    return [
+        {"$vectorSearch": {
+            **_VECTOR_SEARCH_BASE,
+            "queryVector": query_vector,
+            "numCandidates": num_candidates,
+            "limit": top_k
+        }},
+        _CASE_PROJECT_STAGE
+    ]
+
+
+# RagContext 欄位 → DVE prompt 使用的中文 key (只在組 prompt 時轉換)
+_RAG_CONTEXT_LABELS = {
+    "job": "檔案中紀錄職業",
+    "purpose": "上次貸款資金用途",
+    "phone": "檔案中聯絡電話",
+    "default_record": "歷史違約紀錄",
+    "company": "檔案中服務公司名稱",
+    "income": "檔案中年薪/月薪",
+    "inquiry_count": "信用報告查詢次數",
+    "address_changes": "地址變動次數",
+}
+
+
+@dataclass(slots=True)
+class RagContext:
+    """
+    DVE 比對用的 user_history 最新紀錄
+    
+    程式內以屬性存取，送進 LLM 前才以 as_dve_dict() 轉成中文 key
+    """
+    job: str = "無紀錄"
+    purpose: str = "無紀錄"
+    phone: str = "無紀錄"
+    default_record: str = "無"
+    company: str = "無紀錄"
+    income: str = "0"
+    inquiry_count: str = "0"
+    address_changes: str = "0"
+    
+    @classmethod
+    def from_metadata(cls, meta: Dict) -> "RagContext":
+        """由 user_history 紀錄的 metadata 建立"""
+        return cls(
+            job=meta.get("hist_job", "無紀錄"),
+            purpose=meta.get("hist_purpose", "無紀錄"),
+            phone=meta.get("hist_phone", "無紀錄"),
+            default_record=meta.get("default_record", "無"),
+            company=meta.get("hist_company", "無紀錄"),
+            income=str(meta.get("hist_income", "0")),
+            inquiry_count=str(meta.get("inquiry_count", "0")),
+            address_changes=str(meta.get("addr_change_count", "0"))
+        )
+    
+    @classmethod
+    def new_user(cls) -> "RagContext":
+        """無歷史紀錄的新戶"""
+        return cls(job="無紀錄 (新戶)")
+    
+    def as_dve_dict(self) -> Dict[str, str]:
+        """轉成 DVE prompt 的 "RAG 檢索的歷史數據" 區塊"""
+        return {_RAG_CONTEXT_LABELS[f.name]: getattr(self, f.name) for f in fields(self)}
+
+
+class _TTLCache:
+    """
+    有存活時間的 LRU 快取 (執行緒安全)
+    
+    超過 ttl 秒的項目視為不存在；超過 maxsize 時淘汰最久未使用的項目
+    """
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """取出未過期的值，沒有則回傳 None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            
+            self._data.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        """存入 (覆蓋舊值並重新計時)"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key):
+        """移除單一項目"""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class _SemanticCache:
+    """
+    語意快取 (Random-Projection LSH)
+    
+    query embedding 以 n_tables 組、每組 n_bits 個隨機超平面取符號雜湊，
+    任一組落在同一個 bucket 的舊查詢即為候選，再以 cosine 確認 >= threshold；
+    換句話說但語意相同的查詢可直接重用上次的 Vector Search 結果。
+    
+    - 查詢文字中的數字 (tag) 必須完全相同才會共用，月薪 3 萬與 30 萬不會互相命中
+    - 命中時以案例 embedding 對新查詢重算 score (Atlas cosine: (1 + cos) / 2) 並重新排序
+    - 命中時回傳的是「另一個相近查詢」的近鄰案例 (可能來自不同 profile)，只重新排序、不重新搜尋，
+      新查詢真正的 top_k 若有未出現在舊結果中的案例，要等項目過期後才看得到
+    - 超過 ttl 秒的項目視為不存在；超過 maxsize 時淘汰最久未使用的項目
+    """
+    
+    def __init__(
+        self,
+        n_tables: int = 8,
+        n_bits: int = 12,
+        threshold: float = 0.95,
+        maxsize: int = 1024,
+        ttl: float = 120,
+        seed: int = 0
+    ):
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._rng = np.random.default_rng(seed)
+        self._planes: Optional[np.ndarray] = None  # (dim, n_tables * n_bits)，首次使用時依維度建立
+        self._bit_weights = 1 << np.arange(n_bits, dtype=np.int64)
+        self._buckets: List[Dict[Tuple, List[int]]] = [{} for _ in range(n_tables)]
+        # entry_id → (到期時間, 單位向量, bucket keys, 案例, 案例單位向量 (n, dim))
+        self._entries: "OrderedDict[int, Tuple[float, np.ndarray, Tuple, Tuple[Dict, ...], np.ndarray]]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def _prepare(self, vector: Sequence[float], top_k: int, tag: Tuple):
+        """正規化向量並算出各組 bucket key；維度與超平面不符時回傳 None (需持有 lock)"""
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if vec.ndim != 1 or norm == 0:
+            return None
+        vec = vec / norm
+        
+        if self._planes is None:
+            self._planes = self._rng.standard_normal(
+                (vec.shape[0], self.n_tables * self.n_bits)
+            ).astype(np.float32)
+        elif self._planes.shape[0] != vec.shape[0]:
+            return None
+        
+        bits = (vec @ self._planes > 0).reshape(self.n_tables, self.n_bits)
+        codes = bits @ self._bit_weights
+        # top_k 或數字不同的結果不可共用，一併放進 key
+        keys = tuple((top_k, tag, int(c)) for c in codes)
+        return vec, keys
+    
+    def get(self, vector: Sequence[float], top_k: int, tag: Tuple = ()) -> Optional[Tuple[Dict, ...]]:
+        """找出 cosine >= threshold 的最相近舊查詢，回傳以新查詢重算 score 的案例；沒有則回傳 None"""
+        with self._lock:
+            prepared = self._prepare(vector, top_k, tag)
+            if prepared is not None:
+                vec, keys = prepared
+                now = time.monotonic()
+                candidates = {
+                    entry_id
+                    for table, key in zip(self._buckets, keys)
+                    for entry_id in table.get(key, ())
+                }
+                
+                best_id, best_sim = None, self.threshold
+                for entry_id in candidates:
+                    expires_at, entry_vec = self._entries[entry_id][:2]
+                    if expires_at <= now:
+                        self._remove(entry_id)
+                        continue
+                    sim = float(vec @ entry_vec)
+                    if sim >= best_sim:
+                        best_id, best_sim = entry_id, sim
+                
+                if best_id is not None:
+                    self._entries.move_to_end(best_id)
+                    self.hits += 1
+                    _, _, _, cases, case_vecs = self._entries[best_id]
+                    return self._rescore(vec, cases, case_vecs)
+            
+            self.misses += 1
+            return None
+    
+    @staticmethod
+    def _rescore(vec: np.ndarray, cases: Tuple[Dict, ...], case_vecs: np.ndarray) -> Tuple[Dict, ...]:
+        """以新查詢重算每個案例的 score，依分數由高到低排列"""
+        scores = (1.0 + case_vecs @ vec) / 2.0
+        order = np.argsort(-scores, kind="stable")
+        return tuple({**cases[i], "score": float(scores[i])} for i in order)
+    
+    def put(
+        self,
+        vector: Sequence[float],
+        top_k: int,
+        tag: Tuple,
+        results: Tuple[Dict, ...],
+        case_vectors: np.ndarray
+    ):
+        """存入一筆查詢結果；case_vectors 為 results 各案例的 embedding (n, dim)"""
+        with self._lock:
+            prepared = self._prepare(vector, top_k, tag)
+            if prepared is None:
+                return
+            vec, keys = prepared
+            
+            case_vecs = np.asarray(case_vectors, dtype=np.float32)
+            if case_vecs.shape != (len(results), vec.shape[0]):
+                return
+            norms = np.linalg.norm(case_vecs, axis=1, keepdims=True)
+            case_vecs = case_vecs / np.where(norms == 0, 1.0, norms)
+            
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (time.monotonic() + self.ttl, vec, keys, results, case_vecs)
+            for table, key in zip(self._buckets, keys):
+                table.setdefault(key, []).append(entry_id)
+            
+            if len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+    
+    def _remove(self, entry_id: int):
+        """移除單一項目與其 bucket 索引 (需持有 lock)"""
+        keys = self._entries.pop(entry_id)[2]
+        for table, key in zip(self._buckets, keys):
+            bucket = table[key]
+            bucket.remove(entry_id)
+            if not bucket:
+                del table[key]
+    
+    def clear(self):
+        """清空快取 (超平面保留)"""
+        with self._lock:
+            for table in self._buckets:
+                table.clear()
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        """命中統計"""
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
 
 class RAGService:
     """
@@ -46,11 +472,40 @@ class RAGService:
     # 相似度閾值
     SIMILARITY_THRESHOLD = 0.5
     
-    def __init__(self):
+    def __init__(self, db=None, encoder=None):
+        """
+        Args:
+            db: 提供 get_collection() 的資料庫物件，預設為共用的 mongo_db
+            encoder: 提供 encode() 的 embedding 模型，預設延遲載入 all-MiniLM-L6-v2
+        """
+        self._db = db
         self._user_history = None
         self._case_library = None
-        self._encoder = None
+        self._encoder = encoder
         self._initialized = False
+        
+        # 完全相同的查詢 (query_text, top_k) 直接重用上次的 Vector Search 結果，
+        # 省去 embedding 與 Atlas round trip；本 process 新增案例時清空，
+        # 其他 worker / seed 腳本寫入的案例最多延遲 _SEARCH_CACHE_TTL 秒
+        self._search_cache = _TTLCache(maxsize=1024, ttl=_SEARCH_CACHE_TTL)
+        # 文字不同但 embedding 幾乎相同 (且數字相同) 的查詢，重用案例並重算 score；TTL 同上
+        self._semantic_cache = _SemanticCache(ttl=_SEARCH_CACHE_TTL)
+        
+        # FRE 決策參考 (profile 查詢文字, DVE 風險, top_k) → 統計結果，10 分鐘後重新查詢
+        self._decision_cache = _TTLCache(maxsize=2048, ttl=600)
+        
+        # DVE 驗證 user_id → {current_data 指紋: 結果}，同一輪對話內重複驗證不再查 user_history；
+        # 以 user_id 分組，add_user_record 時整組清除。其他 worker 寫入的紀錄
+        # (例如新的違約紀錄) 最多延遲 30 秒，TTL 不宜拉長
+        self._verify_cache = _TTLCache(maxsize=4096, ttl=30)
+        
+        # 文字 → embedding (唯讀 float32)，重複的內容不再跑 encoder
+        self._embed_memo: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._embed_lock = threading.Lock()
+        
+        # warmup() 只執行一次
+        self._warmed = False
+        self._warmup_lock = threading.Lock()
 
     def _lazy_init(self):
         """延遲初始化"""
@@ -58,8 +513,9 @@ class RAGService:
             return
         
         # 取得兩個 Collection
-        self._user_history = mongo_db.get_collection(self.USER_HISTORY_COLLECTION)
-        self._case_library = mongo_db.get_collection(self.CASE_LIBRARY_COLLECTION)
+        db = self._db if self._db is not None else mongo_db
+        self._user_history = db.get_collection(self.USER_HISTORY_COLLECTION)
+        self._case_library = db.get_collection(self.CASE_LIBRARY_COLLECTION)
         
         if self._user_history is None:
             logger.warning(f"⚠️ Collection '{self.USER_HISTORY_COLLECTION}' 未連線")
@@ -71,20 +527,79 @@ class RAGService:
         else:
             logger.info(f"✅ Collection '{self.CASE_LIBRARY_COLLECTION}' 已連線")
         
-        # 載入 Embedding 模型
+        # 載入 Embedding 模型 (建構時已注入則直接使用)
+        if self._encoder is None:
+            self._encoder = self._load_default_encoder()
+        
+        self._initialized = True
+
+    def warmup(self, background: bool = False) -> Optional[threading.Thread]:
+        """
+        預熱: 載入 encoder、跑一次 encode 與 limit=1 的 Vector Search
+        
+        避免第一個真正的請求才付出模型載入、CUDA 初始化與 Atlas index 冷啟動的延遲；
+        只會執行一次，失敗時僅記錄 log。
+        background=True 時在 daemon thread 執行並回傳該 thread
+        """
+        if background:
+            thread = threading.Thread(target=self._warmup, name="rag-warmup", daemon=True)
+            thread.start()
+            return thread
+        
+        self._warmup()
+        return None
+
+    def _warmup(self):
+        """warmup() 的實際流程 (以 lock 確保只執行一次)"""
+        with self._warmup_lock:
+            if self._warmed:
+                return
+            
+            started = time.perf_counter()
+            self._lazy_init()
+            
+            if self._encoder is not None:
+                try:
+                    with self._inference_mode():
+                        vectors = self._encoder.encode(
+                            [_WARMUP_TEXT],
+                            convert_to_numpy=True,
+                            normalize_embeddings=True
+                        )
+                    
+                    if self._case_library is not None:
+                        pipeline = build_vector_search_pipeline(
+                            np.asarray(vectors[0], dtype=np.float32).tolist(), 1
+                        )
+                        list(self._case_library.aggregate(pipeline))
+                except Exception as e:
+                    logger.warning(f"⚠️ RAG 預熱未完成: {e}")
+            
+            self._warmed = True
+            logger.info(f"🔥 RAG 預熱完成 ({time.perf_counter() - started:.2f}s)")
+
+    @staticmethod
+    def _inference_mode():
+        """torch.inference_mode() (未安裝 torch 時不做任何事)"""
+        try:
+            import torch
+        except ImportError:
+            return contextlib.nullcontext()
+        return torch.inference_mode()
+
+    @staticmethod
+    def _load_default_encoder():
+        """載入預設 Embedding 模型，失敗時回傳 None"""
         try:
-            from sentence_transformers import SentenceTransformer
             logger.info("📥 正在載入 Embedding 模型...")
-            self._encoder = SentenceTransformer('all-MiniLM-L6-v2')
+            encoder = _load_encoder()
             logger.info("✅ Embedding 模型載入完成 (384 維)")
+            return encoder
         except ImportError:
             logger.warning("⚠️ sentence-transformers 未安裝")
-            self._encoder = None
         except Exception as e:
             logger.error(f"❌ Embedding 模型載入失敗: {e}")
-            self._encoder = None
-        
-        self._initialized = True
+        return None
 
     def get_embedding(self, text: str) -> List[float]:
         """將文字轉為向量 (384 維)"""
@@ -93,7 +608,47 @@ class RAGService:
         if not text or self._encoder is None:
             return []
         
-        return self._encoder.encode(text).tolist()
+        return self._encode_batch([text])[0].tolist()
+
+    def _encode_batch(self, texts: Sequence[str]) -> List[np.ndarray]:
+        """
+        批次產生 embedding (float32，與 texts 順序對應)
+        
+        已編碼過的文字直接取用記憶體中的結果，其餘去重後
+        合併成一次 encoder.encode 呼叫；回傳的陣列為唯讀，請勿修改
+        """
+        found: Dict[str, np.ndarray] = {}
+        
+        with self._embed_lock:
+            for text in texts:
+                vec = self._embed_memo.get(text)
+                if vec is not None:
+                    self._embed_memo.move_to_end(text)
+                    found[text] = vec
+        
+        pending = [t for t in dict.fromkeys(texts) if t not in found]
+        
+        if pending:
+            vectors = np.asarray(
+                self._encoder.encode(
+                    pending,
+                    batch_size=32,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                ),
+                dtype=np.float32
+            )
+            vectors.setflags(write=False)
+            
+            with self._embed_lock:
+                for text, vec in zip(pending, vectors):
+                    self._embed_memo[text] = vec
+                    found[text] = vec
+                
+                while len(self._embed_memo) > _EMBED_CACHE_SIZE:
+                    self._embed_memo.popitem(last=False)
+        
+        return [found[t] for t in texts]
 
     # ========================================
     # user_history Collection (DVE 用)
@@ -137,19 +692,24 @@ class RAGService:
         
         try:
             result = self._user_history.insert_one(doc)
+            self._verify_cache.pop(user_id)
             logger.info(f"💾 用戶紀錄已存入 user_history (User: {user_id[:4]}***)")
             return str(result.inserted_id)
         except Exception as e:
             logger.error(f"❌ user_history 寫入失敗: {e}")
             return None
 
-    def get_user_history_by_id(self, user_id: str) -> List[Dict]:
+    def get_user_history_by_id(self, user_id: str, limit: int = 0) -> List[Dict]:
         """
         📂 精準檢索 - 根據 User ID 撈出該用戶的所有歷史資料
         
         ⚠️ 這不是 RAG！這是 Database Query
         
         用於 DVE 驗證「同一個人」的歷史
+        
+        Args:
+            user_id: 使用者 ID
+            limit: 最多取回幾筆 (由新到舊，在 MongoDB 端截斷)；0 表示全部
         """
         self._lazy_init()
         
@@ -161,8 +721,8 @@ class RAGService:
             results = list(
                 self._user_history.find(
                     {"user_id": user_id},
-                    {"_id": 0}
-                ).sort("created_at", -1)
+                    {"_id": 0, "embedding": 0}
+                ).sort("created_at", -1).limit(limit)
             )
             
             logger.info(f"📂 user_history: 找到 {len(results)} 筆 (User: {user_id[:4]}***)")
@@ -173,7 +733,7 @@ class RAGService:
 
     def get_latest_user_record(self, user_id: str) -> Optional[Dict]:
         """取得用戶最新一筆紀錄"""
-        history = self.get_user_history_by_id(user_id)
+        history = self.get_user_history_by_id(user_id, limit=1)
         return history[0] if history else None
 
     def verify_against_history(
@@ -197,7 +757,36 @@ class RAGService:
                 "historical_data": {...}
             }
         """
-        history = self.get_user_history_by_id(user_id)
+        fingerprint = self._verify_fingerprint(current_data)
+        if fingerprint is not None:
+            cached = self._verify_cache.get(user_id)
+            if cached and fingerprint in cached:
+                return copy.deepcopy(cached[fingerprint])
+        
+        result = self._verify_uncached(user_id, current_data)
+        
+        # 只快取有歷史紀錄的結果；查無紀錄 (新戶或 MongoDB 暫時失敗) 下次仍重新查詢
+        if fingerprint is not None and result["has_history"]:
+            entries = dict(self._verify_cache.get(user_id) or {})
+            entries[fingerprint] = copy.deepcopy(result)
+            while len(entries) > _VERIFY_ENTRIES_PER_USER:
+                del entries[next(iter(entries))]
+            self._verify_cache.put(user_id, entries)
+        
+        return result
+
+    @staticmethod
+    def _verify_fingerprint(current_data: Dict):
+        """current_data 的快取指紋，含不可雜湊的值時回傳 None (不快取)"""
+        try:
+            return frozenset(current_data.items())
+        except TypeError:
+            return None
+
+    def _verify_uncached(self, user_id: str, current_data: Dict) -> Dict:
+        """verify_against_history 的實際比對 (查詢 user_history)"""
+        # 只比對最新一筆
+        history = self.get_user_history_by_id(user_id, limit=1)
         
         if not history:
             return {
@@ -211,39 +800,19 @@ class RAGService:
         latest = history[0]
         historical_data = latest.get("metadata", {})
         
-        mismatches = []
-        
-        # 職業比對
-        if current_data.get("job") and historical_data.get("hist_job"):
-            if current_data["job"] != historical_data["hist_job"]:
-                mismatches.append(("job", current_data["job"], historical_data["hist_job"]))
-        
-        # 收入比對 (允許 20% 誤差)
-        curr_income = current_data.get("income", 0) or 0
-        hist_income = historical_data.get("hist_income", 0) or 0
-        
-        if curr_income and hist_income:
-            variance = abs(curr_income - hist_income) / hist_income
-            if variance > 0.2:
-                mismatches.append(("income", curr_income, hist_income))
-        
-        # 電話比對
-        curr_phone = self._normalize_phone(current_data.get("phone", ""))
-        hist_phone = self._normalize_phone(historical_data.get("hist_phone", ""))
-        
-        if curr_phone and hist_phone and curr_phone != hist_phone:
-            mismatches.append(("phone", current_data.get("phone"), historical_data.get("hist_phone")))
+        # 職業 / 收入 (允許 20% 誤差) / 電話 依 _VERIFY_RULES 逐項比對
+        mismatches = [
+            (field, current, historical)
+            for field, hist_field, differs in _VERIFY_RULES
+            if (current := current_data.get(field))
+            and (historical := historical_data.get(hist_field))
+            and differs(current, historical)
+        ]
         
         # 風險分類
         has_default = historical_data.get("has_default_record", False)
         mismatch_count = len(mismatches)
-        
-        if has_default or mismatch_count >= 2:
-            risk_level = "HIGH"
-        elif mismatch_count == 1:
-            risk_level = "MEDIUM"
-        else:
-            risk_level = "LOW"
+        risk_level = "HIGH" if has_default else _RISK_BY_MISMATCH[min(mismatch_count, 2)]
         
         return {
             "has_history": True,
@@ -253,11 +822,7 @@ class RAGService:
             "historical_data": historical_data
         }
     
-    def _normalize_phone(self, phone: str) -> str:
-        """正規化電話號碼"""
-        if not phone:
-            return ""
-        return "".join(c for c in str(phone) if c.isdigit())
+    _normalize_phone = staticmethod(_normalize_phone)
 
     # ========================================
     # case_library Collection (FRE RAG 用)
@@ -282,19 +847,94 @@ class RAGService:
         """
         self._lazy_init()
         
-        if metadata is None:
-            metadata = {}
-        
         if self._case_library is None:
             logger.error("MongoDB case_library 未連線")
             return None
         
-        # 生成 embedding
-        embedding = self.get_embedding(content)
+        vector = None
+        if content and self._encoder is not None:
+            vector = self._encode_batch([content])[0]
+        
+        doc = self._build_case_doc(content, metadata, case_id, vector)
+        
+        try:
+            result = self._case_library.insert_one(doc)
+            self._invalidate_case_caches()
+            logger.info(f"💾 案例已存入 case_library")
+            return str(result.inserted_id)
+        except Exception as e:
+            logger.error(f"❌ case_library 寫入失敗: {e}")
+            return None
+
+    def add_cases_bulk(self, cases: List[Dict]) -> int:
+        """
+        批次新增案例到 case_library
+        
+        所有 content 合併成一次 encoder 呼叫，文件以單一
+        bulk_write (ordered=False) 寫入，N 筆只需一次 round trip
+        
+        Args:
+            cases: [{"content": str, "metadata": dict, "case_id": str (可選)}, ...]
+        
+        Returns:
+            成功寫入的筆數
+        """
+        self._lazy_init()
+        
+        if not cases:
+            return 0
+        
+        if self._case_library is None:
+            logger.error("MongoDB case_library 未連線")
+            return 0
+        
+        vectors = {}
+        if self._encoder is not None:
+            texts = [c["content"] for c in cases if c.get("content")]
+            vectors = dict(zip(texts, self._encode_batch(texts)))
+        
+        requests = [
+            InsertOne(self._build_case_doc(
+                c.get("content"), c.get("metadata"), c.get("case_id"), vectors.get(c.get("content"))
+            ))
+            for c in cases
+        ]
+        
+        try:
+            inserted = self._case_library.bulk_write(requests, ordered=False).inserted_count
+        except BulkWriteError as e:
+            # ordered=False: 其餘文件仍會寫入
+            inserted = e.details.get("nInserted", 0)
+            logger.error(f"❌ case_library 批次寫入部分失敗: {len(e.details.get('writeErrors', []))} 筆")
+        except Exception as e:
+            logger.error(f"❌ case_library 批次寫入失敗: {e}")
+            return 0
+        
+        if inserted:
+            self._invalidate_case_caches()
+        
+        logger.info(f"💾 {inserted}/{len(cases)} 筆案例已存入 case_library")
+        return inserted
+
+    @staticmethod
+    def _build_case_doc(
+        content: str,
+        metadata: Optional[Dict],
+        case_id: Optional[str],
+        vector: Optional[np.ndarray]
+    ) -> Dict:
+        """組出 case_library 文件 (add_case / add_cases_bulk 共用)"""
+        if metadata is None:
+            metadata = {}
+        
+        # 寫入時先把審核結果解析成 bool，統計時不必再逐筆比對字串
+        if "final_decision" in metadata and "is_approved" not in metadata:
+            metadata = {**metadata, "is_approved": is_approved_decision(metadata["final_decision"])}
         
         doc = {
             "content": content,
-            "embedding": embedding,
+            # 寫入時才轉成 BSON vector
+            "embedding": to_stored_embedding(vector) if vector is not None else [],
             "metadata": metadata,
             "created_at": time.time()
         }
@@ -302,13 +942,13 @@ class RAGService:
         if case_id:
             doc["case_id"] = case_id
         
-        try:
-            result = self._case_library.insert_one(doc)
-            logger.info(f"💾 案例已存入 case_library")
-            return str(result.inserted_id)
-        except Exception as e:
-            logger.error(f"❌ case_library 寫入失敗: {e}")
-            return None
+        return doc
+
+    def _invalidate_case_caches(self):
+        """case_library 有新增時，清空所有搜尋相關快取"""
+        self._search_cache.clear()
+        self._semantic_cache.clear()
+        self._decision_cache.clear()
 
     def search_similar_cases(
         self, 
@@ -341,45 +981,22 @@ class RAGService:
         if query_text is None and profile:
             query_text = self._profile_to_query(profile)
         
+        if query_text:
+            query_text = query_text.strip()
+        
         if not query_text:
             logger.warning("沒有查詢文字")
             return []
         
-        query_vector = self.get_embedding(query_text)
-        
-        if not query_vector:
-            return []
-        
-        # MongoDB Atlas Vector Search
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "vector_index",
-                    "path": "embedding",
-                    "queryVector": query_vector,
-                    "numCandidates": 100,
-                    "limit": top_k
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "content": 1,
-                    "metadata": 1,
-                    "created_at": 1,
-                    "score": {"$meta": "vectorSearchScore"}
-                }
-            }
-        ]
-        
         try:
-            results = list(self._case_library.aggregate(pipeline))
+            results = self._search_cached(query_text, top_k)
             
-            # 過濾低分
+            # 過濾低分 (快取的是未過濾的結果，不同 min_score 可共用)
             if min_score is None:
                 min_score = self.SIMILARITY_THRESHOLD
             
-            results = [r for r in results if r.get("score", 0) >= min_score]
+            # 回傳副本，呼叫端修改案例不會影響快取
+            results = [copy.deepcopy(r) for r in results if r.get("score", 0) >= min_score]
             
             logger.info(f"🔍 case_library Vector Search: 找到 {len(results)} 筆相似案例")
             return results
@@ -389,21 +1006,73 @@ class RAGService:
             # Fallback: 簡單搜尋
             return self._fallback_search(query_text, top_k)
     
-    def _profile_to_query(self, profile: Dict) -> str:
-        """將 profile 轉為查詢文字"""
-        parts = []
+    def _search_cached(self, query_text: str, top_k: int) -> Tuple[Dict, ...]:
+        """_vector_search 加上 (query_text, top_k) 的 TTL 快取"""
+        key = (query_text, top_k)
+        results = self._search_cache.get(key)
+        if results is None:
+            results = self._vector_search(query_text, top_k)
+            self._search_cache.put(key, results)
+        return results
+    
+    def _vector_search(self, query_text: str, top_k: int) -> Tuple[Dict, ...]:
+        """
+        MongoDB Atlas Vector Search (經 self._search_cached 包裝)
         
-        if profile.get("job"):
-            parts.append(f"職業:{profile['job']}")
-        if profile.get("income"):
-            parts.append(f"月薪:{profile['income']}")
-        if profile.get("amount"):
-            parts.append(f"貸款金額:{profile['amount']}")
-        if profile.get("purpose") or profile.get("loan_purpose"):
-            purpose = profile.get("purpose") or profile.get("loan_purpose")
-            parts.append(f"用途:{purpose}")
+        回傳 tuple 供快取共用，案例 dict 請勿修改；
+        查詢失敗時直接拋出例外，不會被快取
+        """
+        # embedding 全程維持 float32 ndarray，只有組 pipeline 時才轉成 list 交給 PyMongo
+        query_vector = self._encode_batch([query_text])[0]
         
-        return "，".join(parts)
+        tag = tuple(_NUMBER_RE.findall(query_text))
+        
+        cached = self._semantic_cache.get(query_vector, top_k, tag)
+        if cached is not None:
+            return cached
+        
+        pipeline = build_vector_search_pipeline(query_vector.tolist(), top_k)
+        docs = list(self._case_library.aggregate(pipeline))
+        
+        results = tuple({k: v for k, v in doc.items() if k != "_id"} for doc in docs)
+        
+        # 每個案例都有同維度的 embedding 才能在命中時重算 score，否則不放進語意快取
+        case_vectors = self._case_vectors([doc.get("_id") for doc in docs], query_vector.shape[0])
+        if case_vectors is not None:
+            self._semantic_cache.put(query_vector, top_k, tag, results, case_vectors)
+        
+        return results
+    
+    def _case_vectors(self, ids: List, dim: int) -> Optional[np.ndarray]:
+        """
+        依 _id 取回案例 embedding，組成 (len(ids), dim) 矩陣 (只在語意快取未命中時查詢)
+        
+        缺 _id、缺 embedding、維度不符或查詢失敗時回傳 None
+        """
+        if not ids:
+            return np.empty((0, dim), np.float32)
+        if any(i is None for i in ids):
+            return None
+        
+        try:
+            cursor = self._case_library.find({"_id": {"$in": ids}}, {"embedding": 1})
+            stored = {doc["_id"]: doc.get("embedding") for doc in cursor}
+        except Exception as e:
+            logger.warning(f"⚠️ 讀取案例 embedding 失敗: {e}")
+            return None
+        
+        vectors = [from_stored_embedding(stored.get(i)) for i in ids]
+        if not all(v is not None and v.shape == (dim,) for v in vectors):
+            return None
+        return np.stack(vectors)
+    
+    def _profile_to_query(self, profile: Dict) -> str:
+        """將 profile 轉為查詢文字 (沒有值的欄位略過)"""
+        return "，".join(
+            f"{label}:{value}"
+            for label, keys in _QUERY_FIELDS
+            if (value := next(filter(None, map(profile.get, keys)), None))
+        )
     
     def _fallback_search(self, query_text: str, top_k: int) -> List[Dict]:
         """備援搜尋 (當 Vector Search 不可用時)"""
@@ -443,16 +1112,27 @@ class RAGService:
         Returns:
             {
                 "similar_cases": [...],
-                "approval_rate": float,  # 相似案例核准率
+                "approved_count": int,  # 核准案例數
+                "total_count": int,  # 相似案例數
+                "approval_rate": float,  # 相似案例核准率 (approved_count / total_count)
                 "avg_approved_amount": float,  # 平均核准金額
                 "recommendation": str  # 建議
             }
         """
+        # _profile_to_query 欄位順序固定，可直接當作 profile 的簽章
+        cache_key = (self._profile_to_query(profile or {}), dve_risk_level, top_k)
+        cached = self._decision_cache.get(cache_key)
+        if cached is not None:
+            # 快取中的 similar_cases 與案例 dict 不可外流，每次回傳完整副本
+            return copy.deepcopy(cached)
+        
         similar_cases = self.search_similar_cases(profile=profile, top_k=top_k)
         
         if not similar_cases:
             return {
                 "similar_cases": [],
+                "approved_count": 0,
+                "total_count": 0,
                 "approval_rate": None,
                 "avg_approved_amount": None,
                 "recommendation": "無相似案例參考，建議人工審核"
@@ -464,9 +1144,13 @@ class RAGService:
         
         for case in similar_cases:
             meta = case.get("metadata", {})
-            decision = meta.get("final_decision", "")
+            approved = meta.get("is_approved")
+            
+            # 舊案例沒有 is_approved，退回解析 final_decision
+            if approved is None:
+                approved = is_approved_decision(meta.get("final_decision", ""))
             
-            if "PASS" in decision or "核准" in decision:
+            if approved:
                 approved_count += 1
                 total_approved_amount += meta.get("approved_amount", 0)
         
@@ -483,12 +1167,17 @@ class RAGService:
         else:
             recommendation = f"相似案例核准率僅 {approval_rate:.0%}，建議拒絕"
         
-        return {
+        # 只快取有案例的結果 (查無案例可能是服務暫時未就緒)
+        reference = {
             "similar_cases": similar_cases,
+            "approved_count": approved_count,
+            "total_count": len(similar_cases),
             "approval_rate": approval_rate,
             "avg_approved_amount": avg_amount,
             "recommendation": recommendation
         }
+        self._decision_cache.put(cache_key, copy.deepcopy(reference))
+        return reference
 
     # ========================================
     # 向下相容 (舊的 API)
@@ -6,11 +6,14 @@ conftest.py - pytest 自動載入
 import pytest
 import sys
 import os
-from unittest.mock import MagicMock, patch
+from types import MappingProxyType
+from unittest.mock import MagicMock, Mock, create_autospec, patch
 from typing import Dict, Any
 
-# 確保可以 import 專案模組
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 確保可以 import 專案模組 (只插入一次，避免 sys.path 重複膨脹)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
 
 
 # ==========================================
@@ -184,6 +187,24 @@ def sample_fre_task_data():
     }
 
 
+# ==========================================
+# 🧩 Shared Instances (Session Scope)
+# ==========================================
+
+@pytest.fixture(scope="session")
+def field_schema():
+    """共用的 FieldSchema (唯讀，整個 session 只建立一次)"""
+    from conversation.field_schema import FieldSchema
+    return FieldSchema()
+
+
+@pytest.fixture(scope="session")
+def gemini_client():
+    """共用的 GeminiClient (無狀態，整個 session 只建立一次)"""
+    from conversation.gemini_client import GeminiClient
+    return GeminiClient()
+
+
 # ==========================================
 # 🔧 Mock Fixtures
 # ==========================================
@@ -209,6 +230,106 @@ def mock_mongodb():
     return mock
 
 
+# RAGService 使用的 collection 名稱
+_RAG_COLLECTIONS = ("user_history", "case_library")
+
+
+@pytest.fixture(scope="session")
+def _collection_spec_mocks():
+    """
+    每個 collection 各一個依 pymongo Collection 規格建立的 Mock (同一 session 只建立一次)
+    
+    create_autospec 會檢查方法名稱與參數，打錯時直接報錯
+    """
+    from pymongo.collection import Collection
+    return {name: create_autospec(Collection, instance=True) for name in _RAG_COLLECTIONS}
+
+
+def _wire_collection_defaults(collection):
+    """預設行為: 查詢皆回傳空結果，寫入回傳固定的 id"""
+    cursor = MagicMock()
+    cursor.sort.return_value.limit.return_value = []
+    cursor.limit.return_value = []
+    collection.find.return_value = cursor
+    collection.aggregate.return_value = []
+    collection.insert_one.return_value = MagicMock(inserted_id="mock_id")
+    collection.bulk_write.return_value = MagicMock(inserted_count=0)
+
+
+@pytest.fixture
+def rag_mock_collections(_collection_spec_mocks):
+    """
+    collection 名稱 → spec mock
+    
+    每個測試前清除呼叫紀錄與回傳值設定，再接上預設的 cursor / aggregate 行為
+    """
+    for collection in _collection_spec_mocks.values():
+        collection.reset_mock(return_value=True, side_effect=True)
+        _wire_collection_defaults(collection)
+    return _collection_spec_mocks
+
+
+@pytest.fixture
+def rag_mock_db(rag_mock_collections):
+    """注入 RAGService(db=...) 用的資料庫 Mock，依名稱回傳各自的 collection mock"""
+    mock = Mock()
+    mock.get_collection.side_effect = rag_mock_collections.__getitem__
+    return mock
+
+
+# 對話尚未開始時的 Session Profile (唯讀樣板，使用時複製)
+EMPTY_SESSION_PROFILE = MappingProxyType({
+    "name": None,
+    "id": None,
+    "phone": None,
+    "job": None,
+    "income": None,
+    "loan_purpose": None,
+    "amount": None,
+    "last_asked_field": None,
+    "retry_count": 0
+})
+
+# 七個必填欄位皆已填寫的 profile (唯讀，需要修改時請先複製)
+COMPLETE_PROFILE = MappingProxyType({
+    "name": "王小明",
+    "id": "A123456789",
+    "phone": "0912345678",
+    "job": "工程師",
+    "income": 50000,
+    "loan_purpose": "購車",
+    "amount": 500000
+})
+
+
+@pytest.fixture(scope="session")
+def make_session_manager():
+    """
+    Mock Session Manager 的 factory
+    
+    每次呼叫回傳新的輕量 Mock，profile 為樣板的複本 (可安全修改)
+    """
+    def _make(profile: Dict = None):
+        state = dict(EMPTY_SESSION_PROFILE if profile is None else profile)
+        mock = Mock()
+        mock.get_profile.return_value = state
+        mock.get_history.return_value = []
+        mock.update_profile.return_value = state
+        return mock
+    return _make
+
+
+@pytest.fixture(scope="session")
+def make_gemini_client():
+    """Mock Gemini Client 的 factory"""
+    def _make(question: str = "請問您的姓名是?", extracted: Dict = None):
+        mock = Mock()
+        mock.ask_question.return_value = question
+        mock.extract_slots.return_value = extracted or {}
+        return mock
+    return _make
+
+
 @pytest.fixture
 def mock_gemini_response():
     """Mock Gemini API Response"""
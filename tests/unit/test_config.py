@@ -4,133 +4,110 @@ config.py 單元測試
 """
 
 import pytest
-import sys
 import os
+import torch
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+@pytest.fixture(scope="module")
+def cfg():
+    """config 模組 (整個檔案只 import 一次；未設定 GEMINI_API_KEY 時 import 會失敗，只影響用到它的測試)"""
+    import config
+    return config
 
 
 class TestConfig:
     """配置測試"""
     
-    def test_device_detection(self):
+    def test_device_detection(self, cfg):
         """測試設備檢測"""
-        from config import DEVICE
-        import torch
-        
         # 應該是 cuda 或 cpu
-        assert DEVICE.type in ["cuda", "cpu"]
+        assert cfg.DEVICE.type in ["cuda", "cpu"]
         
         # 如果有 GPU，應該檢測到
         if torch.cuda.is_available():
-            assert DEVICE.type == "cuda"
+            assert cfg.DEVICE.type == "cuda"
         else:
-            assert DEVICE.type == "cpu"
+            assert cfg.DEVICE.type == "cpu"
     
-    def test_path_configuration(self):
+    def test_path_configuration(self, cfg):
         """測試路徑配置"""
-        from config import BASE_DIR, MOE_MODEL_PATH, LDE_ADAPTER_PATH
-        
-        assert os.path.isabs(BASE_DIR), "BASE_DIR 應該是絕對路徑"
-        assert "moe" in MOE_MODEL_PATH, "MOE_MODEL_PATH 應該包含 moe"
-        assert "LDE" in LDE_ADAPTER_PATH, "LDE_ADAPTER_PATH 應該包含 LDE"
+        assert os.path.isabs(cfg.BASE_DIR), "BASE_DIR 應該是絕對路徑"
+        assert "moe" in cfg.MOE_MODEL_PATH, "MOE_MODEL_PATH 應該包含 moe"
+        assert "LDE" in cfg.LDE_ADAPTER_PATH, "LDE_ADAPTER_PATH 應該包含 LDE"
     
-    def test_label_mappings(self):
+    def test_label_mappings(self, cfg):
         """測試標籤映射"""
-        from config import ID2LABEL, LABEL2ID
-        
         # 應該有 3 個專家
-        assert len(ID2LABEL) == 3
-        assert len(LABEL2ID) == 3
+        assert len(cfg.ID2LABEL) == 3
+        assert len(cfg.LABEL2ID) == 3
         
         # 雙向映射應該一致
-        for idx, label in ID2LABEL.items():
-            assert LABEL2ID[label] == idx
+        for idx, label in enumerate(cfg.ID2LABEL):
+            assert cfg.LABEL2ID[label] == idx
         
         # 必須包含所有專家
-        assert "LDE" in LABEL2ID
-        assert "DVE" in LABEL2ID
-        assert "FRE" in LABEL2ID
+        assert "LDE" in cfg.LABEL2ID
+        assert "DVE" in cfg.LABEL2ID
+        assert "FRE" in cfg.LABEL2ID
     
-    def test_status_mapping(self):
+    def test_status_mapping(self, cfg):
         """測試狀態映射"""
-        from config import STATUS_MAP
-        
         required_statuses = ["unknown", "pending", "verified", "mismatch"]
         for status in required_statuses:
-            assert status in STATUS_MAP, f"STATUS_MAP 應該包含 {status}"
+            assert status in cfg.STATUS_MAP, f"STATUS_MAP 應該包含 {status}"
     
-    def test_prompt_templates(self):
+    def test_prompt_templates(self, cfg):
         """測試 Prompt Templates"""
-        from config import (
-            LDE_PROMPT_TEMPLATE,
-            DVE_PROMPT_TEMPLATE,
-            FRE_PROMPT_TEMPLATE
-        )
-        
         # 每個 template 應該有佔位符
-        assert "{instruction}" in LDE_PROMPT_TEMPLATE
-        assert "{input_text}" in LDE_PROMPT_TEMPLATE
+        assert "{instruction}" in cfg.LDE_PROMPT_TEMPLATE
+        assert "{input_text}" in cfg.LDE_PROMPT_TEMPLATE
         
-        assert "{instruction}" in DVE_PROMPT_TEMPLATE
-        assert "{input_text}" in DVE_PROMPT_TEMPLATE
+        assert "{instruction}" in cfg.DVE_PROMPT_TEMPLATE
+        assert "{input_text}" in cfg.DVE_PROMPT_TEMPLATE
         
-        assert "{instruction}" in FRE_PROMPT_TEMPLATE
-        assert "{input_text}" in FRE_PROMPT_TEMPLATE
+        assert "{instruction}" in cfg.FRE_PROMPT_TEMPLATE
+        assert "{input_text}" in cfg.FRE_PROMPT_TEMPLATE
     
-    def test_threshold_values(self):
+    def test_threshold_values(self, cfg):
         """測試閾值設定"""
-        from config import (
-            RISK_THRESHOLD_HIGH,
-            RISK_THRESHOLD_LOW,
-            CONFIDENCE_THRESHOLD
-        )
-        
         # 閾值應該在合理範圍
-        assert 0 < RISK_THRESHOLD_LOW < RISK_THRESHOLD_HIGH < 1
-        assert 0 < CONFIDENCE_THRESHOLD < 1
+        assert 0 < cfg.RISK_THRESHOLD_LOW < cfg.RISK_THRESHOLD_HIGH < 1
+        assert 0 < cfg.CONFIDENCE_THRESHOLD < 1
     
-    def test_risk_keywords(self):
+    def test_risk_keywords(self, cfg):
         """測試風險關鍵字"""
-        from config import RISK_HIGH_KWS, RISK_LOW_KWS
-        
-        assert len(RISK_HIGH_KWS) > 0, "高風險關鍵字不應為空"
-        assert len(RISK_LOW_KWS) > 0, "低風險關鍵字不應為空"
-        
-        # 確保沒有重疊
-        overlap = set(RISK_HIGH_KWS) & set(RISK_LOW_KWS)
-        assert len(overlap) == 0, f"高低風險關鍵字不應重疊: {overlap}"
+        assert len(cfg.RISK_HIGH_KWS) > 0, "高風險關鍵字不應為空"
+        assert len(cfg.RISK_LOW_KWS) > 0, "低風險關鍵字不應為空"
+        
+        # 確保沒有重疊 (isdisjoint 遇到第一個重疊即返回)
+        high_kws = frozenset(cfg.RISK_HIGH_KWS)
+        low_kws = frozenset(cfg.RISK_LOW_KWS)
+        assert high_kws.isdisjoint(low_kws), \
+            f"高低風險關鍵字不應重疊: {high_kws & low_kws}"
     
-    def test_get_loss_weights(self):
+    def test_get_loss_weights(self, cfg):
         """測試損失權重函數"""
-        from config import get_loss_weights, DEVICE
-        
-        weights = get_loss_weights()
+        weights = cfg.get_loss_weights()
         
         assert weights.shape[0] == 3, "應該有 3 個權重 (對應 3 個專家)"
-        assert weights.device.type == DEVICE.type, "權重應該在正確的設備上"
+        assert weights.device.type == cfg.DEVICE.type, "權重應該在正確的設備上"
 
 
 class TestConfigEnvironment:
     """環境變數測試"""
     
+    # 這個測試需要 .env 檔案或環境變數，CI 環境未設定時直接跳過
+    @pytest.mark.skipif(not os.getenv("GEMINI_API_KEY"), reason="GEMINI_API_KEY 未設定")
     def test_gemini_api_key_loaded(self):
         """測試 Gemini API Key 載入"""
-        # 這個測試需要 .env 檔案存在
-        # 在 CI 環境可能會失敗，標記為可選
-        try:
-            from config import GEMINI_API_KEY
-            assert GEMINI_API_KEY is not None
-            assert len(GEMINI_API_KEY) > 0
-        except ValueError:
-            pytest.skip("GEMINI_API_KEY 未設定")
+        from config import GEMINI_API_KEY
+        
+        assert GEMINI_API_KEY
     
-    def test_redis_config(self):
+    def test_redis_config(self, cfg):
         """測試 Redis 配置"""
-        from config import REDIS_HOST, REDIS_PORT, REDIS_DB, SESSION_TTL
-        
-        assert isinstance(REDIS_HOST, str)
-        assert isinstance(REDIS_PORT, int)
-        assert isinstance(REDIS_DB, int)
-        assert isinstance(SESSION_TTL, int)
-        assert SESSION_TTL > 0
+        assert isinstance(cfg.REDIS_HOST, str)
+        assert isinstance(cfg.REDIS_PORT, int)
+        assert isinstance(cfg.REDIS_DB, int)
+        assert isinstance(cfg.SESSION_TTL, int)
+        assert cfg.SESSION_TTL > 0
@@ -4,11 +4,14 @@ conversation 模組單元測試
 """
 
 import pytest
-import sys
-import os
-from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+from unittest.mock import patch
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from tests.conftest import COMPLETE_PROFILE
+
+
+# 同一 worker 執行，重用 session-scope 的 field_schema / gemini_client
+pytestmark = pytest.mark.xdist_group("conversation_unit")
 
 
 class TestFieldSchema:
@@ -84,67 +87,28 @@ class TestFieldSchema:
 class TestFieldSchemaManager:
     """欄位 Schema 管理器測試"""
     
-    def test_get_missing_fields_empty(self):
-        """測試空 profile 的缺失欄位"""
-        from conversation.field_schema import FieldSchema
-        
-        schema = FieldSchema()
-        profile = {}
-        
-        missing = schema.get_missing_fields(profile)
-        
-        # 應該回傳所有必填欄位
-        assert "name" in missing
-        assert "id" in missing
-        assert "phone" in missing
-        assert "job" in missing
-        assert "income" in missing
-        assert "loan_purpose" in missing
-        assert "amount" in missing
-    
-    def test_get_missing_fields_partial(self):
-        """測試部分填寫的缺失欄位"""
-        from conversation.field_schema import FieldSchema
-        
-        schema = FieldSchema()
-        profile = {
-            "name": "王小明",
-            "id": "A123456789"
-        }
-        
-        missing = schema.get_missing_fields(profile)
-        
-        assert "name" not in missing
-        assert "id" not in missing
-        assert "phone" in missing
-    
-    def test_get_missing_fields_complete(self):
-        """測試完整填寫"""
-        from conversation.field_schema import FieldSchema
-        
-        schema = FieldSchema()
-        profile = {
-            "name": "王小明",
-            "id": "A123456789",
-            "phone": "0912345678",
-            "job": "工程師",
-            "income": 50000,
-            "loan_purpose": "購車",
-            "amount": 500000
-        }
-        
-        missing = schema.get_missing_fields(profile)
-        
-        assert len(missing) == 0
+    @pytest.mark.parametrize("profile,expected_missing", [
+        # 空 profile: 應該回傳所有必填欄位
+        ({}, {"name", "id", "phone", "job", "income", "loan_purpose", "amount"}),
+        # 部分填寫
+        (
+            {"name": "王小明", "id": "A123456789"},
+            {"phone", "job", "income", "loan_purpose", "amount"}
+        ),
+        # 完整填寫
+        (COMPLETE_PROFILE, set()),
+    ], ids=["empty", "partial", "complete"])
+    def test_get_missing_fields(self, field_schema, profile, expected_missing):
+        """測試缺失欄位判斷"""
+        missing = field_schema.get_missing_fields(profile)
+        
+        assert set(missing) == expected_missing
     
-    def test_field_priority_order(self):
+    def test_field_priority_order(self, field_schema):
         """測試欄位優先順序"""
-        from conversation.field_schema import FieldSchema
-        
-        schema = FieldSchema()
         profile = {}
         
-        missing = schema.get_missing_fields(profile)
+        missing = field_schema.get_missing_fields(profile)
         
         # 應該按優先級排序
         # name (1) < id (2) < phone (3) < ...
@@ -152,25 +116,20 @@ class TestFieldSchemaManager:
         assert missing[1] == "id"
         assert missing[2] == "phone"
     
-    def test_all_required_filled(self):
+    def test_all_required_filled(self, field_schema):
         """測試全部必填檢查"""
-        from conversation.field_schema import FieldSchema
+        incomplete = {"name": "王小明"}
+        assert field_schema.all_required_filled(incomplete) is False
+        
+        assert field_schema.all_required_filled(COMPLETE_PROFILE) is True
+    
+    def test_missing_fields_keep_priority_order(self, field_schema):
+        """測試部分填寫時仍依優先級輸出，空字串視為未填、0 視為已填"""
+        profile = {"name": "王小明", "phone": "", "income": 0, "company": None}
         
-        schema = FieldSchema()
+        missing = field_schema.get_missing_fields(profile)
         
-        incomplete = {"name": "王小明"}
-        assert schema.all_required_filled(incomplete) is False
-        
-        complete = {
-            "name": "王小明",
-            "id": "A123456789",
-            "phone": "0912345678",
-            "job": "工程師",
-            "income": 50000,
-            "loan_purpose": "購車",
-            "amount": 500000
-        }
-        assert schema.all_required_filled(complete) is True
+        assert missing == ["id", "phone", "job", "loan_purpose", "amount"]
 
 
 class TestUtils:
@@ -200,117 +159,86 @@ class TestUtils:
         assert normalize_tw_phone("") is None
         assert normalize_tw_phone(None) is None
     
-    def test_parse_tw_amount_wan(self):
-        """測試萬元單位解析"""
+    @pytest.mark.parametrize("text,expected", [
+        # 萬元單位
+        ("5萬", 50000),
+        ("50萬", 500000),
+        ("1.5萬", 15000),
+        # K 單位
+        ("100k", 100000),
+        ("100K", 100000),
+        ("50k", 50000),
+        # M 單位
+        ("1m", 1000000),
+        ("1.5M", 1500000),
+        # 純數字
+        ("50000", 50000),
+        ("1,000,000", 1000000),
+        (50000, 50000),
+    ])
+    def test_parse_tw_amount(self, text, expected):
+        """測試台灣常見金額表達解析"""
         from conversation.utils import parse_tw_amount
         
-        assert parse_tw_amount("5萬") == 50000
-        assert parse_tw_amount("50萬") == 500000
-        assert parse_tw_amount("1.5萬") == 15000
+        assert parse_tw_amount(text) == expected
     
-    def test_parse_tw_amount_k(self):
-        """測試 K 單位解析"""
-        from conversation.utils import parse_tw_amount
-        
-        assert parse_tw_amount("100k") == 100000
-        assert parse_tw_amount("100K") == 100000
-        assert parse_tw_amount("50k") == 50000
-    
-    def test_parse_tw_amount_m(self):
-        """測試 M 單位解析"""
-        from conversation.utils import parse_tw_amount
-        
-        assert parse_tw_amount("1m") == 1000000
-        assert parse_tw_amount("1.5M") == 1500000
-    
-    def test_parse_tw_amount_pure_number(self):
-        """測試純數字解析"""
-        from conversation.utils import parse_tw_amount
-        
-        assert parse_tw_amount("50000") == 50000
-        assert parse_tw_amount("1,000,000") == 1000000
-        assert parse_tw_amount(50000) == 50000
-    
-    def test_validate_tw_id_valid(self):
-        """測試有效身分證字號"""
-        from conversation.utils import validate_tw_id
-        
-        # 這些是通過檢查碼驗證的測試用身分證字號
-        # 注意：這些是符合檢查碼演算法的測試資料，非真實身分證
-        assert validate_tw_id("A123456789") is True  # A=10, 總和=130, 130%10=0 ✓
-        assert validate_tw_id("B134370951") is True  # 另一個有效格式
-        assert validate_tw_id("F105666362") is True  # 另一個有效格式
-    
-    def test_validate_tw_id_invalid(self):
-        """測試無效身分證字號"""
+    # 這些是通過檢查碼驗證的測試用身分證字號
+    # 注意：這些是符合檢查碼演算法的測試資料，非真實身分證
+    @pytest.mark.parametrize("id_str,expected", [
+        ("A123456789", True),    # A=10, 總和=130, 130%10=0 ✓
+        ("B134370951", True),    # 另一個有效格式
+        ("F105666362", True),    # 另一個有效格式
+        ("123456789", False),    # 缺少英文
+        ("A12345678", False),    # 長度不足
+        ("AA12345678", False),   # 兩個英文
+        ("", False),
+        (None, False),
+    ])
+    def test_validate_tw_id(self, id_str, expected):
+        """測試身分證字號驗證"""
         from conversation.utils import validate_tw_id
         
-        assert validate_tw_id("123456789") is False   # 缺少英文
-        assert validate_tw_id("A12345678") is False   # 長度不足
-        assert validate_tw_id("AA12345678") is False  # 兩個英文
-        assert validate_tw_id("") is False
-        assert validate_tw_id(None) is False
+        assert validate_tw_id(id_str) is expected
 
 
 class TestGeminiClient:
     """Gemini Client 測試"""
     
-    def test_ask_question_standard(self):
+    def test_ask_question_standard(self, gemini_client):
         """測試標準問題生成"""
-        from conversation.gemini_client import GeminiClient
-        
-        client = GeminiClient()
-        
-        question = client.ask_question("name", "standard")
+        question = gemini_client.ask_question("name", "standard")
         assert "姓名" in question
         
-        question = client.ask_question("income", "standard")
+        question = gemini_client.ask_question("income", "standard")
         assert "收入" in question
     
-    def test_ask_question_retry(self):
+    def test_ask_question_retry(self, gemini_client):
         """測試重試問題生成"""
-        from conversation.gemini_client import GeminiClient
-        
-        client = GeminiClient()
-        
-        question = client.ask_question("phone", "retry")
+        question = gemini_client.ask_question("phone", "retry")
         assert "09" in question or "手機" in question
     
-    def test_ask_question_unknown_field(self):
+    def test_ask_question_unknown_field(self, gemini_client):
         """測試未知欄位"""
-        from conversation.gemini_client import GeminiClient
-        
-        client = GeminiClient()
-        
-        question = client.ask_question("unknown_field", "standard")
+        question = gemini_client.ask_question("unknown_field", "standard")
         assert "unknown_field" in question
     
-    @patch('conversation.gemini_client.client.models.generate_content')
-    def test_extract_slots_success(self, mock_generate):
+    def test_extract_slots_success(self, gemini_client):
         """測試欄位抽取成功"""
-        from conversation.gemini_client import GeminiClient
-        
-        mock_response = MagicMock()
-        mock_response.text = '{"name": "王小明", "income": 50000}'
-        mock_generate.return_value = mock_response
+        response = SimpleNamespace(text='{"name": "王小明", "income": 50000}')
         
-        client = GeminiClient()
-        result = client.extract_slots("我叫王小明，月薪5萬", ["name", "income"])
+        # 只替換共用 client 的網路呼叫
+        with patch.object(gemini_client.model, "generate_content", return_value=response):
+            result = gemini_client.extract_slots("我叫王小明，月薪5萬", ["name", "income"])
         
         assert result.get("name") == "王小明"
         assert result.get("income") == 50000
     
-    @patch('conversation.gemini_client.client.models.generate_content')
-    def test_extract_slots_with_amount_conversion(self, mock_generate):
+    def test_extract_slots_with_amount_conversion(self, gemini_client):
         """測試金額轉換"""
-        from conversation.gemini_client import GeminiClient
+        response = SimpleNamespace(text='{"amount": "50萬"}')
         
-        mock_response = MagicMock()
-        mock_response.text = '{"amount": "50萬"}'
-        mock_generate.return_value = mock_response
-        
-        client = GeminiClient()
-        result = client.extract_slots("想借50萬", ["amount"])
+        with patch.object(gemini_client.model, "generate_content", return_value=response):
+            result = gemini_client.extract_slots("想借50萬", ["amount"])
         
         assert result.get("amount") == 500000
 
@@ -318,42 +246,15 @@ class TestGeminiClient:
 class TestConversationManager:
     """對話管理器測試"""
     
-    @pytest.fixture
-    def mock_session_manager(self):
-        """Mock Session Manager"""
-        mock = MagicMock()
-        mock.get_profile.return_value = {
-            "name": None,
-            "id": None,
-            "phone": None,
-            "job": None,
-            "income": None,
-            "loan_purpose": None,
-            "amount": None,
-            "last_asked_field": None,
-            "retry_count": 0
-        }
-        mock.get_history.return_value = []
-        mock.update_profile.return_value = mock.get_profile.return_value
-        return mock
-    
-    @pytest.fixture
-    def mock_gemini_client(self):
-        """Mock Gemini Client"""
-        mock = MagicMock()
-        mock.ask_question.return_value = "請問您的姓名是?"
-        mock.extract_slots.return_value = {}
-        return mock
-    
-    def test_handle_turn_collecting(self, mock_session_manager, mock_gemini_client):
+    def test_handle_turn_collecting(self, make_session_manager, make_gemini_client, field_schema):
         """測試資料收集中的狀態"""
         from conversation.conversation_manager import ConversationManager
-        from conversation.field_schema import FieldSchema
         
+        session_manager = make_session_manager()
         manager = ConversationManager(
-            mock_session_manager,
-            FieldSchema(),
-            mock_gemini_client
+            session_manager,
+            field_schema,
+            make_gemini_client()
         )
         
         result = manager.handle_turn("user_001", "你好")
@@ -361,32 +262,176 @@ class TestConversationManager:
         assert result["status"] == "COLLECTING"
         assert "response" in result
         assert "missing_fields" in result
+        
+        # 使用者輸入與回覆一起寫入歷史，共用本輪時間戳
+        session_manager.add_message.assert_not_called()
+        session_manager.add_messages.assert_called_once()
+        messages = session_manager.add_messages.call_args.args[0]
+        assert messages == [
+            {"role": "user", "content": "你好"},
+            {"role": "assistant", "content": result["response"]}
+        ]
+        assert session_manager.add_messages.call_args.kwargs["now"] == \
+            session_manager.update_profile.call_args.kwargs["now"]
     
-    def test_handle_turn_ready_for_moe(self, mock_session_manager, mock_gemini_client):
+    def test_handle_turn_ready_for_moe(self, make_session_manager, make_gemini_client, field_schema):
         """測試資料收集完成"""
         from conversation.conversation_manager import ConversationManager
-        from conversation.field_schema import FieldSchema
         
         # 設定完整 profile
-        mock_session_manager.get_profile.return_value = {
-            "name": "王小明",
-            "id": "A123456789",
-            "phone": "0912345678",
-            "job": "工程師",
-            "income": 50000,
-            "loan_purpose": "購車",
-            "amount": 500000,
+        session_manager = make_session_manager({
+            **COMPLETE_PROFILE,
             "last_asked_field": None,
             "retry_count": 0
-        }
+        })
         
         manager = ConversationManager(
-            mock_session_manager,
-            FieldSchema(),
-            mock_gemini_client
+            session_manager,
+            field_schema,
+            make_gemini_client()
         )
         
         result = manager.handle_turn("user_001", "完成")
         
         assert result["status"] == "READY_FOR_MOE"
         assert "summary" in result
+
+
+class TestUserSessionManagerHistory:
+    """對話紀錄讀取測試"""
+    
+    def test_get_history_fetches_tail_only(self):
+        """測試只向 Redis 取回最後 N 筆"""
+        from conversation.user_session_manager import UserSessionManager
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            mock_redis.lrange.return_value = [
+                '{"role": "user", "content": "訊息1", "timestamp": 1000}',
+                'invalid json {'
+            ]
+            
+            session = UserSessionManager("user_001")
+            history = session.get_history(limit=20)
+        
+        mock_redis.lrange.assert_called_once_with("loan:history:user_001", -20, -1)
+        assert history == [{"role": "user", "content": "訊息1", "timestamp": 1000}]
+    
+    def test_get_history_batch_decode(self):
+        """測試全部訊息皆有效時整批 decode，順序不變"""
+        from conversation.user_session_manager import UserSessionManager
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            mock_redis.lrange.return_value = [
+                '{"role": "user", "content": "訊息1", "timestamp": 1000}',
+                '{"role": "assistant", "content": "回覆1", "timestamp": 1001}'
+            ]
+            
+            history = UserSessionManager("user_001").get_history()
+        
+        assert [m["content"] for m in history] == ["訊息1", "回覆1"]
+    
+    def test_get_history_non_positive_limit(self):
+        """測試 limit <= 0 不會讀取整條 list"""
+        from conversation.user_session_manager import UserSessionManager
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            session = UserSessionManager("user_001")
+            
+            assert session.get_history(limit=0) == []
+            mock_redis.lrange.assert_not_called()
+
+
+class TestUserSessionManagerWrites:
+    """對話紀錄 / Session 寫入測試"""
+    
+    def test_add_messages_single_rpush(self):
+        """測試批次新增只送出一次 RPUSH，並略過空白訊息"""
+        from conversation.user_session_manager import UserSessionManager
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            pipe = mock_redis.pipeline.return_value
+            
+            session = UserSessionManager("user_001")
+            session.add_messages([
+                {"role": "user", "content": "訊息1"},
+                {"role": "assistant", "content": "   "},
+                {"role": "assistant", "content": "回覆1"}
+            ])
+        
+        mock_redis.pipeline.assert_called_once_with(transaction=False)
+        pipe.rpush.assert_called_once()
+        key, *payloads = pipe.rpush.call_args.args
+        assert key == "loan:history:user_001"
+        assert len(payloads) == 2
+        pipe.ltrim.assert_called_once_with("loan:history:user_001", -50, -1)
+        pipe.execute.assert_called_once()
+    
+    def test_add_messages_empty_skips_redis(self):
+        """測試沒有有效訊息時不連線 Redis"""
+        from conversation.user_session_manager import UserSessionManager
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            UserSessionManager("user_001").add_messages([{"role": "user", "content": ""}])
+        
+        mock_redis.pipeline.assert_not_called()
+    
+    def test_update_profile_shared_timestamp(self):
+        """測試傳入 now 時 created_at / updated_at / 訊息時間戳一致"""
+        from conversation.user_session_manager import UserSessionManager, _loads
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            mock_redis.get.return_value = '{"name": null}'
+            
+            session = UserSessionManager("user_001")
+            profile = session.update_profile({"name": "王小明"}, now=1234.5)
+            session.add_message("user", "你好", now=1234.5)
+            session.add_messages([{"role": "assistant", "content": "您好"}], now=1234.5)
+        
+        assert profile["created_at"] == profile["updated_at"] == 1234.5
+        pipe = mock_redis.pipeline.return_value
+        for call in pipe.rpush.call_args_list:
+            assert _loads(call.args[1])["timestamp"] == 1234.5
+    
+    def test_clear_session_single_delete(self):
+        """測試清除 session 以單一 DEL 刪除所有 key"""
+        from conversation.user_session_manager import UserSessionManager
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            UserSessionManager("user_001").clear_session()
+        
+        mock_redis.delete.assert_called_once_with(
+            "loan:profile:user_001",
+            "loan:history:user_001",
+            "loan:lock:user_001"
+        )
+
+
+class TestUserSessionManagerProfile:
+    """Profile 讀取測試"""
+    
+    def test_get_profile_new_user(self):
+        """測試新使用者取得初始化後的 profile，且不會改到預設樣板"""
+        from conversation.user_session_manager import UserSessionManager
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            mock_redis.get.return_value = None
+            
+            profile = UserSessionManager("user_001").get_profile()
+        
+        assert profile["name"] is None
+        assert profile["retry_count"] == 0
+        assert profile["created_at"] is not None
+        assert UserSessionManager.DEFAULT_PROFILE["created_at"] is None
+        mock_redis.set.assert_called_once()
+    
+    def test_get_profile_decode_error(self):
+        """測試 profile 資料損毀時重新初始化"""
+        from conversation.user_session_manager import UserSessionManager
+        
+        with patch('conversation.user_session_manager.redis_client') as mock_redis:
+            mock_redis.get.return_value = "invalid json {"
+            
+            profile = UserSessionManager("user_001").get_profile()
+        
+        assert set(profile) == set(UserSessionManager.DEFAULT_PROFILE)
+        assert profile["name"] is None
@@ -8,10 +8,83 @@ import sys
 import os
 import json
 import time
+import numpy as np
+from collections import defaultdict
+from types import MappingProxyType
 from unittest.mock import MagicMock, patch, PropertyMock
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+# 電話分隔符號刪除表 (str.translate 單次掃描)
+_PHONE_STRIP = str.maketrans("", "", "- \t()")
+
+
+def softmax(logits):
+    """數值穩定的 softmax (減去最大值避免 exp 溢位)"""
+    logits = np.asarray(logits, dtype=np.float64)
+    e = np.exp(logits - logits.max())
+    return e / e.sum()
+
+
+# ==========================================
+# FRE 評分邏輯
+# ==========================================
+_STABLE_JOBS = frozenset(("公務員", "教師", "醫師", "工程師"))
+
+
+def fre_calculate_dbr(income, amount, term=84, rate=0.03):
+    """DBR (%)，收入為 0 時回傳 inf"""
+    if income == 0:
+        return float('inf')
+    monthly_payment = (amount * (1 + rate)) / term
+    dbr = (monthly_payment / income) * 100
+    return round(dbr, 2)
+
+
+def fre_credit_score(income, job_type, has_default):
+    """信用評分: 基本分 + 收入加分 + 職業加分 - 違約扣分，限制在 300~850"""
+    base_score = 650
+    
+    # 收入加分
+    if income > 80000:
+        base_score += 100
+    elif income > 50000:
+        base_score += 50
+    elif income > 30000:
+        base_score += 20
+    
+    # 職業加分
+    if job_type in _STABLE_JOBS:
+        base_score += 30
+    
+    # 違約扣分
+    if has_default:
+        base_score -= 200
+    
+    return min(850, max(300, base_score))
+
+
+# 必填欄位與全部填寫時的 bitmask
+_REQUIRED_FIELDS = ("name", "id", "phone", "job", "income", "loan_purpose", "amount")
+_FULL_MASK = (1 << len(_REQUIRED_FIELDS)) - 1
+
+
+def filled_mask(profile):
+    """已填寫 (truthy) 的必填欄位 bitmask，第 i 個 bit 對應 _REQUIRED_FIELDS[i]"""
+    mask = 0
+    for i, value in enumerate(map(profile.get, _REQUIRED_FIELDS)):
+        if value:
+            mask |= 1 << i
+    return mask
+
+# 狀態優先護欄: verification_status → (expert, reason)
+_STATUS_RULES = MappingProxyType({
+    "unknown": ("LDE", "資料收集"),
+    "pending": ("DVE", "待驗證"),
+    "verified": ("FRE", "已驗證"),
+    "mismatch": ("LDE", "需釐清")
+})
+
 
 # ==========================================
 # User Session Manager Mock Tests
@@ -46,28 +119,17 @@ class TestUserSessionManagerMocked:
     
     def test_get_profile_new_user(self, mock_redis):
         """測試新用戶取得 profile"""
+        from conversation.user_session_manager import UserSessionManager
+        
         mock_redis.get.return_value = None
         
         # 模擬 get_profile 邏輯
         data = mock_redis.get("loan:profile:new_user")
         
         if not data:
-            # 初始化新 profile
-            default_profile = {
-                "name": None,
-                "id": None,
-                "phone": None,
-                "loan_purpose": None,
-                "job": None,
-                "income": None,
-                "amount": None,
-                "company": None,
-                "last_asked_field": None,
-                "retry_count": 0,
-                "verification_status": None,
-                "created_at": time.time(),
-                "updated_at": None
-            }
+            # 初始化新 profile (複製唯讀樣板)
+            default_profile = UserSessionManager.DEFAULT_PROFILE.copy()
+            default_profile["created_at"] = time.time()
             
             assert default_profile["name"] is None
             assert default_profile["retry_count"] == 0
@@ -121,16 +183,20 @@ class TestUserSessionManagerMocked:
     
     def test_add_message(self, mock_redis):
         """測試新增訊息"""
+        # 與 UserSessionManager 相同的序列化 (orjson 優先，未安裝時退回標準 json)
+        from conversation.user_session_manager import _dumps
+        
         msg = {
             "role": "user",
             "content": "我想申請貸款",
             "timestamp": time.time()
         }
         
-        json_msg = json.dumps(msg, ensure_ascii=False)
+        json_msg = _dumps(msg)
+        assert isinstance(json_msg, bytes)
         
-        # 模擬 pipeline 操作
-        pipe = mock_redis.pipeline()
+        # 模擬 pipeline 操作 (非交易 pipeline，一次 round trip)
+        pipe = mock_redis.pipeline(transaction=False)
         pipe.rpush("loan:history:user_001", json_msg)
         pipe.ltrim("loan:history:user_001", -50, -1)
         pipe.expire("loan:history:user_001", 3600)
@@ -140,6 +206,8 @@ class TestUserSessionManagerMocked:
     
     def test_get_history(self, mock_redis):
         """測試取得歷史紀錄"""
+        from conversation.user_session_manager import _loads
+        
         history_data = [
             json.dumps({"role": "user", "content": "訊息1", "timestamp": 1000}),
             json.dumps({"role": "assistant", "content": "回覆1", "timestamp": 1001}),
@@ -149,9 +217,7 @@ class TestUserSessionManagerMocked:
         
         msgs = mock_redis.lrange("loan:history:user_001", -10, -1)
         
-        result = []
-        for m in msgs:
-            result.append(json.loads(m))
+        result = [_loads(m) for m in msgs]
         
         assert len(result) == 3
         assert result[0]["role"] == "user"
@@ -160,13 +226,14 @@ class TestUserSessionManagerMocked:
         """測試清除 session"""
         user_id = "user_001"
         
-        pipe = mock_redis.pipeline()
-        pipe.delete(f"loan:profile:{user_id}")
-        pipe.delete(f"loan:history:{user_id}")
-        pipe.delete(f"loan:lock:{user_id}")
-        pipe.execute()
+        # 單一 DEL 指令刪除所有 key
+        mock_redis.delete(
+            f"loan:profile:{user_id}",
+            f"loan:history:{user_id}",
+            f"loan:lock:{user_id}"
+        )
         
-        assert mock_redis.pipeline.called
+        assert mock_redis.delete.call_count == 1
     
     def test_get_session_info(self, mock_redis):
         """測試取得 session 資訊"""
@@ -188,6 +255,8 @@ class TestUserSessionManagerMocked:
     
     def test_json_decode_error_handling(self, mock_redis):
         """測試 JSON 解碼錯誤處理"""
+        from conversation.user_session_manager import UserSessionManager
+        
         mock_redis.get.return_value = "invalid json {"
         
         data = mock_redis.get("loan:profile:user_001")
@@ -196,7 +265,7 @@ class TestUserSessionManagerMocked:
             profile = json.loads(data)
         except json.JSONDecodeError:
             # 錯誤時回傳預設 profile
-            profile = {"name": None, "id": None}
+            profile = UserSessionManager.DEFAULT_PROFILE.copy()
         
         assert profile["name"] is None
     
@@ -217,14 +286,11 @@ class TestLDEExpertMocked:
     
     def test_decide_mode_consult(self):
         """測試 Consult 模式決策"""
-        consult_keywords = [
-            "多少", "利率", "什麼", "資格", "可以嗎",
-            "試算", "好過", "推薦", "怎麼", "如何"
-        ]
+        from experts.lde.lde_expert import CONSULT_KEYWORDS
         
         def decide_mode(query, profile, verification_status):
-            is_consult = any(kw in query for kw in consult_keywords)
-            filled_count = sum(1 for v in profile.values() if v is not None)
+            is_consult = CONSULT_KEYWORDS.matches(query)
+            filled_count = len(profile) - list(profile.values()).count(None)
             
             if is_consult and filled_count < 3:
                 return "consult"
@@ -281,16 +347,16 @@ class TestLDEExpertMocked:
     
     def test_profile_completion_check(self):
         """測試 profile 完整度檢查"""
-        required_fields = ["name", "id", "phone", "job", "income", "loan_purpose", "amount"]
-        
         profile = {
             "name": "王小明",
             "id": "A123456789",
             "phone": "0912-345-678"
         }
         
-        filled = [f for f in required_fields if profile.get(f)]
-        missing = [f for f in required_fields if not profile.get(f)]
+        # 只查一次 profile，再依 bit 拆成已填 / 缺少
+        mask = filled_mask(profile)
+        filled = [f for i, f in enumerate(_REQUIRED_FIELDS) if mask >> i & 1]
+        missing = [f for i, f in enumerate(_REQUIRED_FIELDS) if not mask >> i & 1]
         
         assert len(filled) == 3
         assert len(missing) == 4
@@ -333,7 +399,7 @@ class TestDVEExpertMocked:
     def test_mismatch_detection_phone(self):
         """測試電話不符檢測"""
         def normalize_phone(phone):
-            return phone.replace("-", "").replace(" ", "")
+            return phone.translate(_PHONE_STRIP)
         
         current_phone = "0912-345-678"
         hist_phone = "0912345678"
@@ -341,18 +407,15 @@ class TestDVEExpertMocked:
         is_match = normalize_phone(current_phone) == normalize_phone(hist_phone)
         
         assert is_match is True
+        assert normalize_phone("(09) 12-345\t678") == hist_phone
     
     def test_risk_classification(self):
         """測試風險分類"""
+        risk_lut = ("LOW", "MEDIUM", "HIGH")
+        
         def classify_risk(mismatch_count, has_default_record=False):
-            if has_default_record:
-                return "HIGH"
-            if mismatch_count == 0:
-                return "LOW"
-            elif mismatch_count == 1:
-                return "MEDIUM"
-            else:
-                return "HIGH"
+            # 有違約紀錄時直接視為 2 項以上不符
+            return risk_lut[2 if has_default_record else min(mismatch_count, 2)]
         
         assert classify_risk(0) == "LOW"
         assert classify_risk(1) == "MEDIUM"
@@ -414,48 +477,19 @@ class TestFREExpertMocked:
     
     def test_dbr_calculation(self):
         """測試 DBR 計算"""
-        def calculate_dbr(income, amount, term=84, rate=0.03):
-            if income == 0:
-                return float('inf')
-            monthly_payment = (amount * (1 + rate)) / term
-            dbr = (monthly_payment / income) * 100
-            return round(dbr, 2)
-        
         # 月薪 5 萬，借 50 萬
-        dbr = calculate_dbr(50000, 500000)
+        dbr = fre_calculate_dbr(50000, 500000)
         assert 10 < dbr < 15  # 約 12.24%
         
         # 月薪 3 萬，借 100 萬
-        dbr = calculate_dbr(30000, 1000000)
+        dbr = fre_calculate_dbr(30000, 1000000)
         assert dbr > 40
     
     def test_credit_score_calculation(self):
         """測試信用評分計算"""
-        def calculate_credit_score(income, job_type, has_default):
-            base_score = 650
-            
-            # 收入加分
-            if income > 80000:
-                base_score += 100
-            elif income > 50000:
-                base_score += 50
-            elif income > 30000:
-                base_score += 20
-            
-            # 職業加分
-            stable_jobs = ["公務員", "教師", "醫師", "工程師"]
-            if job_type in stable_jobs:
-                base_score += 30
-            
-            # 違約扣分
-            if has_default:
-                base_score -= 200
-            
-            return min(850, max(300, base_score))
-        
-        assert calculate_credit_score(80001, "工程師", False) == 780
-        assert calculate_credit_score(50001, "業務", False) == 700
-        assert calculate_credit_score(50001, "業務", True) == 500
+        assert fre_credit_score(80001, "工程師", False) == 780
+        assert fre_credit_score(50001, "業務", False) == 700
+        assert fre_credit_score(50001, "業務", True) == 500
     
     def test_safety_guard_dbr(self):
         """測試 DBR 安全鎖"""
@@ -569,6 +603,10 @@ class TestLLMUtilsMocked:
         
         raw2 = '```json\n{"result": "pass"}\n```'
         assert clean_output(raw2) == '{"result": "pass"}'
+        
+        # end_of_text 之後若又出現 Output 前綴，不應被採用
+        raw3 = 'prompt ### Output:\n{"result": "pass"}<|end_of_text|>### Output: junk'
+        assert clean_output(raw3) == '{"result": "pass"}'
     
     def test_adapter_loading_logic(self):
         """測試 Adapter 載入邏輯"""
@@ -602,6 +640,22 @@ class TestLLMUtilsMocked:
         manager.switch_adapter("LDE")
         assert manager.current_adapter == "LDE"
     
+    def test_resolve_adapter_file(self, tmp_path):
+        """測試 adapter 權重檔解析 (safetensors 優先，結果快取)"""
+        from llm_utils import _resolve_adapter_file
+        
+        _resolve_adapter_file.cache_clear()
+        assert _resolve_adapter_file(str(tmp_path)) is None
+        
+        (tmp_path / "adapter_model.bin").touch()
+        (tmp_path / "adapter_model.safetensors").touch()
+        _resolve_adapter_file.cache_clear()
+        
+        resolved = _resolve_adapter_file(str(tmp_path))
+        assert resolved.endswith("adapter_model.safetensors")
+        assert _resolve_adapter_file(str(tmp_path)) == resolved
+        assert _resolve_adapter_file.cache_info().hits == 1
+    
     def test_singleton_pattern(self):
         """測試 Singleton 模式"""
         class Singleton:
@@ -627,10 +681,8 @@ class TestGatingEngineMocked:
     def test_verification_status_inference(self):
         """測試驗證狀態推斷"""
         def infer_status(profile):
-            required = ["name", "id", "phone", "job", "income", "loan_purpose", "amount"]
-            filled = sum(1 for f in required if profile.get(f))
-            
-            if filled < len(required):
+            # 全部填寫才等於 _FULL_MASK
+            if filled_mask(profile) != _FULL_MASK:
                 return "unknown"
             elif profile.get("dve_completed"):
                 return "verified"
@@ -656,21 +708,16 @@ class TestGatingEngineMocked:
     
     def test_guardrail_rules(self):
         """測試護欄規則"""
+        from moe.gating_engine import TECH_KEYWORDS
+        
         def apply_guardrails(verification_status, query):
             # 狀態優先護欄
-            status_rules = {
-                "unknown": ("LDE", "資料收集"),
-                "pending": ("DVE", "待驗證"),
-                "verified": ("FRE", "已驗證"),
-                "mismatch": ("LDE", "需釐清")
-            }
+            hit = _STATUS_RULES.get(verification_status)
+            if hit:
+                return hit
             
-            if verification_status in status_rules:
-                return status_rules[verification_status]
-            
-            # 關鍵字護欄
-            tech_keywords = ["系統", "錯誤", "失敗"]
-            if any(kw in query for kw in tech_keywords):
+            # 關鍵字護欄 (單次掃描)
+            if TECH_KEYWORDS.matches(query):
                 return ("DVE", "技術問題")
             
             return (None, None)
@@ -683,67 +730,92 @@ class TestGatingEngineMocked:
     
     def test_softmax_routing(self):
         """測試 Softmax 路由"""
-        import math
-        
-        def softmax(logits):
-            exp_logits = [math.exp(x) for x in logits]
-            sum_exp = sum(exp_logits)
-            return [x / sum_exp for x in exp_logits]
-        
         logits = [2.0, 1.0, 0.5]  # LDE, DVE, FRE
         probs = softmax(logits)
         
-        assert sum(probs) == pytest.approx(1.0, rel=1e-6)
+        assert probs.sum() == pytest.approx(1.0, rel=1e-6)
         assert probs[0] > probs[1] > probs[2]  # LDE > DVE > FRE
     
+    def test_softmax_large_logits(self):
+        """測試 Softmax 大數值不溢位 (先減去最大值)"""
+        probs = softmax([1000.0, 999.0, 998.0])
+        
+        assert np.all(np.isfinite(probs))
+        assert probs.sum() == pytest.approx(1.0, rel=1e-6)
+        np.testing.assert_allclose(probs, softmax([2.0, 1.0, 0.0]))
+    
     def test_expert_selection(self):
         """測試專家選擇"""
-        ID2LABEL = {0: "LDE", 1: "DVE", 2: "FRE"}
+        ID2LABEL = ("LDE", "DVE", "FRE")
         
         def select_expert(logits, guardrail_expert=None):
             if guardrail_expert:
                 return guardrail_expert
             
-            max_idx = logits.index(max(logits))
-            return ID2LABEL[max_idx]
+            # softmax 單調，直接對 logits 取 argmax
+            return ID2LABEL[int(np.argmax(logits))]
         
         assert select_expert([2.0, 1.0, 0.5]) == "LDE"
         assert select_expert([0.5, 2.0, 1.0]) == "DVE"
         assert select_expert([0.5, 1.0, 2.0]) == "FRE"
         assert select_expert([2.0, 1.0, 0.5], guardrail_expert="DVE") == "DVE"
+    
+    def test_winner_confidence_without_softmax(self):
+        """測試勝者機率 1 / Σ exp(logit - max) 與完整 softmax 一致"""
+        logits = np.array([0.3, 2.1, -1.0])
+        
+        confidence = 1.0 / np.exp(logits - logits.max()).sum()
+        
+        assert np.isclose(confidence, softmax(logits).max())
 
 
 # ==========================================
 # RAG Service Mock Tests
 # ==========================================
+# RAG Context: (DVE 使用的標籤, 歷史紀錄欄位)
+_CTX_KEYS = (
+    ("檔案中紀錄職業", "hist_job"),
+    ("檔案中年薪/月薪", "hist_income"),
+    ("檔案中聯絡電話", "hist_phone"),
+    ("歷史違約紀錄", "default_record"),
+)
+
+
 class TestRAGServiceMocked:
     """RAG Service Mock 測試"""
     
     def test_embedding_generation_mock(self):
         """測試 Embedding 生成 (Mock)"""
         def mock_encode(text):
-            # 模擬 384 維 embedding
-            return [0.1] * 384
+            # 模擬 384 維 float32 embedding (連續記憶體，與 encoder 輸出一致)
+            return np.full(384, 0.1, dtype=np.float32)
         
         embedding = mock_encode("測試文字")
         
-        assert len(embedding) == 384
-        assert all(x == 0.1 for x in embedding)
+        assert embedding.shape == (384,)
+        assert embedding.dtype == np.float32
+        assert np.all(embedding == np.float32(0.1))
     
-    def test_vector_search_mock(self):
-        """測試向量搜尋 (Mock)"""
-        def mock_vector_search(query_embedding, top_k=3):
-            # 模擬搜尋結果
-            return [
-                {"content": "歷史紀錄1", "score": 0.95, "metadata": {"hist_job": "工程師"}},
-                {"content": "歷史紀錄2", "score": 0.85, "metadata": {"hist_job": "工程師"}},
-                {"content": "歷史紀錄3", "score": 0.75, "metadata": {"hist_job": "設計師"}}
-            ][:top_k]
+    def test_vector_search_mock(self, rag_mock_db, rag_mock_collections):
+        """測試向量搜尋 (Mock DB 注入 RAGService)"""
+        from services.rag_service import RAGService
         
-        results = mock_vector_search([0.1] * 384, top_k=2)
+        encoder = MagicMock()
+        encoder.encode.return_value = np.full((1, 384), 0.1, dtype=np.float32)
+        rag_mock_collections["case_library"].aggregate.return_value = [
+            {"content": "歷史紀錄1", "score": 0.95, "metadata": {"hist_job": "工程師"}},
+            {"content": "歷史紀錄2", "score": 0.85, "metadata": {"hist_job": "工程師"}},
+            {"content": "歷史紀錄3", "score": 0.30, "metadata": {"hist_job": "設計師"}},
+        ]
+        
+        service = RAGService(db=rag_mock_db, encoder=encoder)
+        results = service.search_similar_cases(query_text="工程師", top_k=3)
         
-        assert len(results) == 2
+        # 低於 SIMILARITY_THRESHOLD 的案例被濾掉
+        assert [r["content"] for r in results] == ["歷史紀錄1", "歷史紀錄2"]
         assert results[0]["score"] > results[1]["score"]
+        pipeline = rag_mock_collections["case_library"].aggregate.call_args[0][0]
+        assert pipeline[0]["$vectorSearch"]["limit"] == 3
     
     def test_add_document_mock(self):
         """測試新增文件 (Mock)"""
@@ -790,12 +862,8 @@ class TestRAGServiceMocked:
             if not history_record:
                 return {}
             
-            return {
-                "檔案中紀錄職業": history_record.get("hist_job", "無資料"),
-                "檔案中年薪/月薪": history_record.get("hist_income", "無資料"),
-                "檔案中聯絡電話": history_record.get("hist_phone", "無資料"),
-                "歷史違約紀錄": history_record.get("default_record", "無資料")
-            }
+            get = history_record.get
+            return {label: get(src, "無資料") for label, src in _CTX_KEYS}
         
         record = {
             "hist_job": "工程師",
@@ -806,13 +874,35 @@ class TestRAGServiceMocked:
         
         context = build_rag_context(record)
         
+        assert list(context) == [label for label, _ in _CTX_KEYS]
         assert context["檔案中紀錄職業"] == "工程師"
         assert context["歷史違約紀錄"] == "無"
+        
+        assert build_rag_context({"hist_job": "工程師"})["檔案中聯絡電話"] == "無資料"
+        assert build_rag_context({}) == {}
 
 
 # ==========================================
 # Conversation Manager Mock Tests
 # ==========================================
+# 重試 / 跳過訊息: (action, 欄位) → 訊息，模組載入時一次產生
+_RETRY_MSGS = {
+    **{("skip", f): f"已多次嘗試，跳過 {f} 欄位" for f in _REQUIRED_FIELDS},
+    **{("retry", f): f"輸入格式不正確，請重新輸入 {f}" for f in _REQUIRED_FIELDS},
+}
+
+# 申請人資料摘要樣板 (以 format_map 一次代入)
+_SUMMARY_TMPL = (
+    "申請人資料摘要：\n"
+    "- 姓名：{name}\n"
+    "- 身分證：{id}\n"
+    "- 職業：{job}\n"
+    "- 月收入：{income}\n"
+    "- 貸款用途：{loan_purpose}\n"
+    "- 申請金額：{amount}"
+)
+
+
 class TestConversationManagerMocked:
     """Conversation Manager Mock 測試"""
     
@@ -869,33 +959,19 @@ class TestConversationManagerMocked:
         max_retry = 3
         
         def handle_invalid_input(retry_count, field_name):
-            if retry_count >= max_retry:
-                return {
-                    "action": "skip",
-                    "message": f"已多次嘗試，跳過 {field_name} 欄位"
-                }
-            else:
-                return {
-                    "action": "retry",
-                    "message": f"輸入格式不正確，請重新輸入 {field_name}"
-                }
+            action = "skip" if retry_count >= max_retry else "retry"
+            return {"action": action, "message": _RETRY_MSGS[action, field_name]}
         
         assert handle_invalid_input(0, "phone")["action"] == "retry"
         assert handle_invalid_input(2, "phone")["action"] == "retry"
         assert handle_invalid_input(3, "phone")["action"] == "skip"
+        assert handle_invalid_input(3, "phone")["message"] == "已多次嘗試，跳過 phone 欄位"
     
     def test_generate_summary(self):
         """測試生成摘要"""
         def generate_summary(profile):
-            return f"""
-申請人資料摘要：
-- 姓名：{profile.get('name', 'N/A')}
-- 身分證：{profile.get('id', 'N/A')}
-- 職業：{profile.get('job', 'N/A')}
-- 月收入：{profile.get('income', 'N/A')}
-- 貸款用途：{profile.get('loan_purpose', 'N/A')}
-- 申請金額：{profile.get('amount', 'N/A')}
-            """.strip()
+            # 缺少的欄位以 N/A 代入
+            return _SUMMARY_TMPL.format_map(defaultdict(lambda: "N/A", profile))
         
         profile = {
             "name": "王小明",
@@ -910,3 +986,4 @@ class TestConversationManagerMocked:
         
         assert "王小明" in summary
         assert "工程師" in summary
+        assert generate_summary({"name": "王小明"}).endswith("- 申請金額：N/A")
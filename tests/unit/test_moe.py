@@ -47,6 +47,23 @@ class TestProfileAdapter:
         assert adapted["name"] == "王小明"
         assert "id" not in adapted  # None 值不應被加入
     
+    def test_adapt_prefers_loan_purpose(self):
+        """測試 loan_purpose 與 purpose 同時存在時以 loan_purpose 為準，未映射欄位不傳遞"""
+        from moe.moe_router import ProfileAdapter
+        
+        conv_profile = {
+            "purpose": "週轉",
+            "loan_purpose": "購車",
+            "retry_count": 2
+        }
+        
+        adapted = ProfileAdapter.adapt(conv_profile)
+        
+        assert adapted == {"purpose": "購車"}
+        
+        # loan_purpose 為 None 時退回 purpose
+        assert ProfileAdapter.adapt({"loan_purpose": None, "purpose": "週轉"}) == {"purpose": "週轉"}
+    
     def test_validate_for_moe_valid(self):
         """測試有效 Profile 驗證"""
         from moe.moe_router import ProfileAdapter
@@ -218,6 +235,14 @@ class TestMoERouter:
         
         assert completeness == 0.5  # 3/6
     
+    def test_filled_mask_bits(self):
+        """測試已填寫欄位 bitmask (0 / False 視為已填寫，只有 None 算缺少)"""
+        from moe.moe_router import _filled_mask
+        
+        assert _filled_mask({}) == 0
+        assert _filled_mask({"name": "王小明", "income": 0}) == 0b001001
+        assert _filled_mask({"job": "工程師", "amount": None}) == 0b000100
+    
     def test_route_missing_fields(self):
         """測試缺少必要欄位的路由"""
         from moe.moe_router import MoERouter
@@ -268,8 +293,8 @@ class TestGuardrails:
         assert True  # placeholder
     
     def test_guardrail_tech_keywords(self):
-        """測試技術問題關鍵字"""
-        tech_keywords = ["系統", "錯誤", "無法", "bug", "故障", "補件", "驗證"]
+        """測試技術問題關鍵字 (與 Guardrail 共用同一組預編譯 regex)"""
+        from moe.gating_engine import TECH_KEYWORDS
         
         # 包含這些關鍵字時，應該導向 DVE
         test_queries = [
@@ -279,19 +304,25 @@ class TestGuardrails:
         ]
         
         for query in test_queries:
-            has_tech_kw = any(kw in query for kw in tech_keywords)
-            assert has_tech_kw is True
+            assert TECH_KEYWORDS.matches(query) is True
+        
+        assert TECH_KEYWORDS.matches("我想申請車貸") is False
+
+
+@pytest.fixture(scope="module")
+def gating_model():
+    """StateFirstGatingModel (eval 模式，同模組共用以避免重複載入 BERT)"""
+    from moe.model_arch import StateFirstGatingModel
+    
+    return StateFirstGatingModel(n_classes=3, struct_dim=7).eval()
 
 
 class TestModelArchitecture:
     """模型架構測試"""
     
-    def test_model_structure(self):
+    def test_model_structure(self, gating_model):
         """測試模型結構"""
-        from moe.model_arch import StateFirstGatingModel
-        import torch
-        
-        model = StateFirstGatingModel(n_classes=3, struct_dim=7)
+        model = gating_model
         
         # 檢查層級結構
         assert hasattr(model, 'bert')
@@ -299,13 +330,11 @@ class TestModelArchitecture:
         assert hasattr(model, 'struct_net')
         assert hasattr(model, 'classifier')
     
-    def test_model_output_shape(self):
+    def test_model_output_shape(self, gating_model):
         """測試模型輸出形狀"""
-        from moe.model_arch import StateFirstGatingModel
         import torch
         
-        model = StateFirstGatingModel(n_classes=3, struct_dim=7)
-        model.eval()
+        model = gating_model
         
         # 建立假輸入
         batch_size = 2
@@ -320,13 +349,11 @@ class TestModelArchitecture:
         
         assert output.shape == (batch_size, 3)  # 3 個專家
     
-    def test_model_forward_pass(self):
+    def test_model_forward_pass(self, gating_model):
         """測試前向傳播"""
-        from moe.model_arch import StateFirstGatingModel
         import torch
         
-        model = StateFirstGatingModel(n_classes=3, struct_dim=7)
-        model.eval()
+        model = gating_model
         
         input_ids = torch.randint(0, 1000, (1, 32))
         attention_mask = torch.ones(1, 32)
@@ -340,3 +367,35 @@ class TestModelArchitecture:
             success = False
         
         assert success is True
+    
+    def test_forward_equals_encode_then_classify(self, gating_model):
+        """測試 forward 與拆開的 encode_text → classify 結果相同 (文字特徵可快取重用)"""
+        import torch
+        
+        input_ids = torch.randint(0, 1000, (2, 32))
+        attention_mask = torch.ones(2, 32, dtype=torch.long)
+        struct_features = torch.rand(2, 7)
+        
+        with torch.no_grad():
+            text_embed = gating_model.encode_text(input_ids, attention_mask)
+            
+            assert text_embed.shape == (2, 32)
+            assert torch.allclose(
+                gating_model.classify(text_embed, struct_features),
+                gating_model(input_ids, attention_mask, struct_features)
+            )
+    
+    def test_traced_model_matches_eager(self, gating_model):
+        """測試 TorchScript trace 後的輸出與 eager 模型一致 (含 padding mask)"""
+        import torch
+        
+        input_ids = torch.randint(0, 1000, (1, 32))
+        attention_mask = torch.zeros(1, 32, dtype=torch.long)
+        attention_mask[:, :10] = 1
+        struct_features = torch.rand(1, 7)
+        example = (input_ids, attention_mask, struct_features)
+        
+        with torch.no_grad():
+            traced = torch.jit.trace(gating_model, example, strict=False)
+            
+            assert torch.allclose(traced(*example), gating_model(*example), atol=1e-4)
@@ -6,11 +6,17 @@ RAG Service 完整測試
 import pytest
 import sys
 import os
+import numpy as np
 from unittest.mock import MagicMock, patch, PropertyMock
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 
+def _fake_encode(texts, **kwargs):
+    """模擬 SentenceTransformer.encode (list 輸入): 每段文字回傳 384 維 float32 向量"""
+    return np.full((len(texts), 384), 0.1, dtype=np.float32)
+
+
 class TestRAGServiceCollections:
     """測試 RAG Service 的兩個 Collection"""
     
@@ -32,23 +38,54 @@ class TestRAGServiceCollections:
         assert service.SIMILARITY_THRESHOLD == 0.5
         assert 0 < service.SIMILARITY_THRESHOLD < 1
 
+    
+    def test_encoder_shared_across_instances(self):
+        """測試多個 RAGService 共用同一個 SentenceTransformer"""
+        from services import rag_service
+        
+        fake_module = MagicMock()
+        rag_service._load_encoder.cache_clear()
+        
+        try:
+            with patch.dict(sys.modules, {"sentence_transformers": fake_module}), \
+                 patch.object(rag_service, "mongo_db"):
+                first = rag_service.RAGService()
+                second = rag_service.RAGService()
+                first._lazy_init()
+                second._lazy_init()
+            
+            assert first._encoder is second._encoder
+            fake_module.SentenceTransformer.assert_called_once_with("all-MiniLM-L6-v2")
+        finally:
+            rag_service._load_encoder.cache_clear()
+    
+    def test_injected_dependencies(self, rag_mock_db, rag_mock_collections):
+        """測試注入的 db / encoder 會被使用，不載入預設模型"""
+        from services.rag_service import RAGService
+        
+        encoder = MagicMock()
+        
+        with patch("services.rag_service._load_encoder") as mock_load:
+            service = RAGService(db=rag_mock_db, encoder=encoder)
+            service._lazy_init()
+        
+        mock_load.assert_not_called()
+        assert service._encoder is encoder
+        assert service._user_history is rag_mock_collections["user_history"]
+        assert service._case_library is rag_mock_collections["case_library"]
+        assert service._user_history is not service._case_library
+
 
 class TestUserHistoryCollection:
     """測試 user_history Collection (DVE 用)"""
     
     @pytest.fixture
-    def mock_rag_service(self):
-        """建立 mock RAG service"""
-        with patch('services.rag_service.mongo_db') as mock_db:
-            mock_collection = MagicMock()
-            mock_db.get_collection.return_value = mock_collection
-            
-            from services.rag_service import RAGService
-            service = RAGService()
-            service._user_history = mock_collection
-            service._initialized = True
-            
-            return service, mock_collection
+    def mock_rag_service(self, rag_mock_db, rag_mock_collections):
+        """建立 mock RAG service (db / encoder 直接注入)，回傳 user_history 的 mock"""
+        from services.rag_service import RAGService
+        
+        service = RAGService(db=rag_mock_db, encoder=MagicMock())
+        return service, rag_mock_collections["user_history"]
     
     def test_add_user_record(self, mock_rag_service):
         """測試新增用戶紀錄"""
@@ -70,7 +107,7 @@ class TestUserHistoryCollection:
         service, mock_collection = mock_rag_service
         
         mock_cursor = MagicMock()
-        mock_cursor.sort.return_value = [
+        mock_cursor.sort.return_value.limit.return_value = [
             {"user_id": "A123456789", "content": "紀錄1"},
             {"user_id": "A123456789", "content": "紀錄2"}
         ]
@@ -86,7 +123,7 @@ class TestUserHistoryCollection:
         service, mock_collection = mock_rag_service
         
         mock_cursor = MagicMock()
-        mock_cursor.sort.return_value = []
+        mock_cursor.sort.return_value.limit.return_value = []
         mock_collection.find.return_value = mock_cursor
         
         result = service.get_user_history_by_id("NOT_EXIST")
@@ -94,13 +131,9 @@ class TestUserHistoryCollection:
         assert result == []
     
     def test_verify_against_history_no_history(self, mock_rag_service):
-        """測試驗證 - 無歷史紀錄"""
+        """測試驗證 - 無歷史紀錄 (fixture 預設的 cursor 即為空結果)"""
         service, mock_collection = mock_rag_service
         
-        mock_cursor = MagicMock()
-        mock_cursor.sort.return_value = []
-        mock_collection.find.return_value = mock_cursor
-        
         result = service.verify_against_history(
             user_id="NEW_USER",
             current_data={"job": "工程師", "income": 80000}
@@ -108,13 +141,14 @@ class TestUserHistoryCollection:
         
         assert result["has_history"] == False
         assert result["risk_level"] == "UNKNOWN"
+        mock_collection.find.assert_called_once()
     
     def test_verify_against_history_low_risk(self, mock_rag_service):
         """測試驗證 - 低風險"""
         service, mock_collection = mock_rag_service
         
         mock_cursor = MagicMock()
-        mock_cursor.sort.return_value = [{
+        mock_cursor.sort.return_value.limit.return_value = [{
             "user_id": "A123456789",
             "metadata": {
                 "hist_job": "工程師",
@@ -133,13 +167,19 @@ class TestUserHistoryCollection:
         assert result["has_history"] == True
         assert result["risk_level"] == "LOW"
         assert result["mismatch_count"] == 0
+        
+        # 只向 MongoDB 取最新一筆，且不帶回 embedding
+        mock_collection.find.assert_called_once_with(
+            {"user_id": "A123456789"}, {"_id": 0, "embedding": 0}
+        )
+        mock_cursor.sort.return_value.limit.assert_called_once_with(1)
     
     def test_verify_against_history_high_risk(self, mock_rag_service):
         """測試驗證 - 高風險 (多項不符)"""
         service, mock_collection = mock_rag_service
         
         mock_cursor = MagicMock()
-        mock_cursor.sort.return_value = [{
+        mock_cursor.sort.return_value.limit.return_value = [{
             "user_id": "A123456789",
             "metadata": {
                 "hist_job": "工程師",
@@ -163,25 +203,110 @@ class TestUserHistoryCollection:
         assert result["risk_level"] == "HIGH"
         assert result["mismatch_count"] >= 2
 
+    def test_verify_cache_hit(self, mock_rag_service):
+        """測試驗證快取 - 同一使用者、相同資料只查一次，新增紀錄後失效"""
+        service, mock_collection = mock_rag_service
+        
+        mock_cursor = MagicMock()
+        mock_cursor.sort.return_value.limit.return_value = [{
+            "user_id": "A123456789",
+            "metadata": {"hist_job": "工程師", "hist_income": 80000}
+        }]
+        mock_collection.find.return_value = mock_cursor
+        current_data = {"job": "工程師", "income": 80000}
+        
+        first = service.verify_against_history("A123456789", current_data)
+        second = service.verify_against_history("A123456789", dict(current_data))
+        
+        assert second == first
+        assert mock_collection.find.call_count == 1
+        
+        # 資料不同 → 重新查詢
+        service.verify_against_history("A123456789", {"job": "業務員", "income": 80000})
+        assert mock_collection.find.call_count == 2
+        
+        # 新增紀錄後該使用者的快取清除
+        mock_collection.insert_one.return_value = MagicMock(inserted_id="test_id")
+        service.add_user_record(user_id="A123456789", content="更新資料")
+        service.verify_against_history("A123456789", current_data)
+        assert mock_collection.find.call_count == 3
+    
+    def test_verify_cache_returns_copies(self, mock_rag_service):
+        """測試驗證快取 - 修改第一次的結果不影響之後的命中，且 TTL 到期後重新查詢"""
+        service, mock_collection = mock_rag_service
+        
+        mock_cursor = MagicMock()
+        mock_cursor.sort.return_value.limit.return_value = [{
+            "user_id": "A123456789",
+            "metadata": {"hist_job": "工程師", "hist_income": 80000}
+        }]
+        mock_collection.find.return_value = mock_cursor
+        current_data = {"job": "業務員", "income": 80000}
+        
+        with patch("services.rag_service.time.monotonic", return_value=1000.0):
+            first = service.verify_against_history("A123456789", current_data)
+            first["mismatches"].clear()
+            first["historical_data"]["hist_job"] = "竄改"
+            first["risk_level"] = "LOW"
+            
+            second = service.verify_against_history("A123456789", current_data)
+            assert second["risk_level"] == "MEDIUM"
+            assert second["mismatch_count"] == len(second["mismatches"]) == 1
+            assert second["historical_data"]["hist_job"] == "工程師"
+            assert mock_collection.find.call_count == 1
+        
+        with patch("services.rag_service.time.monotonic", return_value=1031.0):
+            service.verify_against_history("A123456789", current_data)
+            assert mock_collection.find.call_count == 2
+    
+    @pytest.mark.parametrize("current_data,has_default,expected_risk,expected_fields", [
+        # 電話只差格式、收入差異 20% 以內 → 無不符
+        ({"job": "工程師", "income": 90000, "phone": "0912-345-678"}, False, "LOW", []),
+        # 只有職業不符
+        ({"job": "業務員", "income": 80000}, False, "MEDIUM", ["job"]),
+        # 收入與電話不符
+        ({"income": 50000, "phone": "0987654321"}, False, "HIGH", ["income", "phone"]),
+        # 有違約紀錄直接判 HIGH
+        ({"job": "工程師"}, True, "HIGH", []),
+    ], ids=["format_only", "one_mismatch", "two_mismatches", "default_record"])
+    def test_verify_against_history_rules(
+        self, mock_rag_service, current_data, has_default, expected_risk, expected_fields
+    ):
+        """測試比對規則表與風險等級對照"""
+        service, mock_collection = mock_rag_service
+        
+        mock_cursor = MagicMock()
+        mock_cursor.sort.return_value.limit.return_value = [{
+            "user_id": "A123456789",
+            "metadata": {
+                "hist_job": "工程師",
+                "hist_income": 80000,
+                "hist_phone": "0912345678",
+                "has_default_record": has_default
+            }
+        }]
+        mock_collection.find.return_value = mock_cursor
+        
+        result = service.verify_against_history("A123456789", current_data)
+        
+        assert result["risk_level"] == expected_risk
+        assert [m[0] for m in result["mismatches"]] == expected_fields
+        assert result["mismatch_count"] == len(expected_fields)
+
 
 class TestCaseLibraryCollection:
     """測試 case_library Collection (FRE RAG 用)"""
     
     @pytest.fixture
-    def mock_rag_service_with_encoder(self):
-        """建立 mock RAG service (含 encoder)"""
-        with patch('services.rag_service.mongo_db') as mock_db:
-            mock_collection = MagicMock()
-            mock_db.get_collection.return_value = mock_collection
-            
-            from services.rag_service import RAGService
-            service = RAGService()
-            service._case_library = mock_collection
-            service._encoder = MagicMock()
-            service._encoder.encode.return_value = MagicMock(tolist=lambda: [0.1] * 384)
-            service._initialized = True
-            
-            return service, mock_collection
+    def mock_rag_service_with_encoder(self, rag_mock_db, rag_mock_collections):
+        """建立 mock RAG service (含 encoder)，回傳 case_library 的 mock"""
+        from services.rag_service import RAGService
+        
+        encoder = MagicMock()
+        encoder.encode.side_effect = _fake_encode
+        
+        service = RAGService(db=rag_mock_db, encoder=encoder)
+        return service, rag_mock_collections["case_library"]
     
     def test_add_case(self, mock_rag_service_with_encoder):
         """測試新增案例"""
@@ -197,10 +322,128 @@ class TestCaseLibraryCollection:
         assert result == "case_001"
         mock_collection.insert_one.assert_called_once()
         
-        # 確認有生成 embedding
+        # 確認有生成 embedding (packed float32 BSON vector)
         call_args = mock_collection.insert_one.call_args[0][0]
         assert "embedding" in call_args
-        assert len(call_args["embedding"]) == 384
+        
+        from services.rag_service import BSON_VECTOR_AVAILABLE
+        embedding = call_args["embedding"]
+        if BSON_VECTOR_AVAILABLE:
+            from bson.binary import Binary, BinaryVectorDtype
+            assert isinstance(embedding, Binary)
+            assert embedding.as_vector().dtype == BinaryVectorDtype.FLOAT32
+            embedding = embedding.as_vector().data
+        
+        assert len(embedding) == 384
+        assert embedding[0] == pytest.approx(0.1)
+        
+        # 寫入時附上解析好的 is_approved
+        assert call_args["metadata"]["is_approved"] is True
+    
+    def test_stored_embedding_round_trip(self):
+        """測試 embedding 存成 BSON float32 vector 後可無損還原"""
+        from services.rag_service import from_stored_embedding, to_stored_embedding
+        
+        vector = np.random.RandomState(3).randn(384).astype(np.float32)
+        
+        stored = to_stored_embedding(vector)
+        restored = from_stored_embedding(stored)
+        
+        assert len(stored) < vector.size * 8  # packed float32，比 BSON double array 小
+        assert restored.dtype == np.float32
+        np.testing.assert_array_equal(restored, vector)
+        
+        # 舊資料的 list 格式也能讀；缺少或無法解析時回傳 None
+        np.testing.assert_array_equal(from_stored_embedding(vector.tolist()), vector)
+        assert from_stored_embedding(None) is None
+        assert from_stored_embedding("not a vector") is None
+    
+    def test_to_stored_embedding_fallback(self):
+        """測試舊版 driver 沒有 BSON vector 時退回 list"""
+        from services import rag_service
+        
+        vector = np.full(384, 0.5, dtype=np.float32)
+        
+        with patch.object(rag_service, "BSON_VECTOR_AVAILABLE", False):
+            stored = rag_service.to_stored_embedding(vector)
+        
+        assert stored == [0.5] * 384
+    
+    def test_add_cases_bulk(self, mock_rag_service_with_encoder):
+        """測試批次新增: 一次 encoder 呼叫 + 一次 bulk_write"""
+        service, mock_collection = mock_rag_service_with_encoder
+        mock_collection.bulk_write.return_value = MagicMock(inserted_count=50)
+        
+        cases = [
+            {
+                "content": f"職業:工程師，月薪:{60000 + i * 1000}",
+                "metadata": {"final_decision": "核准_PASS" if i % 2 else "拒絕_REJECT"},
+                "case_id": f"seed_{i:05d}"
+            }
+            for i in range(50)
+        ]
+        
+        inserted = service.add_cases_bulk(cases)
+        
+        assert inserted == 50
+        assert mock_collection.bulk_write.call_count == 1
+        assert mock_collection.insert_one.call_count == 0
+        assert service._encoder.encode.call_count == 1
+        
+        from pymongo import InsertOne
+        
+        requests = mock_collection.bulk_write.call_args[0][0]
+        assert mock_collection.bulk_write.call_args[1] == {"ordered": False}
+        assert len(requests) == 50
+        assert all(isinstance(r, InsertOne) for r in requests)
+        
+        # 文件內容與 add_case 共用同一個組裝函式
+        doc = service._build_case_doc(
+            cases[1]["content"], cases[1]["metadata"], cases[1]["case_id"], None
+        )
+        assert doc["case_id"] == "seed_00001"
+        assert doc["metadata"]["is_approved"] is True
+        assert doc["embedding"] == []
+    
+    def test_add_cases_bulk_empty(self, mock_rag_service_with_encoder):
+        """測試空清單不送出請求"""
+        service, mock_collection = mock_rag_service_with_encoder
+        
+        assert service.add_cases_bulk([]) == 0
+        mock_collection.bulk_write.assert_not_called()
+    
+    def test_warmup_encoder_called(self, mock_rag_service_with_encoder):
+        """測試預熱 - encode 一次固定文字並跑 limit=1 的 Vector Search，重複呼叫不再執行"""
+        from services.rag_service import _WARMUP_TEXT
+        
+        service, mock_collection = mock_rag_service_with_encoder
+        mock_collection.aggregate.return_value = iter([])
+        
+        service.warmup()
+        service.warmup(background=True).join(timeout=5)
+        
+        service._encoder.encode.assert_called_once()
+        assert service._encoder.encode.call_args.args[0] == [_WARMUP_TEXT]
+        
+        mock_collection.aggregate.assert_called_once()
+        pipeline = mock_collection.aggregate.call_args.args[0]
+        assert pipeline[0]["$vectorSearch"]["limit"] == 1
+    
+    def test_encode_called_once_for_duplicate_texts(self, mock_rag_service_with_encoder):
+        """測試相同內容只跑一次 encoder，批次編碼時重複文字只送一次"""
+        service, mock_collection = mock_rag_service_with_encoder
+        mock_collection.insert_one.return_value = MagicMock(inserted_id="case_001")
+        
+        service.add_case(content="職業:工程師，月薪:80000", metadata={})
+        service.add_case(content="職業:工程師，月薪:80000", metadata={})
+        
+        assert service._encoder.encode.call_count == 1
+        
+        vectors = service._encode_batch(["職業:業務", "職業:業務", "職業:工程師，月薪:80000"])
+        
+        assert service._encoder.encode.call_count == 2
+        assert service._encoder.encode.call_args[0][0] == ["職業:業務"]
+        assert [v.dtype for v in vectors] == [np.float32] * 3
     
     def test_search_similar_cases(self, mock_rag_service_with_encoder):
         """測試搜尋相似案例"""
@@ -218,6 +461,11 @@ class TestCaseLibraryCollection:
         
         assert len(result) == 2
         assert result[0]["score"] > result[1]["score"]
+        
+        # 送進 PyMongo 的 queryVector 為一般 list
+        query_vector = mock_collection.aggregate.call_args[0][0][0]["$vectorSearch"]["queryVector"]
+        assert isinstance(query_vector, list)
+        assert len(query_vector) == 384
     
     def test_search_similar_cases_with_profile(self, mock_rag_service_with_encoder):
         """測試用 profile 搜尋相似案例"""
@@ -238,13 +486,135 @@ class TestCaseLibraryCollection:
         
         assert len(result) == 1
     
+    def test_search_hits_cache_second_call(self, mock_rag_service_with_encoder):
+        """測試相同查詢第二次直接命中快取，新增案例後重新查詢"""
+        service, mock_collection = mock_rag_service_with_encoder
+        
+        mock_collection.aggregate.return_value = [
+            {"content": "案例", "metadata": {"final_decision": "核准_PASS"}, "score": 0.85}
+        ]
+        mock_collection.insert_one.return_value = MagicMock(inserted_id="case_002")
+        
+        first = service.search_similar_cases(query_text="工程師，月薪8萬", top_k=3)
+        second = service.search_similar_cases(query_text="工程師，月薪8萬 ", top_k=3)
+        
+        assert first == second
+        assert mock_collection.aggregate.call_count == 1
+        assert service._encoder.encode.call_count == 1
+        
+        # 不同 top_k 視為不同查詢
+        service.search_similar_cases(query_text="工程師，月薪8萬", top_k=5)
+        assert mock_collection.aggregate.call_count == 2
+        
+        # 新增案例後快取失效
+        service.add_case(content="職業:工程師", metadata={})
+        service.search_similar_cases(query_text="工程師，月薪8萬", top_k=3)
+        assert mock_collection.aggregate.call_count == 3
+    
+    def test_search_cache_returns_copies_and_expires(self, mock_rag_service_with_encoder):
+        """測試快取命中時回傳副本，且超過 TTL 後 (含語意快取) 重新查詢，看得到其他 process 新增的案例"""
+        service, mock_collection = mock_rag_service_with_encoder
+        
+        mock_collection.aggregate.return_value = [
+            {"_id": "case_001", "content": "案例", "metadata": {"final_decision": "核准_PASS"}, "score": 0.85}
+        ]
+        mock_collection.find.return_value = [{"_id": "case_001", "embedding": [0.1] * 384}]
+        
+        with patch("services.rag_service.time.monotonic", return_value=1000.0):
+            first = service.search_similar_cases(query_text="工程師，月薪8萬", top_k=3)
+            first[0]["metadata"]["final_decision"] = "拒絕_REJECT"
+            first.clear()
+            
+            second = service.search_similar_cases(query_text="工程師，月薪8萬", top_k=3)
+            assert second[0]["metadata"]["final_decision"] == "核准_PASS"
+            assert mock_collection.aggregate.call_count == 1
+        
+        with patch("services.rag_service.time.monotonic", return_value=1000.0 + 121):
+            service.search_similar_cases(query_text="工程師，月薪8萬", top_k=3)
+            assert mock_collection.aggregate.call_count == 2
+    
+    def test_semantic_cache_hit(self, mock_rag_service_with_encoder):
+        """測試文字不同但 embedding 幾乎相同的查詢命中語意快取，score 以新查詢重算"""
+        service, mock_collection = mock_rag_service_with_encoder
+        
+        case_vector = [0.1] * 384
+        mock_collection.aggregate.return_value = [
+            {"_id": "case_001", "content": "案例", "metadata": {"final_decision": "核准_PASS"}, "score": 1.0}
+        ]
+        mock_collection.find.return_value = [{"_id": "case_001", "embedding": case_vector}]
+        paraphrase = np.array([[0.11] + [0.1] * 383], dtype=np.float32)
+        service._encoder.encode.side_effect = [
+            np.array([[0.1] * 384], dtype=np.float32),
+            paraphrase,
+            np.array([[0.1] * 192 + [-0.1] * 192], dtype=np.float32),
+        ]
+        
+        first = service.search_similar_cases(query_text="工程師，月薪8萬", top_k=3)
+        second = service.search_similar_cases(query_text="職業:工程師 薪水8萬", top_k=3)
+        
+        assert mock_collection.aggregate.call_count == 1
+        assert service._semantic_cache.stats()["hits"] == 1
+        
+        # embedding 只在未命中時依 _id 另外查詢一次，Vector Search 本身不帶回 embedding
+        mock_collection.find.assert_called_once_with({"_id": {"$in": ["case_001"]}}, {"embedding": 1})
+        pipeline = mock_collection.aggregate.call_args[0][0]
+        assert "embedding" not in pipeline[-1]["$project"]
+        
+        # _id 不會回傳給呼叫端；score 是新查詢與案例的 cosine 換算值
+        assert "_id" not in first[0] and "_id" not in second[0]
+        assert second[0]["content"] == first[0]["content"]
+        cos = float(paraphrase[0] @ case_vector) / (np.linalg.norm(paraphrase[0]) * np.linalg.norm(case_vector))
+        assert second[0]["score"] == pytest.approx((1 + cos) / 2, abs=1e-6)
+        assert second[0]["score"] < first[0]["score"]
+        
+        # 語意不同 (cosine = 0) 的查詢仍需查詢 Atlas
+        service.search_similar_cases(query_text="無業，想借錢週轉", top_k=3)
+        assert mock_collection.aggregate.call_count == 2
+    
+    def test_semantic_cache_numbers_not_shared(self, mock_rag_service_with_encoder):
+        """測試只差在數字的 profile (月薪3萬 vs 月薪30萬) 不共用語意快取"""
+        service, mock_collection = mock_rag_service_with_encoder
+        
+        mock_collection.aggregate.side_effect = [
+            [{"_id": "low", "content": "月薪3萬案例", "metadata": {}, "score": 0.9}],
+            [{"_id": "high", "content": "月薪30萬案例", "metadata": {}, "score": 0.9}],
+        ]
+        mock_collection.find.return_value = [
+            {"_id": "low", "embedding": [0.1] * 384},
+            {"_id": "high", "embedding": [0.1] * 384},
+        ]
+        
+        # _fake_encode 對任何文字都回傳同一個向量 (cosine = 1)
+        low = service.search_similar_cases(profile={"job": "工程師", "income": 30000}, top_k=3)
+        high = service.search_similar_cases(profile={"job": "工程師", "income": 300000}, top_k=3)
+        
+        assert mock_collection.aggregate.call_count == 2
+        assert service._semantic_cache.stats()["hits"] == 0
+        assert low[0]["content"] == "月薪3萬案例"
+        assert high[0]["content"] == "月薪30萬案例"
+    
+    def test_semantic_cache_skipped_without_case_vectors(self, mock_rag_service_with_encoder):
+        """測試取不到案例 embedding 時照常回傳結果，只是不放進語意快取"""
+        service, mock_collection = mock_rag_service_with_encoder
+        
+        mock_collection.aggregate.return_value = [
+            {"_id": "case_001", "content": "案例", "metadata": {}, "score": 0.9}
+        ]
+        mock_collection.find.side_effect = RuntimeError("connection reset")
+        
+        result = service.search_similar_cases(query_text="工程師，月薪8萬", top_k=3)
+        
+        assert [r["content"] for r in result] == ["案例"]
+        assert service._semantic_cache.get(np.full(384, 0.1, dtype=np.float32), 3, ("8",)) is None
+    
     def test_get_reference_for_decision(self, mock_rag_service_with_encoder):
         """測試取得 FRE 決策參考"""
         service, mock_collection = mock_rag_service_with_encoder
         
         mock_collection.aggregate.return_value = [
-            {"content": "案例1", "metadata": {"final_decision": "核准_PASS", "approved_amount": 500000}, "score": 0.9},
-            {"content": "案例2", "metadata": {"final_decision": "核准_PASS", "approved_amount": 600000}, "score": 0.85},
+            {"content": "案例1", "metadata": {"final_decision": "核准_PASS", "is_approved": True, "approved_amount": 500000}, "score": 0.9},
+            {"content": "案例2", "metadata": {"final_decision": "核准_PASS", "is_approved": True, "approved_amount": 600000}, "score": 0.85},
+            # 舊案例沒有 is_approved，以 final_decision 判斷
             {"content": "案例3", "metadata": {"final_decision": "拒絕_REJECT", "approved_amount": 0}, "score": 0.8}
         ]
         
@@ -261,8 +631,65 @@ class TestCaseLibraryCollection:
         assert "avg_approved_amount" in result
         assert "recommendation" in result
         
-        # 2/3 核准 = 66.7%
-        assert result["approval_rate"] == pytest.approx(0.667, rel=0.01)
+        # 2/3 核准：以整數計數精確比對
+        assert result["approved_count"] == 2
+        assert result["total_count"] == 3
+        assert result["approval_rate"] == 2 / 3
+        assert result["avg_approved_amount"] == pytest.approx(550000)
+
+    
+    def test_get_reference_for_decision_cached(self, mock_rag_service_with_encoder):
+        """測試相同 profile + 風險等級第二次直接取快取，過期或新增案例後重新查詢"""
+        service, mock_collection = mock_rag_service_with_encoder
+        
+        mock_collection.aggregate.return_value = [
+            {"content": "案例1", "metadata": {"final_decision": "核准_PASS", "approved_amount": 500000}, "score": 0.9}
+        ]
+        mock_collection.insert_one.return_value = MagicMock(inserted_id="case_003")
+        profile = {"job": "工程師", "income": 80000, "amount": 500000}
+        
+        first = service.get_reference_for_decision(profile=profile, dve_risk_level="LOW")
+        
+        with patch.object(service, "search_similar_cases", return_value=[]) as mock_search:
+            second = service.get_reference_for_decision(profile=dict(profile), dve_risk_level="LOW")
+            mock_search.assert_not_called()
+            
+            # 風險等級不同即為不同的 key
+            service.get_reference_for_decision(profile=profile, dve_risk_level="HIGH")
+            assert mock_search.call_count == 1
+        
+        assert second == first
+        
+        # 修改回傳結果 (含巢狀的案例) 不影響快取
+        first["similar_cases"][0]["metadata"]["approved_amount"] = 0
+        second["similar_cases"].clear()
+        third = service.get_reference_for_decision(profile=profile, dve_risk_level="LOW")
+        assert third["similar_cases"][0]["metadata"]["approved_amount"] == 500000
+        assert mock_collection.aggregate.call_count == 1
+        
+        # 新增案例後失效
+        service.add_case(content="職業:工程師", metadata={})
+        service.get_reference_for_decision(profile=profile, dve_risk_level="LOW")
+        assert mock_collection.aggregate.call_count == 2
+    
+    def test_ttl_cache_expiry(self):
+        """測試 TTL 快取過期與 LRU 淘汰"""
+        from services.rag_service import _TTLCache
+        
+        cache = _TTLCache(maxsize=2, ttl=60)
+        
+        with patch("services.rag_service.time.monotonic", return_value=1000.0):
+            cache.put("a", 1)
+            cache.put("b", 2)
+            assert cache.get("a") == 1
+            cache.put("c", 3)  # 淘汰最久未使用的 b
+            
+            assert cache.get("b") is None
+            assert len(cache) == 2
+        
+        with patch("services.rag_service.time.monotonic", return_value=1061.0):
+            assert cache.get("a") is None
+            assert cache.get("c") is None
 
 
 class TestRAGHelpers:
@@ -288,6 +715,17 @@ class TestRAGHelpers:
         assert "貸款金額:500000" in query
         assert "用途:購車" in query
     
+    def test_profile_to_query_partial(self):
+        """測試缺欄位時略過，用途可由 loan_purpose 提供"""
+        from services.rag_service import RAGService
+        
+        service = RAGService()
+        
+        query = service._profile_to_query({"job": "護理師", "income": None, "loan_purpose": "進修"})
+        
+        assert query == "職業:護理師，用途:進修"
+        assert service._profile_to_query({}) == ""
+    
     def test_normalize_phone(self):
         """測試電話正規化"""
         from services.rag_service import RAGService
@@ -298,45 +736,41 @@ class TestRAGHelpers:
         assert service._normalize_phone("0912 345 678") == "0912345678"
         assert service._normalize_phone("") == ""
         assert service._normalize_phone(None) == ""
+        assert service._normalize_phone("+886 (912) 345-678") == "886912345678"
+        assert service._normalize_phone(912345678) == "912345678"
+        # 擷取異常時可能拿到不可雜湊的值，仍應正常轉成字串處理
+        assert service._normalize_phone(["0912-345-678"]) == "0912345678"
 
 
 class TestBackwardCompatibility:
     """測試向下相容 API"""
     
-    def test_add_document_calls_add_user_record(self):
+    def test_add_document_calls_add_user_record(self, rag_mock_db, rag_mock_collections):
         """測試 add_document 等同於 add_user_record"""
-        with patch('services.rag_service.mongo_db') as mock_db:
-            mock_collection = MagicMock()
-            mock_db.get_collection.return_value = mock_collection
-            mock_collection.insert_one.return_value = MagicMock(inserted_id="test_id")
-            
-            from services.rag_service import RAGService
-            service = RAGService()
-            service._user_history = mock_collection
-            service._initialized = True
-            
-            result = service.add_document(
-                user_id="A123456789",
-                content="測試",
-                metadata={}
-            )
-            
-            assert result == "test_id"
+        from services.rag_service import RAGService
+        
+        rag_mock_collections["user_history"].insert_one.return_value = MagicMock(inserted_id="test_id")
+        service = RAGService(db=rag_mock_db, encoder=MagicMock())
+        
+        result = service.add_document(
+            user_id="A123456789",
+            content="測試",
+            metadata={}
+        )
+        
+        assert result == "test_id"
+        rag_mock_collections["case_library"].insert_one.assert_not_called()
     
-    def test_vector_search_calls_search_similar_cases(self):
+    def test_vector_search_calls_search_similar_cases(self, rag_mock_db, rag_mock_collections):
         """測試 vector_search 等同於 search_similar_cases"""
-        with patch('services.rag_service.mongo_db') as mock_db:
-            mock_collection = MagicMock()
-            mock_db.get_collection.return_value = mock_collection
-            mock_collection.aggregate.return_value = []
-            
-            from services.rag_service import RAGService
-            service = RAGService()
-            service._case_library = mock_collection
-            service._encoder = MagicMock()
-            service._encoder.encode.return_value = MagicMock(tolist=lambda: [0.1] * 384)
-            service._initialized = True
-            
-            result = service.vector_search("測試查詢", top_k=3)
-            
-            assert isinstance(result, list)
+        from services.rag_service import RAGService
+        
+        encoder = MagicMock()
+        encoder.encode.side_effect = _fake_encode
+        service = RAGService(db=rag_mock_db, encoder=encoder)
+        
+        result = service.vector_search("測試查詢", top_k=3)
+        
+        assert isinstance(result, list)
+        rag_mock_collections["case_library"].aggregate.assert_called_once()
+        rag_mock_collections["user_history"].aggregate.assert_not_called()
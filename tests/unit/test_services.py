@@ -77,32 +77,38 @@ class TestRAGService:
     
     def test_vector_search_pipeline(self):
         """測試向量搜尋 Pipeline 結構"""
+        from services.rag_service import build_vector_search_pipeline
+        
         query_vector = [0.1] * 384
         top_k = 3
         
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "vector_index",
-                    "path": "embedding",
-                    "queryVector": query_vector,
-                    "numCandidates": 100,
-                    "limit": top_k
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "content": 1,
-                    "metadata": 1,
-                    "score": {"$meta": "vectorSearchScore"}
-                }
-            }
-        ]
+        pipeline = build_vector_search_pipeline(query_vector, top_k)
         
         assert len(pipeline) == 2
         assert "$vectorSearch" in pipeline[0]
         assert pipeline[0]["$vectorSearch"]["limit"] == top_k
+        assert pipeline[0]["$vectorSearch"]["queryVector"] is query_vector
+        assert pipeline[1]["$project"]["score"] == {"$meta": "vectorSearchScore"}
+        
+        # 每次呼叫的 $vectorSearch stage 互相獨立，共用樣板不被修改
+        other = build_vector_search_pipeline([0.2] * 384, 5)
+        assert pipeline[0]["$vectorSearch"]["limit"] == top_k
+        assert other[0]["$vectorSearch"]["limit"] == 5
+        assert other[1] is pipeline[1]
+    
+    @pytest.mark.parametrize("top_k,expected", [
+        (3, 100),      # 下限
+        (10, 200),     # top_k × 20
+        (1000, 10000), # Atlas 上限
+    ])
+    def test_vector_search_num_candidates(self, top_k, expected):
+        """測試 numCandidates 隨 top_k 調整"""
+        from services.rag_service import build_vector_search_pipeline
+        
+        pipeline = build_vector_search_pipeline([0.1] * 384, top_k)
+        
+        assert pipeline[0]["$vectorSearch"]["numCandidates"] == expected
+        assert pipeline[0]["$vectorSearch"]["index"] == "vector_index"
     
     def test_get_user_history_by_id_query(self):
         """測試根據 ID 查詢的結構"""
@@ -164,6 +170,26 @@ class TestRAGServiceIntegration:
         
         for key in required_keys:
             assert key in rag_context
+        
+        # RagContext 轉回 prompt 用的 dict 應與上面的結構完全一致
+        from services.rag_service import RagContext
+        
+        context = RagContext.from_metadata({
+            "hist_job": "工程師",
+            "hist_purpose": "購車",
+            "hist_phone": "0912-345-678",
+            "default_record": "無",
+            "hist_company": "科技公司",
+            "hist_income": 70000,
+            "inquiry_count": 2,
+            "addr_change_count": 0
+        })
+        assert context.income == "70000"
+        assert context.as_dve_dict() == rag_context
+        
+        new_user = RagContext.new_user().as_dve_dict()
+        assert list(new_user) == list(rag_context)
+        assert new_user["檔案中紀錄職業"] == "無紀錄 (新戶)"
 
 
 class TestDatabaseConnectionHandling:
@@ -0,0 +1,47 @@
+"""
+text_utils 單元測試
+測試關鍵字比對
+"""
+
+import pytest
+
+from text_utils import KeywordSet
+
+
+class TestKeywordSet:
+    """關鍵字集合測試"""
+    
+    @pytest.mark.parametrize("text,expected", [
+        ("圖片傳不上去", True),
+        ("系統失敗", True),
+        ("我要補件", False),
+        ("", False),
+        (None, False),
+    ])
+    def test_matches(self, text, expected):
+        """測試是否包含任一關鍵字"""
+        keywords = KeywordSet(["傳不上", "失敗", "格式錯誤"])
+        
+        assert keywords.matches(text) is expected
+    
+    def test_first_prefers_longest(self):
+        """測試同一位置命中多個關鍵字時回傳最長者"""
+        keywords = KeywordSet(["多少", "多少錢"])
+        
+        assert keywords.first("請問要多少錢?") == "多少錢"
+        assert keywords.first("你好") is None
+    
+    def test_special_characters_escaped(self):
+        """測試關鍵字中的 regex 特殊字元會被跳脫"""
+        keywords = KeywordSet(["a+b", "(?)"])
+        
+        assert keywords.matches("1 a+b 2") is True
+        assert keywords.matches("aab") is False
+        assert keywords.first("問號(?)") == "(?)"
+    
+    def test_empty_set_never_matches(self):
+        """測試空集合不會匹配任何字串"""
+        keywords = KeywordSet([])
+        
+        assert len(keywords) == 0
+        assert keywords.matches("任何內容") is False
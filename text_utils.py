@@ -0,0 +1,48 @@
+"""
+文字處理工具
+各模組共用的關鍵字比對
+"""
+
+import re
+from typing import Iterable, Optional, Tuple
+
+
+class KeywordSet:
+    """
+    關鍵字集合 (子字串比對)
+
+    於 import 時把所有關鍵字編譯成單一 alternation regex，
+    判斷「query 是否包含任一關鍵字」只需一次 C 層掃描，
+    取代各處 any(kw in query for kw in keywords) 的 Python 迴圈。
+    """
+
+    __slots__ = ("words", "_pattern")
+
+    def __init__(self, words: Iterable[str]):
+        self.words: Tuple[str, ...] = tuple(words)
+
+        if self.words:
+            # 長字優先，first() 回傳的會是該位置最長的關鍵字
+            ordered = sorted(self.words, key=len, reverse=True)
+            self._pattern = re.compile("|".join(map(re.escape, ordered)))
+        else:
+            # 空集合: 永遠不匹配 (空 alternation 會匹配任何字串)
+            self._pattern = re.compile(r"(?!)")
+
+    def first(self, text: str) -> Optional[str]:
+        """回傳 text 中最先出現的關鍵字，沒有則回傳 None"""
+        if not text:
+            return None
+
+        match = self._pattern.search(text)
+        return match.group() if match else None
+
+    def matches(self, text: str) -> bool:
+        """text 是否包含任一關鍵字"""
+        return bool(text) and self._pattern.search(text) is not None
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __repr__(self) -> str:
+        return f"KeywordSet({self.words!r})"